@@ -36,6 +36,45 @@ else:
     FIRESTORE_DB = None
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Tiempo máximo por llamada a Gemini; al vencer se usa el resumen offline
+GEMINI_DEADLINE_SECONDS = float(os.environ.get("GEMINI_DEADLINE_SECONDS", "30"))
+# Hedging: segunda llamada si la primera supera el cuantil GEMINI_HEDGE_QUANTILE de latencia
+GEMINI_HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE_ENABLED", "False") == "True"
+GEMINI_HEDGE_QUANTILE = float(os.environ.get("GEMINI_HEDGE_QUANTILE", "0.95"))
+GEMINI_HEDGE_INITIAL_DELAY = float(os.environ.get("GEMINI_HEDGE_INITIAL_DELAY", "5"))
+GEMINI_HEDGE_MIN_DELAY = float(os.environ.get("GEMINI_HEDGE_MIN_DELAY", "1"))
+# Fracción máxima de llamadas que pueden duplicarse
+GEMINI_HEDGE_BUDGET = float(os.environ.get("GEMINI_HEDGE_BUDGET", "0.1"))
+# Llamadas a Gemini en vuelo por proceso; con todas ocupadas se usa el resumen offline
+GEMINI_MAX_WORKERS = int(os.environ.get("GEMINI_MAX_WORKERS", "8"))
+
+# Hilos usados para confirmar batches de escritura en Firestore
+FIRESTORE_WRITE_WORKERS = int(os.environ.get("FIRESTORE_WRITE_WORKERS", "8"))
+# Write-behind: análisis, historial y corridas van primero a un spool en la base local
+# y un hilo los confirma en Firestore en batches, con reintentos. Desactivado por
+# defecto: las cachés de respuestas se invalidan recién al confirmar, desde el
+# proceso que vacía el spool (requiere una caché compartida: CACHE_DIR o REDIS_CACHE_URL)
+FIRESTORE_WRITE_BEHIND = os.environ.get("FIRESTORE_WRITE_BEHIND", "False") == "True"
+FIRESTORE_SPOOL_FLUSH_INTERVAL = float(os.environ.get("FIRESTORE_SPOOL_FLUSH_INTERVAL", "1"))
+# Filas del spool por commit (cada análisis es un set; una corrida, 1 + un set por producto)
+FIRESTORE_SPOOL_BATCH_ROWS = int(os.environ.get("FIRESTORE_SPOOL_BATCH_ROWS", "100"))
+# Espera máxima entre reintentos mientras Firestore falla
+FIRESTORE_SPOOL_MAX_BACKOFF = float(os.environ.get("FIRESTORE_SPOOL_MAX_BACKOFF", "300"))
+# Segundos que un proceso intenta vaciar el spool al terminar; lo que quede lo envía el próximo flusher
+FIRESTORE_SPOOL_EXIT_TIMEOUT = float(os.environ.get("FIRESTORE_SPOOL_EXIT_TIMEOUT", "10"))
+
+# Retención del historial de análisis (product_analysis_history)
+HISTORY_KEEP_LAST = int(os.environ.get("HISTORY_KEEP_LAST", "50"))
+HISTORY_DOWNSAMPLE = os.environ.get("HISTORY_DOWNSAMPLE", "daily")
+HISTORY_COLLAPSE_IDENTICAL = os.environ.get("HISTORY_COLLAPSE_IDENTICAL", "True") == "True"
+# Límites absolutos: entradas más viejas que HISTORY_MAX_AGE_DAYS (fuera de las últimas
+# HISTORY_KEEP_LAST) y tope de entradas por producto; 0 desactiva cada uno
+HISTORY_MAX_AGE_DAYS = int(os.environ.get("HISTORY_MAX_AGE_DAYS", "365"))
+HISTORY_MAX_ENTRIES = int(os.environ.get("HISTORY_MAX_ENTRIES", "200"))
+# Segundos entre compactaciones automáticas; 0 desactiva el hilo
+HISTORY_COMPACTION_INTERVAL = int(os.environ.get("HISTORY_COMPACTION_INTERVAL", "0"))
+# Análisis recientes que forman la ventana de tendencia de cada producto (product_trends)
+TRENDS_WINDOW_SIZE = int(os.environ.get("TRENDS_WINDOW_SIZE", "10"))
 
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -59,6 +98,8 @@ CLOUD_FUNCTIONS_TIMEOUT = int(os.environ.get("CLOUD_FUNCTIONS_TIMEOUT", "10"))
 CLOUD_FUNCTIONS_AUTH_TOKEN = os.environ.get("CLOUD_FUNCTIONS_AUTH_TOKEN")
 CLOUD_FUNCTIONS_FUNCTION_NAME = os.environ.get("CLOUD_FUNCTIONS_FUNCTION_NAME", "api")
 CLOUD_FUNCTIONS_VERIFY_TLS = os.environ.get("CLOUD_FUNCTIONS_VERIFY_TLS", "True") == "True"
+# Respuestas de /resenas/producto/<id> que se guardan en memoria para GET condicionales (LRU)
+CLOUD_FUNCTIONS_PAYLOAD_CACHE_SIZE = int(os.environ.get("CLOUD_FUNCTIONS_PAYLOAD_CACHE_SIZE", "128"))
 CLOUD_FUNCTIONS_FALLBACK_BASE_URL = os.environ.get(
     "CLOUD_FUNCTIONS_FALLBACK_BASE_URL",
     "https://us-central1-figureverse-9b12e.cloudfunctions.net/api",
@@ -82,14 +123,93 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'feedback.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'feedback.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Origen de las lecturas del catálogo: "upstream" (Cloud Functions) o "mirror" (copia SQLite local)
+CATALOG_SOURCE = os.environ.get("CATALOG_SOURCE", "upstream")
+# Segundos entre refrescos incrementales del espejo; 0 desactiva el hilo
+CATALOG_MIRROR_REFRESH_INTERVAL = int(os.environ.get("CATALOG_MIRROR_REFRESH_INTERVAL", "0"))
+
+# Corridas de análisis particionadas: coordinador de leases ("firestore", "database" o "memory")
+ANALYSIS_SHARD_COORDINATOR = os.environ.get("ANALYSIS_SHARD_COORDINATOR", "firestore")
+# Segundos que un worker conserva un shard sin renovarlo antes de que otro pueda tomarlo
+ANALYSIS_SHARD_LEASE_SECONDS = int(os.environ.get("ANALYSIS_SHARD_LEASE_SECONDS", "120"))
+
+# Re-análisis incremental por eventos de reseñas (POST /api/eventos/resenas/). Sin token el endpoint responde 403
+REVIEW_EVENTS_TOKEN = os.environ.get("REVIEW_EVENTS_TOKEN", "")
+# Un producto se re-analiza tras estos segundos sin eventos nuevos...
+REVIEW_EVENTS_DEBOUNCE_SECONDS = int(os.environ.get("REVIEW_EVENTS_DEBOUNCE_SECONDS", "30"))
+# ...o, si siguen llegando, a lo sumo estos segundos después del primero
+REVIEW_EVENTS_MAX_DELAY_SECONDS = int(os.environ.get("REVIEW_EVENTS_MAX_DELAY_SECONDS", "300"))
+# Segundos entre revisiones de productos pendientes; 0 (o REVIEW_EVENTS_TOKEN vacío) desactiva el hilo
+REVIEW_EVENTS_POLL_SECONDS = int(os.environ.get("REVIEW_EVENTS_POLL_SECONDS", "10"))
+REVIEW_EVENTS_LEASE_SECONDS = int(os.environ.get("REVIEW_EVENTS_LEASE_SECONDS", "300"))
+
+# Perfilado bajo demanda (?profile=1 o X-Profile: 1). Sin token sólo pueden perfilar usuarios staff
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+PROFILING_DIR = os.environ.get("PROFILING_DIR", str(BASE_DIR / "profiles"))
+# Cantidad de perfiles que se conservan en disco
+PROFILING_KEEP = int(os.environ.get("PROFILING_KEEP", "50"))
+
+# Control de admisión de corridas de análisis y sincronizaciones masivas (por proceso)
+ADMISSION_HEAVY_GLOBAL_LIMIT = int(os.environ.get("ADMISSION_HEAVY_GLOBAL_LIMIT", "2"))
+ADMISSION_HEAVY_PER_CLIENT_LIMIT = int(os.environ.get("ADMISSION_HEAVY_PER_CLIENT_LIMIT", "1"))
+ADMISSION_HEAVY_QUEUE_SIZE = int(os.environ.get("ADMISSION_HEAVY_QUEUE_SIZE", "4"))
+# Segundos que una petición espera en la cola antes de responder 503
+ADMISSION_HEAVY_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_HEAVY_QUEUE_TIMEOUT", "30"))
+# Token bucket por cliente en /productos, /resenas y /resenas/producto; 0 desactiva el límite.
+# Los buckets se guardan en la caché de Django (ver CACHES más abajo)
+PROXY_RATE_PER_SECOND = float(os.environ.get("PROXY_RATE_PER_SECOND", "20"))
+PROXY_BURST = int(os.environ.get("PROXY_BURST", "40"))
+# Header con la IP del cliente que agrega el proxy de confianza (p. ej. X-Forwarded-For).
+# Vacío: se usa REMOTE_ADDR. Sólo configurarlo si todo el tráfico pasa por ese proxy
+TRUSTED_PROXY_HEADER = os.environ.get("TRUSTED_PROXY_HEADER", "")
+
+# Cache de respuestas (response_cache). Sin configurar se usa la caché por defecto de
+# Django (en memoria, por proceso). Con varios procesos que escriben en Firestore
+# (workers del servidor, comandos, flusher del spool) conviene una caché compartida para
+# que las invalidaciones lleguen a todos: REDIS_CACHE_URL (varias máquinas; requiere el
+# paquete redis) o CACHE_DIR (archivos, procesos de una misma máquina)
+REDIS_CACHE_URL = os.environ.get("REDIS_CACHE_URL", "")
+CACHE_DIR = os.environ.get("CACHE_DIR", "")
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": CACHE_DIR,
+            "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", "5000"))},
+        }
+    }
+# Vencimiento opcional de cada respuesta cacheada; vacío = sin vencimiento (sólo invalidación por generación)
+RESPONSE_CACHE_TTL = int(os.environ["RESPONSE_CACHE_TTL"]) if os.environ.get("RESPONSE_CACHE_TTL") else None
+
+# Compresión brotli/gzip de las respuestas de la API
+COMPRESSION_PATH_PREFIX = os.environ.get("COMPRESSION_PATH_PREFIX", "/api/")
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'feedback.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 ROOT_URLCONF = 'ai_reviews_api.urls'
 
 TEMPLATES = [
@@ -117,6 +237,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Varios procesos (workers de shards) escriben en la misma base
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_reviews_api.settings')
 
 application = get_wsgi_application()
+
+# Los hilos de fondo sólo corren en el servidor web, no en los comandos de manage.py
+from feedback.apps import start_background_workers  # noqa: E402
+
+start_background_workers()
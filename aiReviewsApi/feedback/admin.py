@@ -1,3 +1,49 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AnalysisShard, AnalysisShardRun, CatalogProduct, CatalogReview, CatalogSyncState, DirtyProduct, SpooledWrite
+
+
+@admin.register(CatalogProduct)
+class CatalogProductAdmin(admin.ModelAdmin):
+    list_display = ("product_id", "name", "refreshed_at")
+    search_fields = ("product_id", "name")
+
+
+@admin.register(CatalogReview)
+class CatalogReviewAdmin(admin.ModelAdmin):
+    list_display = ("review_key", "product_id", "rating", "created_at")
+    list_filter = ("rating",)
+    search_fields = ("product_id",)
+
+
+@admin.register(CatalogSyncState)
+class CatalogSyncStateAdmin(admin.ModelAdmin):
+    list_display = ("source", "content_hash", "refreshed_at")
+
+
+class AnalysisShardInline(admin.TabularInline):
+    model = AnalysisShard
+    fields = ("index", "status", "owner", "lease_expires_at", "attempts")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(AnalysisShardRun)
+class AnalysisShardRunAdmin(admin.ModelAdmin):
+    list_display = ("run_id", "num_shards", "rating_threshold", "status", "started_at")
+    list_filter = ("status",)
+    inlines = [AnalysisShardInline]
+
+
+@admin.register(DirtyProduct)
+class DirtyProductAdmin(admin.ModelAdmin):
+    list_display = ("product_id", "event_count", "first_event_at", "last_event_at", "claimed_until", "attempts")
+    search_fields = ("product_id",)
+
+
+@admin.register(SpooledWrite)
+class SpooledWriteAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "created_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("kind", "payload", "created_at", "attempts", "last_error")
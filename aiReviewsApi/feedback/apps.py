@@ -1,18 +1,52 @@
 from django.apps import AppConfig
+from django.conf import settings
 import threading
 
 
 _started = False
+_start_lock = threading.Lock()
 
 
-class FeedbackConfig(AppConfig):
-    name = "feedback"
+def _startup_analysis():
+    from .services.admission import heavy_controller
+    from .services.analysis_service import analyze_general_opinion_for_products
+    # Ocupa un lugar del límite global como cualquier corrida pedida por la API
+    with heavy_controller().admit("startup"):
+        analyze_general_opinion_for_products()
 
-    def ready(self):
-        global _started
+
+def start_background_workers():
+    """
+    Arranca los hilos de fondo (análisis inicial, compactación, refresco del
+    espejo, eventos de reseñas y flusher del spool). Lo llaman wsgi.py y
+    asgi.py, así que sólo corren en el proceso del servidor web: los comandos
+    de manage.py (workers de shards, migraciones, tests) no los inician.
+    """
+    global _started
+    with _start_lock:
         if _started:
             return
         _started = True
-        from .services.analysis_service import analyze_general_opinion_for_products
-        t = threading.Thread(target=analyze_general_opinion_for_products, daemon=True)
-        t.start()
+    t = threading.Thread(target=_startup_analysis, daemon=True)
+    t.start()
+    interval = getattr(settings, "HISTORY_COMPACTION_INTERVAL", 0)
+    if interval > 0:
+        from .services.history_retention import start_compaction_worker
+        start_compaction_worker(interval)
+    refresh_interval = getattr(settings, "CATALOG_MIRROR_REFRESH_INTERVAL", 0)
+    if refresh_interval > 0:
+        from .services.catalog_mirror import start_refresh_worker
+        start_refresh_worker(refresh_interval)
+    events_poll = getattr(settings, "REVIEW_EVENTS_POLL_SECONDS", 0)
+    # Sin token el endpoint rechaza los eventos, así que no hay nada que procesar
+    if events_poll > 0 and getattr(settings, "REVIEW_EVENTS_TOKEN", ""):
+        from .services.review_events import start_worker
+        start_worker(events_poll)
+    from .services import write_spool
+    if write_spool.enabled():
+        # Envía lo que haya quedado en el spool de una ejecución anterior
+        write_spool.start_flusher()
+
+
+class FeedbackConfig(AppConfig):
+    name = "feedback"
@@ -0,0 +1,70 @@
+import subprocess
+import sys
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback.services.analysis_service import AnalysisError, DEFAULT_RATING_THRESHOLD
+from feedback.services.sharding import (
+    COORDINATORS,
+    create_sharded_run,
+    get_coordinator,
+    run_shard_worker,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea una corrida de análisis particionada. Con --workers la ejecuta en esta máquina "
+        "(procesos con el coordinador firestore/database, hilos con memory); con 0 sólo la "
+        "registra para que la tomen workers externos (run_shard_worker)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", type=int, default=8)
+        parser.add_argument("--workers", type=int, default=0)
+        parser.add_argument("--threshold", type=int, default=DEFAULT_RATING_THRESHOLD)
+        parser.add_argument("--coordinator", choices=COORDINATORS, help="Por defecto ANALYSIS_SHARD_COORDINATOR")
+
+    def handle(self, *args, **options):
+        coordinator = get_coordinator(options["coordinator"])
+        try:
+            run = create_sharded_run(options["shards"], options["threshold"], coordinator=coordinator)
+        except AnalysisError as exc:
+            raise CommandError(str(exc))
+        run_id = run["run_id"]
+        self.stdout.write(f"Corrida {run_id}: {run['num_shards']} shards, {run['total_products']} productos")
+
+        workers = options["workers"]
+        if workers <= 0:
+            return
+        if options["coordinator"] == "memory":
+            # El coordinador en memoria sólo se comparte entre hilos del mismo proceso
+            errors = []
+
+            def work():
+                try:
+                    run_shard_worker(run_id, coordinator=coordinator)
+                except AnalysisError as exc:
+                    errors.append(exc)
+
+            threads = [threading.Thread(target=work) for _ in range(workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise CommandError(str(errors[0]))
+        else:
+            cmd = [sys.executable, str(settings.BASE_DIR / "manage.py"), "run_shard_worker", "--run-id", run_id]
+            if options["coordinator"]:
+                cmd += ["--coordinator", options["coordinator"]]
+            procs = [subprocess.Popen(cmd) for _ in range(workers)]
+            failed = sum(1 for p in procs if p.wait() != 0)
+            if failed:
+                self.stderr.write(f"{failed} workers terminaron con error; sus shards quedan para otro worker.")
+
+        shards = coordinator.list_shards(run_id)
+        done = sum(1 for s in shards if s["status"] == "done")
+        self.stdout.write(f"Shards terminados: {done}/{len(shards)}")
@@ -0,0 +1,64 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from feedback.middleware import brotli
+from feedback.renderers import FastJSONRenderer, RawJSON, orjson
+from feedback.services.cloud_functions_client import get_reviews_raw
+
+
+def _synthetic_reviews(n: int) -> bytes:
+    reviews = [
+        {
+            "id": i,
+            "id_producto": i % 500,
+            "calificacion": i % 5 + 1,
+            "comentario": "Muy buena figura, llegó bien embalada pero la pintura tiene detalles " * 2,
+            "fecha": "2024-05-%02dT12:00:00Z" % (i % 28 + 1),
+        }
+        for i in range(n)
+    ]
+    return json.dumps(reviews, ensure_ascii=False).encode()
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Compara CPU y bytes transferidos de los renderers JSON y la compresión para /api/resenas/."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reviews", type=int, default=20000, help="Reseñas sintéticas a generar")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--live", action="store_true", help="Usar la respuesta real de /resenas")
+
+    def handle(self, *args, **options):
+        body = get_reviews_raw() if options["live"] else _synthetic_reviews(options["reviews"])
+        data = json.loads(body)
+        repeat = options["repeat"]
+
+        drf = JSONRenderer()
+        fast = FastJSONRenderer()
+        rows = [
+            ("DRF JSONRenderer", _time(lambda: drf.render(data), repeat)),
+            ("FastJSONRenderer" + ("" if orjson else " (sin orjson)"), _time(lambda: fast.render(data), repeat)),
+            ("RawJSON passthrough", _time(lambda: fast.render(RawJSON(body)), repeat)),
+        ]
+        self.stdout.write(f"Payload: {len(data)} registros, {len(body)} bytes")
+        for name, seconds in rows:
+            self.stdout.write(f"  {name:<32} {seconds * 1000:9.2f} ms")
+
+        gz = gzip.compress(body, compresslevel=6)
+        self.stdout.write(f"  {'gzip':<32} {len(gz):>9} bytes ({len(gz) / len(body):.1%})")
+        if brotli is not None:
+            br = brotli.compress(body, quality=4)
+            self.stdout.write(f"  {'brotli q4':<32} {len(br):>9} bytes ({len(br) / len(body):.1%})")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from feedback.services.history_retention import (
+    RetentionPolicy,
+    compact_all_history,
+    compact_product_history,
+)
+
+
+class Command(BaseCommand):
+    help = "Aplica la política de retención al historial de análisis (product_analysis_history)."
+
+    def add_arguments(self, parser):
+        defaults = RetentionPolicy.from_settings()
+        parser.add_argument("--product-id", help="Compactar sólo este producto")
+        parser.add_argument("--keep-last", type=int, default=defaults.keep_last)
+        parser.add_argument(
+            "--downsample",
+            choices=["daily", "weekly", "none"],
+            default=defaults.downsample or "none",
+        )
+        parser.add_argument("--max-age-days", type=int, default=defaults.max_age_days, help="0 sin límite")
+        parser.add_argument("--max-entries", type=int, default=defaults.max_entries, help="0 sin límite")
+        parser.add_argument(
+            "--no-collapse",
+            action="store_true",
+            help="No colapsar entradas consecutivas con el mismo resumen",
+        )
+
+    def handle(self, *args, **options):
+        policy = RetentionPolicy(
+            keep_last=options["keep_last"],
+            downsample="" if options["downsample"] == "none" else options["downsample"],
+            collapse_identical=not options["no_collapse"],
+            max_age_days=options["max_age_days"],
+            max_entries=options["max_entries"],
+        )
+        if options["product_id"]:
+            deleted = compact_product_history(options["product_id"], policy)
+            self.stdout.write(f"Producto {options['product_id']}: {deleted} entradas borradas")
+            return
+        stats = compact_all_history(policy)
+        self.stdout.write(f"{stats['products']} productos revisados, {stats['deleted']} entradas borradas")
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback.services import exporter
+from feedback.services.firebase_client import EXPORT_SOURCES
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta análisis, historial o comentarios de Firestore en NDJSON, CSV o Parquet, "
+        "en una sola pasada y con memoria constante. Al terminar informa la marca para --since."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", choices=EXPORT_SOURCES, required=True)
+        parser.add_argument("--format", dest="fmt", choices=exporter.EXPORT_FORMATS, default="ndjson")
+        parser.add_argument("--since", help="Sólo documentos posteriores a esta fecha (ISO 8601)")
+        parser.add_argument("--output", default="-", help="Archivo de salida; '-' para stdout")
+
+    def handle(self, *args, **options):
+        stats = {}
+        try:
+            chunks = exporter.export(options["source"], options["fmt"], since=options["since"], stats=stats)
+        except exporter.ExportError as exc:
+            raise CommandError(str(exc))
+        if options["output"] == "-":
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+        else:
+            with open(options["output"], "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        # A stderr para no mezclarse con la exportación cuando sale por stdout
+        self.stderr.write(f"{stats.get('count', 0)} documentos; siguiente --since: {stats.get('watermark') or '-'}")
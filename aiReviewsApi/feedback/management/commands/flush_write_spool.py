@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback.services import write_spool
+
+
+class Command(BaseCommand):
+    help = "Envía a Firestore las escrituras pendientes del spool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requeue-dead",
+            action="store_true",
+            help="Volver a encolar las escrituras descartadas por errores permanentes",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_dead"]:
+            self.stdout.write(f"{write_spool.requeue_dead()} escrituras reencoladas")
+        try:
+            flushed = write_spool.flush()
+        except Exception as exc:
+            raise CommandError(f"Firestore no aceptó el batch: {exc!r}")
+        stats = write_spool.snapshot()
+        self.stdout.write(
+            f"{flushed} escrituras enviadas; quedan {stats['depth']} pendientes "
+            f"y {stats['dead_count']} descartadas"
+        )
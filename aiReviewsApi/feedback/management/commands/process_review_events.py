@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from feedback.services.review_events import process_dirty_products
+
+
+class Command(BaseCommand):
+    help = "Re-analiza los productos marcados por eventos de reseñas."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Procesar todos los pendientes sin esperar el debounce",
+        )
+        parser.add_argument("--limit", type=int, default=0, help="Máximo de productos en esta pasada")
+
+    def handle(self, *args, **options):
+        stats = process_dirty_products(force=options["force"], limit=options["limit"])
+        self.stdout.write(
+            f"{stats['analyzed']} analizados ({stats['still_dirty']} siguen pendientes), "
+            f"{stats['skipped']} sin reseñas, {stats['failed']} con error"
+        )
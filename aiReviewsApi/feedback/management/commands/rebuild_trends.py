@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from feedback.services.firebase_client import list_history_product_ids, rebuild_product_trend
+
+
+class Command(BaseCommand):
+    help = "Recalcula product_trends desde el historial (para productos analizados antes de existir las tendencias)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product-id", help="Recalcular sólo este producto")
+
+    def handle(self, *args, **options):
+        product_ids = [options["product_id"]] if options["product_id"] else list_history_product_ids()
+        rebuilt = sum(1 for pid in product_ids if rebuild_product_trend(pid) is not None)
+        self.stdout.write(f"{rebuilt} de {len(product_ids)} productos con tendencia recalculada")
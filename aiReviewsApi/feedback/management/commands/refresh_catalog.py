@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback.services.catalog_mirror import refresh_catalog_mirror
+from feedback.services.cloud_functions_client import CloudFunctionsError
+
+
+class Command(BaseCommand):
+    help = "Refresca de forma incremental el espejo SQLite de productos y reseñas."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Aplica también una respuesta vacía del origen (borra el espejo).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stats = refresh_catalog_mirror(force=options["force"])
+        except CloudFunctionsError as exc:
+            raise CommandError(f"Error al leer datos desde Cloud Functions: {exc}")
+        for source, counts in stats.items():
+            self.stdout.write(
+                f"{source}: {counts['created']} nuevos, {counts['updated']} actualizados, {counts['deleted']} borrados"
+            )
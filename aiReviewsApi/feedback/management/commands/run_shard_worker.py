@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback.services.analysis_service import AnalysisError
+from feedback.services.sharding import COORDINATORS, get_coordinator, run_shard_worker
+
+
+class Command(BaseCommand):
+    help = "Worker de una corrida de análisis particionada: toma shards con lease hasta que no queden."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--run-id", required=True)
+        parser.add_argument("--coordinator", choices=COORDINATORS, help="Por defecto ANALYSIS_SHARD_COORDINATOR")
+        parser.add_argument("--worker-id", help="Por defecto host-pid-aleatorio")
+        parser.add_argument("--lease-seconds", type=float)
+        parser.add_argument(
+            "--no-wait",
+            action="store_true",
+            help="Terminar cuando no haya shards libres, sin esperar leases de otros workers",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = run_shard_worker(
+                options["run_id"],
+                coordinator=get_coordinator(options["coordinator"]),
+                worker_id=options["worker_id"],
+                lease_seconds=options["lease_seconds"],
+                wait=not options["no_wait"],
+            )
+        except AnalysisError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            f"{result['worker_id']}: shards {result['shards']}, "
+            f"{result['analyzed_count']} productos analizados"
+            + (", registro final escrito" if result["finalized"] else "")
+        )
@@ -0,0 +1,127 @@
+import cProfile
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence, compress_string
+
+from .services import profiling
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él sólo se negocia gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_RE_ACCEPTS_BR = _lazy_re_compile(r"\bbr\b")
+_RE_ACCEPTS_GZIP = _lazy_re_compile(r"\bgzip\b")
+
+
+class CompressionMiddleware:
+    """
+    Comprime las respuestas de la API con brotli o gzip según Accept-Encoding.
+
+    Sólo actúa sobre rutas que empiezan con COMPRESSION_PATH_PREFIX y sobre
+    cuerpos de al menos COMPRESSION_MIN_BYTES. Las respuestas en streaming se
+    comprimen con gzip a medida que se generan.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.path_prefix = getattr(settings, "COMPRESSION_PATH_PREFIX", "/api/")
+        self.min_bytes = getattr(settings, "COMPRESSION_MIN_BYTES", 1024)
+        self.brotli_quality = getattr(settings, "COMPRESSION_BROTLI_QUALITY", 4)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not request.path.startswith(self.path_prefix):
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+        if not response.streaming and len(response.content) < self.min_bytes:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accept = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        use_br = brotli is not None and not response.streaming and _RE_ACCEPTS_BR.search(accept)
+        if not use_br and not _RE_ACCEPTS_GZIP.search(accept):
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers["Content-Length"]
+            encoding = "gzip"
+        else:
+            if use_br:
+                compressed = brotli.compress(response.content, quality=self.brotli_quality)
+                encoding = "br"
+            else:
+                compressed = compress_string(response.content)
+                encoding = "gzip"
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # El ETag fuerte describe el cuerpo sin comprimir
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Perfila con cProfile las peticiones marcadas con ?profile=1 o el header
+    X-Profile: 1 cuando el llamador está autorizado (PROFILING_TOKEN o staff).
+    El perfil se guarda en PROFILING_DIR y su id vuelve en X-Profile-Id.
+
+    cProfile admite un solo perfilador activo por proceso: si ya hay una
+    petición perfilándose, la nueva se atiende sin perfilar (X-Profile-Skipped).
+    """
+
+    _busy = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.wants_profile(request) or not profiling.is_authorized(request):
+            return self.get_response(request)
+        if not self._busy.acquire(blocking=False):
+            response = self.get_response(request)
+            response.headers["X-Profile-Skipped"] = "busy"
+            return response
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            try:
+                profile_id = profiling.save_profile(
+                    "request",
+                    {
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "duration_seconds": round(time.perf_counter() - started, 4),
+                    },
+                    profiler,
+                )
+            except OSError as exc:
+                # Disco lleno o PROFILING_DIR sin permisos: la petición ya se atendió
+                logger.warning("No se pudo guardar el perfil de %s: %s", request.path, exc)
+                response.headers["X-Profile-Skipped"] = "save-failed"
+                return response
+        finally:
+            self._busy.release()
+        response.headers["X-Profile-Id"] = profile_id
+        return response
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.JSONField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_key', models.CharField(max_length=64, unique=True)),
+                ('product_id', models.CharField(db_index=True, max_length=64, null=True)),
+                ('rating', models.FloatField(db_index=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True, null=True)),
+                ('payload', models.JSONField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['product_id', 'rating'], name='catalog_review_prod_rating'), models.Index(fields=['product_id', 'created_at'], name='catalog_review_prod_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisShardRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(max_length=64, unique=True)),
+                ('num_shards', models.PositiveIntegerField()),
+                ('rating_threshold', models.IntegerField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('total_products', models.PositiveIntegerField(default=0)),
+                ('started_at', models.CharField(max_length=40)),
+                ('status', models.CharField(default='running', max_length=16)),
+                ('finalized_by', models.CharField(blank=True, max_length=128, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalysisShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('status', models.CharField(default='pending', max_length=16)),
+                ('owner', models.CharField(blank=True, max_length=128, null=True)),
+                ('lease_expires_at', models.FloatField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='feedback.analysisshardrun')),
+            ],
+            options={
+                'ordering': ['index'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalysisShardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=64)),
+                ('entry', models.JSONField()),
+                ('shard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='feedback.analysisshard')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('shard', 'product_id'), name='analysis_shard_entry_product')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='analysisshard',
+            constraint=models.UniqueConstraint(fields=('run', 'index'), name='analysis_shard_run_index'),
+        ),
+    ]
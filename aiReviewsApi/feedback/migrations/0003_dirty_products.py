@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback', '0002_analysis_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=64, unique=True)),
+                ('first_event_at', models.DateTimeField()),
+                ('last_event_at', models.DateTimeField(db_index=True)),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'ordering': ['first_event_at'],
+            },
+        ),
+    ]
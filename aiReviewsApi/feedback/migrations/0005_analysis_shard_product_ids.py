@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback', '0004_write_spool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisshard',
+            name='product_ids',
+            field=models.JSONField(default=list),
+        ),
+    ]
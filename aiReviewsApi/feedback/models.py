@@ -1,3 +1,148 @@
 from django.db import models
 
-# Create your models here.
+
+class CatalogProduct(models.Model):
+    """Copia local de un producto de Cloud Functions (/productos)."""
+    product_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, null=True, blank=True)
+    payload = models.JSONField()
+    content_hash = models.CharField(max_length=64)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.name or ''}"
+
+
+class CatalogReview(models.Model):
+    """Copia local de una reseña de Cloud Functions (/resenas)."""
+    # ID de origen o, si no viene, hash del contenido
+    review_key = models.CharField(max_length=64, unique=True)
+    product_id = models.CharField(max_length=64, null=True, db_index=True)
+    rating = models.FloatField(null=True, db_index=True)
+    created_at = models.DateTimeField(null=True, db_index=True)
+    payload = models.JSONField()
+    content_hash = models.CharField(max_length=64)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["product_id", "rating"], name="catalog_review_prod_rating"),
+            models.Index(fields=["product_id", "created_at"], name="catalog_review_prod_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.review_key} ({self.product_id})"
+
+
+class CatalogSyncState(models.Model):
+    """Hash de la última respuesta de origen aplicada al espejo, por fuente."""
+    source = models.CharField(max_length=32, unique=True)
+    content_hash = models.CharField(max_length=64)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source}: {self.content_hash[:12]}"
+
+
+class AnalysisShardRun(models.Model):
+    """Corrida de análisis particionada coordinada desde la base local."""
+    run_id = models.CharField(max_length=64, unique=True)
+    num_shards = models.PositiveIntegerField()
+    rating_threshold = models.IntegerField()
+    fingerprint = models.CharField(max_length=64)
+    total_products = models.PositiveIntegerField(default=0)
+    started_at = models.CharField(max_length=40)
+    status = models.CharField(max_length=16, default="running")
+    finalized_by = models.CharField(max_length=128, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.run_id} ({self.status})"
+
+
+class AnalysisShard(models.Model):
+    """Partición de una corrida; un worker la toma con un lease que vence."""
+    run = models.ForeignKey(AnalysisShardRun, on_delete=models.CASCADE, related_name="shards")
+    index = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, default="pending")
+    owner = models.CharField(max_length=128, null=True, blank=True)
+    # Epoch en segundos
+    lease_expires_at = models.FloatField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    # Productos del shard fijados al crear la corrida
+    product_ids = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ["index"]
+        constraints = [
+            models.UniqueConstraint(fields=["run", "index"], name="analysis_shard_run_index"),
+        ]
+
+    def __str__(self):
+        return f"{self.run.run_id}#{self.index} ({self.status})"
+
+
+class AnalysisShardEntry(models.Model):
+    """Producto terminado dentro de un shard."""
+    shard = models.ForeignKey(AnalysisShard, on_delete=models.CASCADE, related_name="entries")
+    product_id = models.CharField(max_length=64)
+    entry = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["shard", "product_id"], name="analysis_shard_entry_product"),
+        ]
+
+
+class DirtyProduct(models.Model):
+    """
+    Producto con reseñas nuevas o modificadas pendiente de re-análisis.
+    Varios eventos del mismo producto se acumulan en una sola fila.
+    """
+    product_id = models.CharField(max_length=64, unique=True)
+    first_event_at = models.DateTimeField()
+    last_event_at = models.DateTimeField(db_index=True)
+    event_count = models.PositiveIntegerField(default=0)
+    # Mientras no venza, otro worker no lo toma (también se usa como espera tras un error)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ["first_event_at"]
+
+    def __str__(self):
+        return f"{self.product_id} ({self.event_count} eventos)"
+
+
+class SpooledWrite(models.Model):
+    """
+    Escritura a Firestore pendiente (write-behind). El flusher las envía en
+    orden de id; las que fallan con un error permanente quedan como "dead".
+    """
+    kind = models.CharField(max_length=32)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=8, default="pending", db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class SpoolFlushLease(models.Model):
+    """Lease que asegura un solo flusher por spool aunque haya varios procesos."""
+    name = models.CharField(max_length=32, unique=True)
+    owner = models.CharField(max_length=128, blank=True, default="")
+    # Epoch en segundos
+    expires_at = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.owner})"
@@ -0,0 +1,15 @@
+from rest_framework.permissions import BasePermission
+
+from .services import profiling
+
+
+class DiagnosticsPermission(BasePermission):
+    """
+    Acceso a /api/diagnostico/*: PROFILING_TOKEN en el header X-Profile-Token
+    o usuario staff (las mismas reglas que el perfilado bajo demanda).
+    """
+
+    message = "No autorizado."
+
+    def has_permission(self, request, view):
+        return profiling.is_authorized(request)
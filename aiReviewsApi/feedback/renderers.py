@@ -0,0 +1,39 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el encoder estándar de DRF
+    orjson = None
+
+
+class RawJSON:
+    """
+    Cuerpo JSON ya serializado (por ejemplo, la respuesta original de Cloud
+    Functions) que el renderer devuelve tal cual, sin decodificar ni re-codificar.
+    """
+    __slots__ = ("body",)
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer que deja pasar RawJSON sin tocarlo y, si orjson está
+    instalado, serializa el resto con orjson. Con indentación pedida (API
+    navegable) o tipos que orjson no soporta vuelve al renderer de DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, RawJSON):
+            return data.body
+        if data is None:
+            return b""
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Igual que DRF: U+2028/U+2029 escapados para ser un subconjunto válido de JavaScript
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
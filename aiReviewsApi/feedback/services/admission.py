@@ -0,0 +1,166 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from django.conf import settings
+
+
+class AdmissionRejected(Exception):
+    """
+    La petición no se admite. status es 429 (límite del cliente) o 503
+    (capacidad global y cola llenas); retry_after en segundos.
+    """
+
+    def __init__(self, status: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Límite de ejecuciones concurrentes, global y por cliente, con una cola
+    acotada. Cuando no hay lugar la petición espera en la cola hasta
+    queue_timeout segundos; si la cola también está llena se rechaza al
+    instante. Los límites son por proceso.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        global_limit: int,
+        per_client_limit: int,
+        queue_size: int,
+        queue_timeout: float,
+        default_retry_after: int = 30,
+    ):
+        self.name = name
+        self.global_limit = max(global_limit, 1)
+        self.per_client_limit = max(per_client_limit, 1)
+        self.queue_size = max(queue_size, 0)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._per_client: Dict[str, int] = {}
+        # Duración promedio (EWMA) de las ejecuciones, para estimar Retry-After
+        self._avg_seconds = float(default_retry_after)
+        self._stats = {"admitted": 0, "queued": 0, "rejected_client": 0, "rejected_full": 0, "rejected_timeout": 0}
+
+    def _retry_after(self) -> int:
+        # Tiempo aproximado hasta que se libere un lugar para cada petición en cola
+        slots_ahead = self._waiting // self.global_limit + 1
+        return max(1, math.ceil(self._avg_seconds * slots_ahead))
+
+    def _reject(self, kind: str, status: int, detail: str):
+        self._stats[kind] += 1
+        return AdmissionRejected(status, detail, self._retry_after())
+
+    @contextmanager
+    def admit(self, client_id: str):
+        """Ejecuta el bloque si hay capacidad; si no, lanza AdmissionRejected."""
+        with self._cond:
+            if self._per_client.get(client_id, 0) >= self.per_client_limit:
+                raise self._reject(
+                    "rejected_client", 429,
+                    f"Ya hay {self.per_client_limit} ejecuciones de {self.name} en curso para este cliente.",
+                )
+            if self._running >= self.global_limit:
+                if self._waiting >= self.queue_size:
+                    raise self._reject("rejected_full", 503, f"Capacidad de {self.name} agotada; reintentar más tarde.")
+                self._waiting += 1
+                self._stats["queued"] += 1
+                # El cliente cuenta desde que entra a la cola
+                self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._running >= self.global_limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._release_client(client_id)
+                            raise self._reject(
+                                "rejected_timeout", 503,
+                                f"No se liberó capacidad de {self.name} a tiempo; reintentar más tarde.",
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            else:
+                self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+            self._running += 1
+            self._stats["admitted"] += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._running -= 1
+                self._release_client(client_id)
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+                self._cond.notify()
+
+    def _release_client(self, client_id: str):
+        count = self._per_client.get(client_id, 0) - 1
+        if count > 0:
+            self._per_client[client_id] = count
+        else:
+            self._per_client.pop(client_id, None)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "global_limit": self.global_limit,
+                "per_client_limit": self.per_client_limit,
+                "queue_size": self.queue_size,
+                "avg_seconds": round(self._avg_seconds, 3),
+                **self._stats,
+            }
+
+
+def client_ip(request) -> str:
+    """
+    IP de origen. Detrás de un proxy de confianza (TRUSTED_PROXY_HEADER, por
+    ejemplo X-Forwarded-For) se usa la última dirección del header, que es la
+    que agregó ese proxy; las anteriores las puede inventar el cliente.
+    """
+    header = getattr(settings, "TRUSTED_PROXY_HEADER", "")
+    if header:
+        value = request.META.get("HTTP_" + header.upper().replace("-", "_"), "")
+        forwarded = [part.strip() for part in value.split(",") if part.strip()]
+        if forwarded:
+            return forwarded[-1]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def client_id(request) -> str:
+    """Usuario autenticado o, si no hay, la IP de origen."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{client_ip(request)}"
+
+
+_heavy: Optional[AdmissionController] = None
+_heavy_lock = threading.Lock()
+
+
+def heavy_controller() -> AdmissionController:
+    """Controlador compartido por los endpoints que disparan análisis o escrituras masivas."""
+    global _heavy
+    with _heavy_lock:
+        if _heavy is None:
+            _heavy = AdmissionController(
+                "análisis",
+                global_limit=getattr(settings, "ADMISSION_HEAVY_GLOBAL_LIMIT", 2),
+                per_client_limit=getattr(settings, "ADMISSION_HEAVY_PER_CLIENT_LIMIT", 1),
+                queue_size=getattr(settings, "ADMISSION_HEAVY_QUEUE_SIZE", 4),
+                queue_timeout=getattr(settings, "ADMISSION_HEAVY_QUEUE_TIMEOUT", 30),
+            )
+        return _heavy
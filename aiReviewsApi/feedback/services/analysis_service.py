@@ -1,13 +1,54 @@
-from typing import Dict, Any
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 from statistics import mean
 
+from django.db import DatabaseError
+
 from .cloud_functions_client import (
-    get_products,
-    get_all_reviews,
+    get_products_payload,
+    get_reviews_payload,
+    get_reviews_by_product,
     CloudFunctionsError,
 )
-from .firebase_client import save_product_analysis, append_product_analysis_history, save_analysis_run
-from .gemini_client import summarize_low_rating_reviews, summarize_general_opinion, GeminiError
+from .firebase_client import (
+    save_product_analysis,
+    append_product_analysis_history,
+    save_analysis_run,
+    get_analyzed_review_counts,
+    create_analysis_checkpoint,
+    record_checkpoint_product,
+    get_analysis_checkpoint,
+    find_resumable_checkpoint,
+    complete_analysis_checkpoint,
+)
+from .catalog_mirror import (
+    use_mirror,
+    refresh_catalog_mirror,
+    mirror_catalog,
+    mirror_product,
+    mirror_reviews_for_product,
+)
+from .gemini_client import summarize_product_reviews, estimate_tokens, GeminiError
+from .profiling import phase, phase_report, record_phases, save_profile
+from .records import Product, Review, normalize_products, normalize_reviews, group_reviews_by_product
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RATING_THRESHOLD = 3
+
+# Orden en que se procesan los productos de una corrida
+PRIORITY_POLICIES = (
+    "upstream",       # orden de Cloud Functions
+    "new_reviews",    # más reseñas nuevas desde el último análisis
+    "lowest_rating",  # peor calificación promedio primero
+    "most_reviews",   # mayor volumen de reseñas primero
+)
 
 
 class AnalysisError(Exception):
@@ -15,195 +56,380 @@ class AnalysisError(Exception):
     pass
 
 
-def analyze_products_with_low_ratings(rating_threshold: int) -> Dict[str, Any]:
-    """
-    Analiza productos que tengan reseñas con calificación <= rating_threshold.
-    Usa Cloud Functions para leer datos, Gemini para resumir y Firebase para guardar.
+class CheckpointError(AnalysisError):
+    """No se puede reanudar la corrida pedida."""
+    pass
 
-    Devuelve un dict con estadísticas globales:
-    {
-        "rating_threshold": ...,
-        "analyzed_products": ...,
-        "total_products": ...,
-    }
+
+class ProductNotFoundError(AnalysisError):
+    """El producto no existe o no tiene reseñas para analizar."""
+    pass
+
+
+def _fetch_catalog() -> Tuple[List[Product], Dict[str, List[Review]], str]:
+    """
+    Descarga productos y reseñas una sola vez (o los lee del espejo SQLite si
+    CATALOG_SOURCE="mirror") y agrupa las reseñas por producto.
+    Devuelve también la huella de la entrada (hash de ambas respuestas).
     """
+    if use_mirror():
+        refresh_error = None
+        # El refresco ya mide sus descargas (fetch) y su parseo (parse) por dentro
+        try:
+            refresh_catalog_mirror()
+        except (CloudFunctionsError, DatabaseError) as exc:
+            # Origen caído o refresco concurrente: se analiza la última copia local
+            refresh_error = exc
+            logger.warning("No se pudo refrescar el espejo; se usa la última copia: %s", exc)
+        with phase("fetch"):
+            products, all_reviews, snapshot = mirror_catalog()
+        if not products and refresh_error is not None:
+            raise AnalysisError(f"El espejo del catálogo está vacío y no se pudo refrescar: {refresh_error}")
+        with phase("group"):
+            reviews_by_product = group_reviews_by_product(all_reviews)
+        return products, reviews_by_product, snapshot
     try:
-        products = get_products()
-        all_reviews = get_all_reviews()
+        products_payload = get_products_payload()
+        reviews_payload = get_reviews_payload()
     except CloudFunctionsError as exc:
         # Reempaquetamos el error con un tipo propio
         raise AnalysisError(f"Error al leer datos desde Cloud Functions: {exc}")
+    with phase("parse"):
+        products = normalize_products(products_payload["data"])
+        all_reviews = normalize_reviews(reviews_payload["data"])
+    snapshot = products_payload["content_hash"] + reviews_payload["content_hash"]
+    with phase("group"):
+        reviews_by_product = group_reviews_by_product(all_reviews)
+    return products, reviews_by_product, snapshot
+
+
+def _fingerprint(snapshot: str, rating_threshold: int) -> str:
+    return hashlib.sha256(f"{snapshot}:{rating_threshold}".encode()).hexdigest()
+
+
+def _load_checkpoint(resume_run_id: Optional[str], resume: bool, fingerprint: str):
+    """Checkpoint a continuar (o None para empezar una corrida nueva)."""
+    if resume_run_id:
+        checkpoint = get_analysis_checkpoint(resume_run_id)
+        if checkpoint is None:
+            raise CheckpointError(f"No existe checkpoint para la corrida {resume_run_id}.")
+        if checkpoint.get("status") == "completed":
+            raise CheckpointError(f"La corrida {resume_run_id} ya terminó.")
+        if checkpoint.get("fingerprint") != fingerprint:
+            raise CheckpointError(
+                f"Los datos de entrada cambiaron desde la corrida {resume_run_id}; no se puede reanudar."
+            )
+        return checkpoint
+    if resume:
+        return find_resumable_checkpoint(fingerprint)
+    return None
+
+
+def _product_stats(product_reviews: List[Review], rating_threshold: int) -> Dict[str, Any]:
+    # Sólo cuentan para el promedio las reseñas con calificación numérica
+    rated_reviews = [r for r in product_reviews if r.rating is not None]
+    return {
+        "avg_rating": mean(r.rating for r in rated_reviews) if rated_reviews else 0.0,
+        "low_rating_reviews": [r for r in rated_reviews if r.rating <= rating_threshold],
+    }
 
-    # Indexamos reseñas por producto
-    reviews_by_product = {}
-    for r in all_reviews:
-        product_id = r.get("product_id") or r.get("id_producto")
-        if product_id is None:
-            continue
 
-        reviews_by_product.setdefault(product_id, []).append(r)
+def _analyze_product(
+    product: Product,
+    product_reviews: List[Review],
+    stats: Dict[str, Any],
+    rating_threshold: int,
+) -> Dict[str, Any]:
+    """
+    Genera ambos resúmenes (quejas y opinión general) de un producto con una
+    sola llamada a Gemini, y guarda un único documento de análisis y una
+    única entrada de historial. Devuelve el análisis guardado.
+    """
+    low_rating_reviews = stats["low_rating_reviews"]
+    try:
+        summaries = summarize_product_reviews(
+            product=product,
+            reviews=product_reviews,
+            low_rating_reviews=low_rating_reviews,
+            rating_threshold=rating_threshold,
+            avg_rating=stats["avg_rating"],
+            total_reviews=len(product_reviews),
+        )
+    except GeminiError as exc:
+        raise AnalysisError(f"Error al analizar producto {product.id}: {exc}")
+
+    analysis_data = {
+        "product_name": product.name,
+        "rating_threshold": rating_threshold,
+        "avg_rating": stats["avg_rating"],
+        "total_reviews": len(product_reviews),
+        "low_rating_reviews_count": len(low_rating_reviews),
+        # Sin reseñas malas no hay resumen de quejas
+        "summary": summaries["summary"],
+        "general_opinion": summaries["general_opinion"],
+    }
+    with phase("firestore_write"):
+        save_product_analysis(product.id, analysis_data)
+        append_product_analysis_history(product.id, analysis_data)
+    return analysis_data
+
+
+def run_entry(product: Product, analysis_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Entrada por producto que se guarda en checkpoints y shards."""
+    return {
+        "product_id": product.id,
+        "product_name": analysis_data["product_name"],
+        "summary": analysis_data["summary"],
+        "general_opinion": analysis_data["general_opinion"],
+    }
 
-    analyzed_count = 0
-    analyzed_names = []
-    summaries = []
 
-    # Suponemos que products es una lista de diccionarios con campo 'id' o 'id_producto'
-    for p in products:
-        product_id = p.get("id") or p.get("id_producto")
-        if product_id is None:
-            continue
+def build_run_results(entries: List[Dict[str, Any]], rating_threshold: int, total_products: int) -> Dict[str, Any]:
+    """Campos de resultados de un registro de analysis_runs a partir de las entradas por producto."""
+    return {
+        "rating_threshold": rating_threshold,
+        "analyzed_products": [e["product_name"] for e in entries if e.get("product_name")],
+        "analyzed_count": len(entries),
+        "total_products": total_products,
+        "summaries": [
+            {"product_id": e["product_id"], "product_name": e.get("product_name"), "summary": e["summary"]}
+            for e in entries if e.get("summary")
+        ],
+        "general_summaries": [
+            {"product_id": e["product_id"], "product_name": e.get("product_name"), "general_opinion": e.get("general_opinion")}
+            for e in entries
+        ],
+    }
 
-        product_reviews = reviews_by_product.get(product_id, [])
 
-        if not product_reviews:
-            # Si el producto no tiene reseñas, no lo analizamos
-            continue
+def _prioritize(candidates: List[tuple], priority: str) -> List[tuple]:
+    """Ordena (producto, reseñas, stats) según la política de prioridad."""
+    if priority == "lowest_rating":
+        return sorted(candidates, key=lambda c: c[2]["avg_rating"])
+    if priority == "most_reviews":
+        return sorted(candidates, key=lambda c: len(c[1]), reverse=True)
+    if priority == "new_reviews":
+        previous = get_analyzed_review_counts()
+        return sorted(
+            candidates,
+            key=lambda c: len(c[1]) - previous.get(c[0].key, 0),
+            reverse=True,
+        )
+    return candidates
+
+
+def analyze_products(
+    rating_threshold: int = DEFAULT_RATING_THRESHOLD,
+    budget_seconds: Optional[float] = None,
+    budget_tokens: Optional[int] = None,
+    priority: str = "upstream",
+    resume_run_id: Optional[str] = None,
+    resume: bool = False,
+    profile: bool = False,
+) -> Dict[str, Any]:
+    """
+    Pipeline único de análisis: descarga y agrupa el catálogo una vez y, por
+    cada producto con reseñas, genera el resumen de quejas (reseñas con
+    calificación <= rating_threshold) y la opinión general.
 
-        # Obtenemos el rating de cada reseña
-        ratings = []
-        for r in product_reviews:
-            rating_value = r.get("rating") or r.get("calificacion")
-            try:
-                # Intentamos convertir a float/int
-                ratings.append(float(rating_value))
-            except (TypeError, ValueError):
-                continue
+    - budget_seconds: tiempo máximo de la corrida (reloj de pared)
+    - budget_tokens: tokens de Gemini estimados como máximo
+    - priority: una de PRIORITY_POLICIES; define qué productos se procesan primero
 
-        if not ratings:
-            continue
+    - resume_run_id: continúa esa corrida desde su checkpoint
+    - resume: continúa la última corrida sin terminar con la misma entrada
 
-        avg_rating = mean(ratings)
-        total_reviews = len(ratings)
+    Al agotarse un presupuesto la corrida se detiene antes del siguiente
+    producto; los pendientes quedan en "deferred_products".
 
-        # Reseñas con mala calificación (<= threshold)
-        low_rating_reviews = [
-            r for r, rv in zip(product_reviews, ratings)
-            if rv <= rating_threshold
-        ]
+    - profile: mide el tiempo de cada fase (fetch, parse, group, prompt_build,
+      llm_wait, firestore_write); el desglose vuelve en "phases" y se guarda
+      en PROFILING_DIR.
 
-        if not low_rating_reviews:
-            # Si no hay reseñas malas, no tiene sentido generar resumen
-            continue
+    Cada producto terminado se registra en analysis_checkpoints/<run_id>, de
+    modo que una corrida interrumpida puede reanudarse sin repetir llamadas a
+    Gemini mientras la entrada (productos, reseñas y umbral) no cambie.
 
-        # Llamamos a Gemini para generar el resumen de reseñas malas
-        try:
-            summary = summarize_low_rating_reviews(
-                product=p,
-                low_rating_reviews=low_rating_reviews,
-                rating_threshold=rating_threshold,
-                avg_rating=avg_rating,
-                total_reviews=total_reviews,
+    Devuelve el registro de la corrida:
+    {
+        "rating_threshold": ...,
+        "analyzed_products": [...],
+        "analyzed_count": ...,
+        "total_products": ...,
+        "summaries": [...],          # productos con resumen de quejas
+        "general_summaries": [...],  # opinión general de cada producto analizado
+        "deferred_products": [...],  # IDs que quedaron fuera por presupuesto
+    }
+    """
+    options = dict(
+        rating_threshold=rating_threshold,
+        budget_seconds=budget_seconds,
+        budget_tokens=budget_tokens,
+        priority=priority,
+        resume_run_id=resume_run_id,
+        resume=resume,
+    )
+    if not profile:
+        return _run_analysis(**options)
+    started = time.monotonic()
+    with record_phases() as acc:
+        run = _run_analysis(**options)
+    report = phase_report(acc, time.monotonic() - started)
+    try:
+        report["profile_id"] = save_profile("analysis_run", {"run_id": run["run_id"], **report})
+    except OSError:
+        report["profile_id"] = None
+    run["phases"] = report
+    return run
+
+
+def _run_analysis(
+    rating_threshold: int,
+    budget_seconds: Optional[float],
+    budget_tokens: Optional[int],
+    priority: str,
+    resume_run_id: Optional[str],
+    resume: bool,
+) -> Dict[str, Any]:
+    if priority not in PRIORITY_POLICIES:
+        raise AnalysisError(f"Prioridad desconocida: {priority}")
+    started = time.monotonic()
+    products, reviews_by_product, snapshot = _fetch_catalog()
+    fingerprint = _fingerprint(snapshot, rating_threshold)
+
+    checkpoint = _load_checkpoint(resume_run_id, resume, fingerprint)
+    if checkpoint is not None:
+        run_id = checkpoint["run_id"]
+        started_at = checkpoint.get("started_at")
+        completed = {str(e.get("product_id")): e for e in checkpoint["products"]}
+    else:
+        run_id = uuid.uuid4().hex
+        started_at = datetime.utcnow().isoformat() + "Z"
+        completed = {}
+        with phase("firestore_write"):
+            create_analysis_checkpoint(run_id, {
+                "fingerprint": fingerprint,
+                "rating_threshold": rating_threshold,
+                "priority": priority,
+                "started_at": started_at,
+            })
+    resumed_count = len(completed)
+
+    candidates = []
+    with phase("group"):
+        for p in products:
+            product_reviews = reviews_by_product.get(p.key, [])
+            if not product_reviews:
+                # Si el producto no tiene reseñas, no lo analizamos
+                continue
+            candidates.append((p, product_reviews, _product_stats(product_reviews, rating_threshold)))
+    candidates = _prioritize(candidates, priority)
+
+    entries = []
+    deferred = []
+    stopped_reason = None
+    tokens_used = 0
+
+    for p, product_reviews, stats in candidates:
+        if p.key in completed:
+            # Terminado en una ejecución anterior de esta corrida
+            entries.append(completed[p.key])
+            continue
+        if stopped_reason is None and budget_seconds is not None and time.monotonic() - started >= budget_seconds:
+            stopped_reason = "time_budget"
+        tokens = 0
+        if stopped_reason is None and budget_tokens is not None:
+            tokens = estimate_tokens(
+                p, product_reviews, stats["low_rating_reviews"], rating_threshold, stats["avg_rating"]
             )
-        except GeminiError as exc:
-            # Podríamos registrar el error y continuar con otros productos
-            # Por ahora, lo propagamos
-            raise AnalysisError(f"Error al analizar producto {product_id}: {exc}")
-
-        analysis_data = {
-            "product_name": p.get("name") or p.get("nombre"),
-            "rating_threshold": rating_threshold,
-            "avg_rating": avg_rating,
-            "total_reviews": total_reviews,
-            "low_rating_reviews_count": len(low_rating_reviews),
-            "summary": summary,
-        }
-
-        save_product_analysis(product_id, analysis_data)
-        analyzed_count += 1
-        product_name = analysis_data["product_name"]
-        if product_name:
-            analyzed_names.append(product_name)
-        summaries.append({
-            "product_id": product_id,
-            "product_name": product_name,
-            "summary": summary,
-        })
-        append_product_analysis_history(product_id, analysis_data)
+            if tokens_used + tokens > budget_tokens:
+                stopped_reason = "token_budget"
+        if stopped_reason is not None:
+            deferred.append(p.id)
+            continue
 
+        analysis_data = _analyze_product(p, product_reviews, stats, rating_threshold)
+        tokens_used += tokens
+        entry = run_entry(p, analysis_data)
+        with phase("firestore_write"):
+            record_checkpoint_product(run_id, p.id, entry)
+        entries.append(entry)
+
+    # El registro final se arma a partir de las entradas del checkpoint
     run = {
-        "rating_threshold": rating_threshold,
-        "analyzed_products": analyzed_names,
-        "analyzed_count": analyzed_count,
-        "total_products": len(products),
-        "summaries": summaries,
+        "kind": "combined",
+        **build_run_results(entries, rating_threshold, len(products)),
+        "priority": priority,
+        "budget_seconds": budget_seconds,
+        "budget_tokens": budget_tokens,
+        "estimated_tokens": tokens_used if budget_tokens is not None else None,
+        "stopped_reason": stopped_reason,
+        "deferred_products": deferred,
+        "deferred_count": len(deferred),
+        "resumed_count": resumed_count,
+        "started_at": started_at,
+        "finished_at": datetime.utcnow().isoformat() + "Z",
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "run_id": run_id,
     }
     try:
-        save_analysis_run(run)
+        with phase("firestore_write"):
+            save_analysis_run(run, run_id=run_id)
+            complete_analysis_checkpoint(run_id)
     except Exception:
-        pass
-    result = run
+        # Los análisis por producto ya están guardados; la corrida queda reanudable desde el checkpoint
+        logger.exception("No se pudo guardar el registro de la corrida %s", run_id)
+    return run
 
-    return result
+
+def _product_reviews_upstream(product_id) -> List[Review]:
+    """Reseñas de /resenas/producto/<id>; la ruta responde 4xx si el producto no tiene reseñas."""
+    try:
+        return normalize_reviews(get_reviews_by_product(product_id))
+    except CloudFunctionsError as exc:
+        if exc.is_client_error:
+            return []
+        raise
 
 
-def analyze_general_opinion_for_products() -> Dict[str, Any]:
+def analyze_single_product(product_id, rating_threshold: int = DEFAULT_RATING_THRESHOLD) -> Dict[str, Any]:
+    """
+    Analiza un único producto: lee sólo sus reseñas (/resenas/producto/<id>
+    o el espejo), genera ambos resúmenes y guarda su documento de análisis y
+    una entrada de historial. No registra una corrida en analysis_runs.
+    """
+    key = str(product_id)
     try:
-        products = get_products()
-        all_reviews = get_all_reviews()
+        if use_mirror():
+            product = mirror_product(key)
+            product_reviews = mirror_reviews_for_product(key)
+        else:
+            # /productos se revalida con GET condicional; normalmente no se descarga de nuevo
+            product = next((p for p in normalize_products(get_products_payload()["data"]) if p.key == key), None)
+            product_reviews = _product_reviews_upstream(product_id) if product is not None else []
     except CloudFunctionsError as exc:
         raise AnalysisError(f"Error al leer datos desde Cloud Functions: {exc}")
+    if product is None:
+        raise ProductNotFoundError(f"No existe el producto {product_id}.")
+    # La ruta por producto puede devolver reseñas de otros productos si ignora el filtro
+    product_reviews = [r for r in product_reviews if r.product_id is None or r.product_key == key]
+    if not product_reviews:
+        raise ProductNotFoundError(f"El producto {product_id} no tiene reseñas.")
 
-    reviews_by_product = {}
-    for r in all_reviews:
-        product_id = r.get("product_id") or r.get("id_producto")
-        if product_id is None:
-            continue
-        reviews_by_product.setdefault(product_id, []).append(r)
+    stats = _product_stats(product_reviews, rating_threshold)
+    analysis_data = _analyze_product(product, product_reviews, stats, rating_threshold)
+    return {"product_id": product.id, **analysis_data}
 
-    analyzed_count = 0
-    analyzed_names = []
-    summaries = []
 
-    for p in products:
-        product_id = p.get("id") or p.get("id_producto")
-        if product_id is None:
-            continue
-        product_reviews = reviews_by_product.get(product_id, [])
-        if not product_reviews:
-            continue
-
-        ratings = []
-        for r in product_reviews:
-            rating_value = r.get("rating") or r.get("calificacion")
-            try:
-                ratings.append(float(rating_value))
-            except (TypeError, ValueError):
-                continue
-        avg_rating = mean(ratings) if ratings else 0.0
-        total_reviews = len(product_reviews)
+def analyze_products_with_low_ratings(rating_threshold: int, **run_options) -> Dict[str, Any]:
+    """
+    Analiza productos que tengan reseñas con calificación <= rating_threshold.
+    Usa el pipeline combinado, por lo que también actualiza la opinión general.
+    run_options se pasan a analyze_products (presupuestos y prioridad).
+    """
+    return analyze_products(rating_threshold, **run_options)
 
-        try:
-            summary = summarize_general_opinion(product=p, reviews=product_reviews)
-        except GeminiError as exc:
-            raise AnalysisError(f"Error al analizar producto {product_id}: {exc}")
-
-        analysis_data = {
-            "product_name": p.get("name") or p.get("nombre"),
-            "avg_rating": avg_rating,
-            "total_reviews": total_reviews,
-            "general_opinion": summary,
-        }
-
-        save_product_analysis(product_id, analysis_data)
-        analyzed_count += 1
-        product_name = analysis_data["product_name"]
-        if product_name:
-            analyzed_names.append(product_name)
-        summaries.append({
-            "product_id": product_id,
-            "product_name": product_name,
-            "general_opinion": summary,
-        })
-        append_product_analysis_history(product_id, analysis_data)
 
-    run = {
-        "analyzed_products": analyzed_names,
-        "analyzed_count": analyzed_count,
-        "total_products": len(products),
-        "general_summaries": summaries,
-    }
-    try:
-        save_analysis_run(run)
-    except Exception:
-        pass
-    return run
+def analyze_general_opinion_for_products(**run_options) -> Dict[str, Any]:
+    """Genera la opinión general de cada producto (y su resumen de quejas) con el umbral por defecto."""
+    return analyze_products(DEFAULT_RATING_THRESHOLD, **run_options)
@@ -0,0 +1,220 @@
+import base64
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+from .cloud_functions_client import get_products_payload, get_reviews_payload
+from .records import (
+    PRODUCT_ID_KEYS,
+    PRODUCT_NAME_KEYS,
+    PRODUCT_DESC_KEYS,
+    REVIEW_ID_KEYS,
+    REVIEW_PRODUCT_ID_KEYS,
+    REVIEW_RATING_KEYS,
+    REVIEW_COMMENT_KEYS,
+    REVIEW_DATE_KEYS,
+    normalize_products,
+    normalize_reviews,
+)
+
+
+# Nombres canónicos aceptados en fields= y sus equivalentes en la API de origen
+PRODUCT_FIELD_ALIASES = {
+    "id": PRODUCT_ID_KEYS,
+    "name": PRODUCT_NAME_KEYS,
+    "description": PRODUCT_DESC_KEYS,
+}
+REVIEW_FIELD_ALIASES = {
+    "id": REVIEW_ID_KEYS,
+    "product_id": REVIEW_PRODUCT_ID_KEYS,
+    "rating": REVIEW_RATING_KEYS,
+    "comment": REVIEW_COMMENT_KEYS,
+    "created_at": REVIEW_DATE_KEYS,
+}
+
+MAX_PAGE_SIZE = 500
+
+
+class CatalogQueryError(ValueError):
+    """Parámetros de consulta inválidos."""
+    pass
+
+
+def project_record(
+    record: Dict[str, Any],
+    fields: Optional[List[str]],
+    aliases: Dict[str, Sequence[str]],
+) -> Dict[str, Any]:
+    """Devuelve sólo fields del registro; los nombres canónicos se resuelven con aliases."""
+    if not fields:
+        return record
+    out = {}
+    for f in fields:
+        if f in record:
+            out[f] = record[f]
+            continue
+        for alt in aliases.get(f, ()):
+            if record.get(alt) is not None:
+                out[f] = record[alt]
+                break
+    return out
+
+
+def _timestamp(value) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class CatalogIndex:
+    """
+    Copia indexada de una respuesta de Cloud Functions.
+
+    Las posiciones de cada registro en la respuesta original sirven de
+    identificador interno: los índices guardan listas ordenadas de
+    posiciones por producto, calificación y fecha.
+    """
+
+    def __init__(self, version: str, records: List[Dict[str, Any]], aliases: Dict[str, Sequence[str]]):
+        self.version = version
+        self.records = records
+        self.aliases = aliases
+        self.by_product: Dict[str, List[int]] = {}
+        self.by_rating: List[tuple] = []
+        self.by_date: List[tuple] = []
+
+    def project(self, record: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+        return project_record(record, fields, self.aliases)
+
+
+def _build_products_index(payload) -> CatalogIndex:
+    products = normalize_products(payload["data"])
+    index = CatalogIndex(payload["content_hash"], [p.raw for p in products], PRODUCT_FIELD_ALIASES)
+    for pos, p in enumerate(products):
+        index.by_product.setdefault(p.key, []).append(pos)
+    return index
+
+
+def _build_reviews_index(payload) -> CatalogIndex:
+    reviews = normalize_reviews(payload["data"])
+    index = CatalogIndex(payload["content_hash"], [r.raw for r in reviews], REVIEW_FIELD_ALIASES)
+    for pos, r in enumerate(reviews):
+        if r.product_id is not None:
+            index.by_product.setdefault(r.product_key, []).append(pos)
+        if r.rating is not None:
+            index.by_rating.append((r.rating, pos))
+        ts = _timestamp(r.created_at)
+        if ts is not None:
+            index.by_date.append((ts, pos))
+    index.by_rating.sort()
+    index.by_date.sort()
+    return index
+
+
+_indexes: Dict[str, CatalogIndex] = {}
+_lock = threading.Lock()
+
+
+def _get_index(name: str, fetch, build) -> CatalogIndex:
+    """Reconstruye el índice sólo si cambió el hash de la respuesta de origen."""
+    payload = fetch()
+    with _lock:
+        index = _indexes.get(name)
+        if index is not None and index.version == payload["content_hash"]:
+            return index
+    index = build(payload)
+    with _lock:
+        _indexes[name] = index
+    return index
+
+
+def get_products_index() -> CatalogIndex:
+    return _get_index("products", get_products_payload, _build_products_index)
+
+
+def get_reviews_index() -> CatalogIndex:
+    return _get_index("reviews", get_reviews_payload, _build_reviews_index)
+
+
+def _range(sorted_pairs: List[tuple], low: Optional[float], high: Optional[float]) -> set:
+    lo = 0 if low is None else bisect_left(sorted_pairs, (low, -1))
+    hi = len(sorted_pairs) if high is None else bisect_right(sorted_pairs, (high, float("inf")))
+    return {pos for _, pos in sorted_pairs[lo:hi]}
+
+
+def encode_cursor(position: int) -> str:
+    return base64.urlsafe_b64encode(str(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise CatalogQueryError("cursor inválido.")
+
+
+def query_index(
+    index: CatalogIndex,
+    product_id=None,
+    fields: Optional[List[str]] = None,
+    rating_min: Optional[float] = None,
+    rating_max: Optional[float] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    cursor: Optional[str] = None,
+) -> Dict[str, object]:
+    """
+    Filtra, pagina y proyecta los registros del índice.
+
+    Los resultados mantienen el orden original de Cloud Functions. Con cursor
+    se continúa después del último registro devuelto (ignora page).
+    """
+    if page_size <= 0:
+        page_size = 20
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    if page <= 0:
+        page = 1
+
+    if product_id is not None:
+        positions = index.by_product.get(str(product_id), [])
+    else:
+        positions = range(len(index.records))
+
+    selected = None
+    if rating_min is not None or rating_max is not None:
+        selected = _range(index.by_rating, rating_min, rating_max)
+    if date_from or date_to:
+        start, end = _timestamp(date_from), _timestamp(date_to)
+        if (date_from and start is None) or (date_to and end is None):
+            raise CatalogQueryError("from/to deben ser fechas ISO 8601.")
+        by_date = _range(index.by_date, start, end)
+        selected = by_date if selected is None else selected & by_date
+    if selected is not None:
+        positions = [pos for pos in positions if pos in selected]
+    else:
+        positions = list(positions)
+
+    if cursor:
+        after = decode_cursor(cursor)
+        start_idx = bisect_right(positions, after)
+    else:
+        start_idx = (page - 1) * page_size
+    window = positions[start_idx:start_idx + page_size]
+    has_more = start_idx + page_size < len(positions)
+
+    return {
+        "count": len(positions),
+        "page": None if cursor else page,
+        "page_size": page_size,
+        "next_cursor": encode_cursor(window[-1]) if window and has_more else None,
+        "results": [index.project(index.records[pos], fields) for pos in window],
+    }
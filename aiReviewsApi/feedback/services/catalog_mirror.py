@@ -0,0 +1,254 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import CatalogProduct, CatalogReview, CatalogSyncState
+from .catalog_index import (
+    CatalogQueryError,
+    MAX_PAGE_SIZE,
+    PRODUCT_FIELD_ALIASES,
+    REVIEW_FIELD_ALIASES,
+    decode_cursor,
+    encode_cursor,
+    project_record,
+)
+from .cloud_functions_client import get_products_payload, get_reviews_payload
+from .records import Product, Review, normalize_product, normalize_products, normalize_review, normalize_reviews
+
+
+logger = logging.getLogger(__name__)
+
+# El hilo de refresco y el refresco previo a cada corrida no se pisan dentro del proceso
+_refresh_lock = threading.Lock()
+
+
+def use_mirror() -> bool:
+    """True si las lecturas del catálogo deben resolverse contra el espejo SQLite."""
+    return getattr(settings, "CATALOG_SOURCE", "upstream") == "mirror"
+
+
+def _record_hash(raw: dict) -> str:
+    return hashlib.sha1(json.dumps(raw, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when
+
+
+def _sync(
+    model, source: str, content_hash: str, rows: Dict[str, dict], key_field: str, force: bool = False
+) -> Dict[str, int]:
+    """
+    Aplica al espejo la diferencia con la respuesta de origen: inserta filas
+    nuevas, actualiza las que cambiaron de hash y borra las que ya no están.
+
+    Una respuesta vacía no vacía un espejo con datos (suele ser una falla del
+    origen, no un catálogo borrado) salvo con force=True. Tampoco se guarda
+    su hash, así que el próximo refresco la vuelve a evaluar.
+    """
+    with transaction.atomic():
+        # Se lee dentro de la transacción; si otro proceso inserta las mismas
+        # claves entre medio, update_conflicts convierte el insert en update
+        existing = dict(model.objects.values_list(key_field, "content_hash"))
+        if not rows and existing and not force:
+            logger.warning(
+                "El origen devolvió %s vacío; se conservan las %d filas del espejo", source, len(existing)
+            )
+            return {"created": 0, "updated": 0, "deleted": 0}
+        to_create = []
+        to_update = []
+        for key, fields in rows.items():
+            old_hash = existing.pop(key, None)
+            if old_hash is None:
+                to_create.append(model(**{key_field: key}, **fields))
+            elif old_hash != fields["content_hash"]:
+                to_update.append((key, fields))
+
+        if to_create:
+            model.objects.bulk_create(
+                to_create,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=[key_field],
+                update_fields=list(next(iter(rows.values())).keys()) + ["refreshed_at"],
+            )
+        if to_update:
+            objs = {
+                getattr(o, key_field): o
+                for o in model.objects.filter(**{f"{key_field}__in": [k for k, _ in to_update]})
+            }
+            update_fields = list(to_update[0][1].keys())
+            for key, fields in to_update:
+                if key not in objs:
+                    # Otro proceso la borró mientras tanto
+                    continue
+                for name, value in fields.items():
+                    setattr(objs[key], name, value)
+            model.objects.bulk_update(list(objs.values()), update_fields, batch_size=500)
+        if existing:
+            model.objects.filter(**{f"{key_field}__in": list(existing)}).delete()
+        CatalogSyncState.objects.update_or_create(source=source, defaults={"content_hash": content_hash})
+    return {"created": len(to_create), "updated": len(to_update), "deleted": len(existing)}
+
+
+def _refresh_products(force: bool = False) -> Dict[str, int]:
+    payload = get_products_payload()
+    state = CatalogSyncState.objects.filter(source="products").first()
+    if state is not None and state.content_hash == payload["content_hash"]:
+        return {"created": 0, "updated": 0, "deleted": 0}
+    rows = {}
+    for p in normalize_products(payload["data"]):
+        rows[p.key] = {"name": p.name, "payload": p.raw, "content_hash": _record_hash(p.raw)}
+    return _sync(CatalogProduct, "products", payload["content_hash"], rows, "product_id", force)
+
+
+def _refresh_reviews(force: bool = False) -> Dict[str, int]:
+    payload = get_reviews_payload()
+    state = CatalogSyncState.objects.filter(source="reviews").first()
+    if state is not None and state.content_hash == payload["content_hash"]:
+        return {"created": 0, "updated": 0, "deleted": 0}
+    rows = {}
+    for r in normalize_reviews(payload["data"]):
+        record_hash = _record_hash(r.raw)
+        key = str(r.id) if r.id is not None else record_hash
+        rows[key] = {
+            "product_id": r.product_key if r.product_id is not None else None,
+            "rating": r.rating,
+            "created_at": _parse_datetime(r.created_at),
+            "payload": r.raw,
+            "content_hash": record_hash,
+        }
+    return _sync(CatalogReview, "reviews", payload["content_hash"], rows, "review_key", force)
+
+
+def refresh_catalog_mirror(force: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Refresco incremental del espejo. Usa los GET condicionales de
+    cloud_functions_client y no toca la base si el contenido no cambió.
+    force=True aplica también una respuesta vacía del origen (borra el espejo).
+    """
+    with _refresh_lock:
+        return {"products": _refresh_products(force), "reviews": _refresh_reviews(force)}
+
+
+def _refresh_loop(interval_seconds: int):
+    while True:
+        try:
+            refresh_catalog_mirror()
+        except Exception:
+            # Si el origen no responde se sigue sirviendo la última copia
+            logger.exception("Falló el refresco del espejo del catálogo")
+        time.sleep(interval_seconds)
+
+
+def start_refresh_worker(interval_seconds: int) -> threading.Thread:
+    t = threading.Thread(target=_refresh_loop, args=(interval_seconds,), daemon=True)
+    t.start()
+    return t
+
+
+# --- Lecturas ---
+
+def mirror_catalog() -> Tuple[List[Product], List[Review], str]:
+    """Productos, reseñas y huella (hashes de las fuentes aplicadas) desde el espejo."""
+    products = [normalize_product(p) for p in CatalogProduct.objects.values_list("payload", flat=True)]
+    reviews = [normalize_review(r) for r in CatalogReview.objects.values_list("payload", flat=True)]
+    hashes = dict(CatalogSyncState.objects.values_list("source", "content_hash"))
+    return products, reviews, hashes.get("products", "") + hashes.get("reviews", "")
+
+
+def mirror_payloads(kind: str) -> List[dict]:
+    """Registros originales de todos los productos o reseñas ("products"/"reviews") del espejo."""
+    model = CatalogProduct if kind == "products" else CatalogReview
+    return list(model.objects.order_by("id").values_list("payload", flat=True))
+
+
+def mirror_product(product_id) -> Optional[Product]:
+    payload = CatalogProduct.objects.filter(product_id=str(product_id)).values_list("payload", flat=True).first()
+    return normalize_product(payload) if payload is not None else None
+
+
+def mirror_reviews_for_product(product_id) -> List[Review]:
+    return [
+        normalize_review(r)
+        for r in CatalogReview.objects.filter(product_id=str(product_id)).values_list("payload", flat=True)
+    ]
+
+
+def has_product_reviews(product_id) -> bool:
+    return CatalogReview.objects.filter(product_id=str(product_id)).exists()
+
+
+def query_mirror(
+    kind: str,
+    product_id=None,
+    fields: Optional[List[str]] = None,
+    rating_min: Optional[float] = None,
+    rating_max: Optional[float] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    cursor: Optional[str] = None,
+) -> Dict[str, object]:
+    """
+    Misma interfaz y formato de respuesta que catalog_index.query_index, pero
+    resuelto con consultas indexadas sobre SQLite. kind es "products" o "reviews".
+    """
+    if page_size <= 0:
+        page_size = 20
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    if page <= 0:
+        page = 1
+
+    if kind == "products":
+        qs = CatalogProduct.objects.all()
+        aliases = PRODUCT_FIELD_ALIASES
+    else:
+        qs = CatalogReview.objects.all()
+        aliases = REVIEW_FIELD_ALIASES
+        if product_id is not None:
+            qs = qs.filter(product_id=str(product_id))
+        if rating_min is not None:
+            qs = qs.filter(rating__gte=rating_min)
+        if rating_max is not None:
+            qs = qs.filter(rating__lte=rating_max)
+        for value, lookup in ((date_from, "created_at__gte"), (date_to, "created_at__lte")):
+            if value:
+                when = _parse_datetime(value)
+                if when is None:
+                    raise CatalogQueryError("from/to deben ser fechas ISO 8601.")
+                qs = qs.filter(**{lookup: when})
+
+    total = qs.count()
+    if cursor:
+        qs = qs.filter(id__gt=decode_cursor(cursor))
+        offset = 0
+    else:
+        offset = (page - 1) * page_size
+    rows = list(qs.order_by("id").values_list("id", "payload")[offset:offset + page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    return {
+        "count": total,
+        "page": None if cursor else page,
+        "page_size": page_size,
+        "next_cursor": encode_cursor(rows[-1][0]) if rows and has_more else None,
+        "results": [project_record(payload, fields, aliases) for _, payload in rows],
+    }
@@ -1,7 +1,16 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
 import requests
 import certifi
 from django.conf import settings
 
+from .profiling import phase
+
 BASE_URL = settings.CLOUD_FUNCTIONS_BASE_URL
 FALLBACK_BASE_URL = getattr(settings, "CLOUD_FUNCTIONS_FALLBACK_BASE_URL", None)
 EMULATOR_BASE_URL = getattr(settings, "CLOUD_FUNCTIONS_EMULATOR_BASE_URL", None)
@@ -10,10 +19,71 @@ AUTH_TOKEN = getattr(settings, "CLOUD_FUNCTIONS_AUTH_TOKEN", None)
 FN = getattr(settings, "CLOUD_FUNCTIONS_FUNCTION_NAME", "api")
 PREFIX = f"/{FN}" if FN else ""
 VERIFY_TLS = getattr(settings, "CLOUD_FUNCTIONS_VERIFY_TLS", True)
+# Respuestas por producto que se conservan para revalidar (LRU); las del catálogo completo siempre
+PAYLOAD_CACHE_SIZE = getattr(settings, "CLOUD_FUNCTIONS_PAYLOAD_CACHE_SIZE", 128)
+
+PRODUCT_REVIEWS_PREFIX = f"{PREFIX}/resenas/producto/"
 
 
 class CloudFunctionsError(Exception):
-    pass
+    """Error al llamar a Cloud Functions; status_code es el HTTP del último intento, si hubo respuesta."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def is_client_error(self) -> bool:
+        return self.status_code is not None and 400 <= self.status_code < 500
+
+
+# Última respuesta de cada ruta con sus validadores (ETag, Last-Modified, hash).
+# /productos y /resenas en _payloads; /resenas/producto/<id> en un LRU acotado,
+# porque el id lo elige quien llama
+_payloads: Dict[str, Dict[str, Any]] = {}
+_product_payloads: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Métricas de transferencia por ruta (las rutas por producto se agrupan en una)
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def _cached_payload(path: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        if path.startswith(PRODUCT_REVIEWS_PREFIX):
+            entry = _product_payloads.get(path)
+            if entry is not None:
+                _product_payloads.move_to_end(path)
+            return entry
+        return _payloads.get(path)
+
+
+def _stats_key(path: str) -> str:
+    return PRODUCT_REVIEWS_PREFIX + "<id>" if path.startswith(PRODUCT_REVIEWS_PREFIX) else path
+
+
+def _new_stats():
+    return {
+        "requests": 0,
+        "not_modified": 0,
+        "hash_hits": 0,
+        "bytes_received": 0,
+        "bytes_saved": 0,
+        "parse_seconds": 0.0,
+        "parse_seconds_saved": 0.0,
+    }
+
+
+def _record(path: str, **deltas):
+    with _lock:
+        st = _stats.setdefault(_stats_key(path), _new_stats())
+        for k, v in deltas.items():
+            st[k] += v
+
+
+def get_transfer_stats() -> Dict[str, Dict[str, float]]:
+    """Métricas acumuladas por ruta: bytes y tiempo de parseo ahorrados por revalidación."""
+    with _lock:
+        return {path: dict(st) for path, st in _stats.items()}
 
 
 def _headers():
@@ -31,7 +101,79 @@ def _compose_url(base: str, path: str):
     return f"{base_trimmed}{path}"
 
 
-def _get_json(path: str):
+def _conditional_headers(cached):
+    h = _headers()
+    if cached is None:
+        return h
+    if cached.get("etag"):
+        h["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        h["If-Modified-Since"] = cached["last_modified"]
+    return h
+
+
+def _store_payload(path: str, response, body: bytes, content_hash: str, data, parse_seconds: float):
+    entry = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+        "body": body,
+        "data": data,
+        "parse_seconds": parse_seconds,
+    }
+    with _lock:
+        if path.startswith(PRODUCT_REVIEWS_PREFIX):
+            _product_payloads[path] = entry
+            _product_payloads.move_to_end(path)
+            while len(_product_payloads) > max(PAYLOAD_CACHE_SIZE, 0):
+                _product_payloads.popitem(last=False)
+        else:
+            _payloads[path] = entry
+    return entry
+
+
+def _resolve_payload(path: str, response, cached):
+    """
+    Convierte la respuesta HTTP en la entrada almacenada para path.
+
+    - 304: se reutiliza la copia local sin descargar ni parsear.
+    - 200 con el mismo hash que la copia local: se reutiliza sin parsear.
+    - 200 con contenido nuevo: se parsea y se guarda junto a sus validadores.
+    """
+    if response.status_code == 304 and cached is not None:
+        _record(
+            path,
+            requests=1,
+            not_modified=1,
+            bytes_saved=len(cached["body"]),
+            parse_seconds_saved=cached["parse_seconds"],
+        )
+        return cached
+
+    body = response.content
+    content_hash = hashlib.sha256(body).hexdigest()
+    if cached is not None and cached["content_hash"] == content_hash:
+        _record(
+            path,
+            requests=1,
+            hash_hits=1,
+            bytes_received=len(body),
+            parse_seconds_saved=cached["parse_seconds"],
+        )
+        return _store_payload(path, response, body, content_hash, cached["data"], cached["parse_seconds"])
+
+    started = time.perf_counter()
+    try:
+        with phase("parse"):
+            data = json.loads(body)
+    except ValueError as exc:
+        raise CloudFunctionsError(f"Respuesta JSON inválida en {path}: {exc}")
+    parse_seconds = time.perf_counter() - started
+    _record(path, requests=1, bytes_received=len(body), parse_seconds=parse_seconds)
+    return _store_payload(path, response, body, content_hash, data, parse_seconds)
+
+
+def _get_payload(path: str):
     bases = []
     if EMULATOR_BASE_URL:
         bases.append(EMULATOR_BASE_URL)
@@ -39,22 +181,37 @@ def _get_json(path: str):
     if FALLBACK_BASE_URL:
         bases.append(FALLBACK_BASE_URL)
 
+    cached = _cached_payload(path)
+
     last_exc = None
     for base in bases:
         url = _compose_url(base, path)
         is_emulator = base.startswith("http://localhost:") or base.startswith("http://127.0.0.1:")
         verify = False if is_emulator else (certifi.where() if VERIFY_TLS else False)
         try:
-            response = requests.get(url, headers=_headers(), timeout=TIMEOUT, verify=verify, allow_redirects=True)
+            with phase("fetch"):
+                response = requests.get(url, headers=_conditional_headers(cached), timeout=TIMEOUT, verify=verify, allow_redirects=True)
             if 500 <= response.status_code < 600:
                 raise requests.HTTPError(response=response)
             response.raise_for_status()
-            return response.json()
+            return _resolve_payload(path, response, cached)
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.SSLError, requests.HTTPError) as e:
             last_exc = e
             continue
 
-    raise CloudFunctionsError(str(last_exc) if last_exc else "Unknown error calling Cloud Functions")
+    status_code = None
+    if isinstance(last_exc, requests.HTTPError) and last_exc.response is not None:
+        status_code = last_exc.response.status_code
+    raise CloudFunctionsError(str(last_exc) if last_exc else "Unknown error calling Cloud Functions", status_code)
+
+
+def _get_json(path: str):
+    """
+    GET condicional: envía If-None-Match / If-Modified-Since con los
+    validadores de la última respuesta. El objeto devuelto puede ser la copia
+    compartida en memoria, por lo que no debe modificarse.
+    """
+    return _get_payload(path)["data"]
 
 
 def get_products():
@@ -71,3 +228,27 @@ def get_all_reviews():
 
 def get_reviews_by_product(product_id):
     return _get_json(f"{PREFIX}/resenas/producto/{product_id}")
+
+
+def get_products_payload() -> Dict[str, Any]:
+    """Última respuesta de /productos: {"data", "body", "content_hash", ...}."""
+    return _get_payload(f"{PREFIX}/productos")
+
+
+def get_reviews_payload() -> Dict[str, Any]:
+    """Última respuesta de /resenas: {"data", "body", "content_hash", ...}."""
+    return _get_payload(f"{PREFIX}/resenas")
+
+
+# Variantes que devuelven el cuerpo JSON original (bytes) para reenviarlo sin re-serializar
+
+def get_products_raw() -> bytes:
+    return _get_payload(f"{PREFIX}/productos")["body"]
+
+
+def get_reviews_raw() -> bytes:
+    return _get_payload(f"{PREFIX}/resenas")["body"]
+
+
+def get_reviews_by_product_raw(product_id) -> bytes:
+    return _get_payload(f"{PREFIX}/resenas/producto/{product_id}")["body"]
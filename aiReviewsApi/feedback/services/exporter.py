@@ -0,0 +1,226 @@
+import csv
+import io
+import json
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .firebase_client import EXPORT_SOURCES, iter_export_records
+from .records import normalize_review
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la librería estándar
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow es opcional: sin él no se ofrece Parquet
+    pyarrow = None
+
+
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Columnas de CSV y Parquet por fuente, con su tipo
+COLUMNS = {
+    "analyses": [
+        ("product_id", "string"),
+        ("product_name", "string"),
+        ("avg_rating", "float64"),
+        ("total_reviews", "int64"),
+        ("low_rating_reviews_count", "int64"),
+        ("rating_threshold", "int64"),
+        ("summary", "string"),
+        ("general_opinion", "string"),
+        ("last_analyzed_at", "string"),
+    ],
+    "history": [
+        ("id", "string"),
+        ("product_id", "string"),
+        ("created_at", "string"),
+        ("product_name", "string"),
+        ("avg_rating", "float64"),
+        ("total_reviews", "int64"),
+        ("low_rating_reviews_count", "int64"),
+        ("rating_threshold", "int64"),
+        ("summary", "string"),
+        ("general_opinion", "string"),
+    ],
+    "comments": [
+        ("id", "string"),
+        ("product_id", "string"),
+        ("review_id", "string"),
+        ("rating", "float64"),
+        ("comment", "string"),
+        ("created_at", "string"),
+    ],
+}
+
+# Fecha que usa since y que sirve de marca para la siguiente carga incremental
+WATERMARK_FIELDS = {"analyses": "last_analyzed_at", "history": "created_at", "comments": "created_at"}
+
+# Filas por row group de Parquet y tamaño aproximado de cada chunk enviado
+ROW_GROUP_SIZE = 5000
+CHUNK_BYTES = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Fuente o formato de exportación inválido."""
+    pass
+
+
+def validate(source: str, fmt: str):
+    if source not in EXPORT_SOURCES:
+        raise ExportError(f"La fuente debe ser una de: {', '.join(EXPORT_SOURCES)}.")
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"El formato debe ser uno de: {', '.join(EXPORT_FORMATS)}.")
+    if fmt == "parquet" and pyarrow is None:
+        raise ExportError("Parquet requiere pyarrow instalado.")
+
+
+def _row(source: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila plana con las columnas de source."""
+    if source == "comments":
+        # "id" es el ID del documento en Firestore; el de la reseña sale de los campos de origen
+        review = normalize_review({k: v for k, v in record.items() if k != "id"})
+        record = {
+            **record,
+            "review_id": record.get("review_id", review.id),
+            "rating": review.rating,
+            "comment": review.comment,
+        }
+    return {name: record.get(name) for name, _ in COLUMNS[source]}
+
+
+def _cast(value, kind: str):
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "float64":
+            return float(value)
+        if kind == "int64":
+            return int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(record, ensure_ascii=False, default=str).encode()
+
+
+def _buffered(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    """Agrupa piezas chicas en chunks de ~CHUNK_BYTES para la transferencia."""
+    buf = bytearray()
+    for piece in pieces:
+        buf += piece
+        if len(buf) >= CHUNK_BYTES:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+def iter_ndjson(records: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Un documento completo por línea."""
+    return _buffered(_dumps(r) + b"\n" for r in records)
+
+
+def iter_csv(source: str, records: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    names = [name for name, _ in COLUMNS[source]]
+
+    def lines():
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=names)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(_row(source, record))
+            yield out.getvalue().encode()
+            out.seek(0)
+            out.truncate()
+
+    return _buffered(lines())
+
+
+def write_parquet(source: str, records: Iterable[Dict[str, Any]], fileobj) -> int:
+    """
+    Escribe Parquet en fileobj por row groups de ROW_GROUP_SIZE filas, sin
+    juntar todas las filas en memoria. Devuelve la cantidad de filas.
+    """
+    columns = COLUMNS[source]
+    schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in columns])
+    total = 0
+    with pyarrow.parquet.ParquetWriter(fileobj, schema) as writer:
+        batch: List[Dict[str, Any]] = []
+
+        def flush():
+            table = pyarrow.Table.from_pydict(
+                {name: [_cast(row[name], kind) for row in batch] for name, kind in columns},
+                schema=schema,
+            )
+            writer.write_table(table)
+            batch.clear()
+
+        for record in records:
+            batch.append(_row(source, record))
+            total += 1
+            if len(batch) >= ROW_GROUP_SIZE:
+                flush()
+        if batch:
+            flush()
+    return total
+
+
+def iter_parquet(source: str, records: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Parquet lleva los metadatos al final del archivo, así que se escribe
+    primero en un archivo temporal (en memoria hasta 8 MB) y luego se envía
+    por chunks.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        write_parquet(source, records, spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def export(source: str, fmt: str, since: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """
+    Genera la exportación de source en fmt como chunks de bytes.
+
+    Si se pasa stats (dict), al terminar quedan en stats["count"] los
+    documentos exportados y en stats["watermark"] la fecha más reciente:
+    usarla como since en la próxima carga incremental.
+    """
+    validate(source, fmt)
+    field = WATERMARK_FIELDS[source]
+
+    def records():
+        count = 0
+        latest = since
+        for record in iter_export_records(source, since=since):
+            count += 1
+            latest = record.get(field) or latest
+            yield record
+        if stats is not None:
+            stats.update(count=count, watermark=latest)
+
+    if fmt == "ndjson":
+        return iter_ndjson(records())
+    if fmt == "csv":
+        return iter_csv(source, records())
+    return iter_parquet(source, records())
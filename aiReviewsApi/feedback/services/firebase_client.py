@@ -1,12 +1,33 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 from typing import Optional, List, Dict
 
+from . import response_cache, trends
+
 
 COLLECTION_NAME = "product_analysis"
 RUNS_COLLECTION = "analysis_runs"
 HISTORY_COLLECTION = "product_analysis_history"
+CHECKPOINTS_COLLECTION = "analysis_checkpoints"
+SHARDS_COLLECTION = "analysis_shards"
 COMMENTS_COLLECTION = "product_comments"
+TRENDS_COLLECTION = "product_trends"
+
+# Firestore admite hasta 500 escrituras por batch
+BATCH_MAX_WRITES = 500
+WRITE_WORKERS = getattr(settings, "FIRESTORE_WRITE_WORKERS", 8)
+
+
+def _timestamp(when: Optional[datetime] = None) -> str:
+    """
+    Fecha UTC (naive) en el formato con que se guardan created_at y
+    last_analyzed_at: ISO 8601 siempre con microsegundos y sufijo Z. Con un
+    ancho fijo la comparación de textos en Firestore sigue el orden de las fechas.
+    """
+    return (when or datetime.utcnow()).isoformat(timespec="microseconds") + "Z"
 
 
 def _get_collection():
@@ -26,27 +47,26 @@ def save_product_analysis(product_id, analysis_data: dict):
 
     - product_id: ID del producto (int o str)
     - analysis_data: diccionario con los campos del análisis
+
+    Con FIRESTORE_WRITE_BEHIND la escritura queda en el spool local y la
+    confirma el flusher en segundo plano.
     """
-    col = _get_collection()
-    if col is None:
+    if getattr(settings, "FIRESTORE_DB", None) is None:
         # Entorno sin Firebase configurado: no guardamos pero no rompemos
         return
-    doc_ref = col.document(str(product_id))
 
     # Siempre agregamos/actualizamos la fecha de último análisis
-    analysis_data["last_analyzed_at"] = datetime.utcnow().isoformat() + "Z"
-
-    # Usamos merge=True para no sobreescribir campos que no están en analysis_data
-    doc_ref.set(analysis_data, merge=True)
+    analysis_data["last_analyzed_at"] = _timestamp()
+    _write("product_analysis", {"product_id": str(product_id), "data": dict(analysis_data)})
 
 def append_product_analysis_history(product_id, analysis_entry: dict):
     db = getattr(settings, "FIRESTORE_DB", None)
     if db is None:
         return
-    doc = db.collection(HISTORY_COLLECTION).document(str(product_id))
-    runs_col = doc.collection("runs")
-    analysis_entry["created_at"] = datetime.utcnow().isoformat() + "Z"
-    runs_col.add(analysis_entry)
+    analysis_entry["created_at"] = _timestamp()
+    # ID fijo desde ahora: si el flusher reintenta no se duplica la entrada
+    entry_id = db.collection(HISTORY_COLLECTION).document().id
+    _write("analysis_history", {"product_id": str(product_id), "entry_id": entry_id, "data": dict(analysis_entry)})
 
 
 def get_product_analysis(product_id):
@@ -69,81 +89,231 @@ def get_product_analysis(product_id):
     data["product_id"] = product_id
     return data
 
-def list_product_analyses():
+def list_product_analyses(fields: Optional[List[str]] = None):
+    """
+    Análisis de todos los productos, del más reciente al más antiguo.
+    fields limita los campos descargados (proyección de Firestore).
+    """
     col = _get_collection()
     if col is None:
         return []
+    query = col.select(fields) if fields else col
+    query = query.order_by("last_analyzed_at", direction=firestore.Query.DESCENDING)
     results = []
-    for doc in col.stream():
+    for doc in query.stream():
         d = doc.to_dict() or {}
         d["product_id"] = doc.id
         results.append(d)
-    def _parse(ts):
-        if not ts:
-            return datetime.min
-        try:
-            return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        except Exception:
-            return datetime.min
-    results.sort(key=lambda x: _parse(x.get("last_analyzed_at")), reverse=True)
     return results
+
+def get_analyzed_review_counts() -> Dict[str, int]:
+    """
+    Devuelve {product_id: total_reviews} del último análisis de cada producto,
+    descargando sólo ese campo.
+    """
+    col = _get_collection()
+    if col is None:
+        return {}
+    counts = {}
+    for doc in col.select(["total_reviews"]).stream():
+        d = doc.to_dict() or {}
+        try:
+            counts[doc.id] = int(d.get("total_reviews") or 0)
+        except (TypeError, ValueError):
+            counts[doc.id] = 0
+    return counts
     
+# Campos que devuelve el listado de análisis
+ANALYSIS_LIST_FIELDS = [
+    "product_name",
+    "avg_rating",
+    "total_reviews",
+    "low_rating_reviews_count",
+    "rating_threshold",
+    "summary",
+    "general_opinion",
+    "last_analyzed_at",
+]
+
+
+def _normalize_page(page: int, page_size: int):
+    if page_size <= 0:
+        page_size = 20
+    if page <= 0:
+        page = 1
+    return page, page_size
+
+
+def _aggregate_count(query) -> int:
+    """Total de documentos con una agregación count() (no descarga los documentos)."""
+    return int(query.count().get()[0][0].value)
+
+
+def _get_docs_in_order(db, refs, field_paths=None):
+    """Lee varios documentos en una sola llamada y los devuelve en el orden de refs."""
+    if not refs:
+        return []
+    by_id = {d.id: d for d in db.get_all(refs, field_paths=field_paths) if d.exists}
+    return [by_id[r.id] for r in refs if r.id in by_id]
+
+
 def query_product_analyses(
     product_name_contains: Optional[str] = None,
     page: int = 1,
     page_size: int = 20,
 ) -> Dict[str, object]:
-    items = list_product_analyses()
+    """
+    Página de análisis ordenados por last_analyzed_at (más reciente primero).
+
+    Sin filtro, el orden y la paginación se resuelven en Firestore y el total
+    con count() sobre la misma consulta ordenada (order_by deja afuera los
+    documentos sin last_analyzed_at, así que tampoco se cuentan). Con filtro
+    por nombre (subcadena, que Firestore no soporta) se recorre una proyección
+    de esa consulta con sólo product_name y después se leen los documentos de
+    la página.
+    """
+    page, page_size = _normalize_page(page, page_size)
+    col = _get_collection()
+    if col is None:
+        return {"count": 0, "page": page, "page_size": page_size, "results": []}
+    db = settings.FIRESTORE_DB
     q = (product_name_contains or "").strip().lower()
-    if q:
-        items = [it for it in items if q in str(it.get("product_name") or "").lower()]
-    total = len(items)
-    if page_size <= 0:
-        page_size = 20
-    if page <= 0:
-        page = 1
     start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
+    ordered = col.order_by("last_analyzed_at", direction=firestore.Query.DESCENDING)
+
+    if not q:
+        query = ordered.select(ANALYSIS_LIST_FIELDS).offset(start_idx).limit(page_size)
+        docs = list(query.stream())
+        total = _aggregate_count(ordered)
+    else:
+        refs = []
+        for doc in ordered.select(["product_name", "last_analyzed_at"]).stream():
+            d = doc.to_dict() or {}
+            if q in str(d.get("product_name") or "").lower():
+                refs.append(doc.reference)
+        total = len(refs)
+        docs = _get_docs_in_order(db, refs[start_idx:start_idx + page_size], field_paths=ANALYSIS_LIST_FIELDS)
+
+    results = []
+    for doc in docs:
+        d = doc.to_dict() or {}
+        d["product_id"] = doc.id
+        results.append(d)
     return {
         "count": total,
         "page": page,
         "page_size": page_size,
-        "results": items[start_idx:end_idx],
+        "results": results,
     }
 
-def list_product_analysis_history(product_id):
+def list_product_analysis_history(product_id, fields: Optional[List[str]] = None):
+    """
+    Devuelve el historial completo de un producto, del más reciente al más antiguo.
+    Con fields sólo se descargan esos campos (además del ID del documento).
+    """
     db = getattr(settings, "FIRESTORE_DB", None)
     if db is None:
         return []
     runs = db.collection(HISTORY_COLLECTION).document(str(product_id)).collection("runs")
+    query = runs.select(fields) if fields else runs
+    query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
     out = []
-    for d in runs.stream():
+    for d in query.stream():
         v = d.to_dict() or {}
         v["id"] = d.id
         out.append(v)
-    def _parse(ts):
-        if not ts:
-            return datetime.min
-        try:
-            return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        except Exception:
-            return datetime.min
-    out.sort(key=lambda x: _parse(x.get("created_at")), reverse=True)
     return out
 
-def save_product_comments(product_id: int, comments: list[dict]):
+def query_product_analysis_history(product_id, page: int = 1, page_size: int = 20) -> Dict[str, object]:
+    """
+    Devuelve una página del historial sin recorrer la colección completa:
+    el orden, offset y límite se resuelven en Firestore y el total con count()
+    sobre la misma consulta ordenada que se pagina.
+    """
+    page, page_size = _normalize_page(page, page_size)
     db = getattr(settings, "FIRESTORE_DB", None)
     if db is None:
+        return {"count": 0, "page": page, "page_size": page_size, "results": []}
+    runs = db.collection(HISTORY_COLLECTION).document(str(product_id)).collection("runs")
+    ordered = runs.order_by("created_at", direction=firestore.Query.DESCENDING)
+    query = ordered.offset((page - 1) * page_size).limit(page_size)
+    results = []
+    for d in query.stream():
+        v = d.to_dict() or {}
+        v["id"] = d.id
+        results.append(v)
+    return {
+        "count": _aggregate_count(ordered),
+        "page": page,
+        "page_size": page_size,
+        "results": results,
+    }
+
+def list_history_product_ids() -> List[str]:
+    """IDs de los productos que tienen historial (incluye documentos padre sin campos)."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return []
+    return [ref.id for ref in db.collection(HISTORY_COLLECTION).list_documents()]
+
+def delete_product_analysis_history_entries(product_id, entry_ids: List[str]) -> int:
+    """Borra entradas del historial de un producto en batches; devuelve cuántas se borraron."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None or not entry_ids:
         return 0
-    doc = db.collection(COMMENTS_COLLECTION).document(str(product_id))
-    col = doc.collection("comments")
-    count = 0
-    for c in comments or []:
-        item = dict(c or {})
-        item["created_at"] = datetime.utcnow().isoformat() + "Z"
-        col.add(item)
-        count += 1
-    return count
+    runs = db.collection(HISTORY_COLLECTION).document(str(product_id)).collection("runs")
+    for start in range(0, len(entry_ids), BATCH_MAX_WRITES):
+        batch = db.batch()
+        for entry_id in entry_ids[start:start + BATCH_MAX_WRITES]:
+            batch.delete(runs.document(entry_id))
+        batch.commit()
+    response_cache.invalidate_product_history(product_id)
+    return len(entry_ids)
+
+def save_product_comments(product_id: int, comments: list[dict]):
+    saved = save_products_comments_bulk({product_id: comments})
+    return saved.get(str(product_id), 0)
+
+def save_products_comments_bulk(comments_by_product: Dict[object, list]) -> Dict[str, int]:
+    """
+    Guarda comentarios de varios productos usando batches de Firestore.
+
+    Los comentarios se reparten en lotes de hasta BATCH_MAX_WRITES escrituras
+    y los lotes se confirman en paralelo. Devuelve {product_id: guardados}.
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return {}
+    chunks = []
+    current = []
+    for product_id, comments in comments_by_product.items():
+        col = db.collection(COMMENTS_COLLECTION).document(str(product_id)).collection("comments")
+        for c in comments or []:
+            current.append((str(product_id), col, dict(c or {})))
+            if len(current) >= BATCH_MAX_WRITES:
+                chunks.append(current)
+                current = []
+    if current:
+        chunks.append(current)
+
+    def _commit(chunk):
+        batch = db.batch()
+        created_at = _timestamp()
+        for _, col, item in chunk:
+            item["created_at"] = created_at
+            batch.set(col.document(), item)
+        batch.commit()
+        return chunk
+
+    saved: Dict[str, int] = {str(pid): 0 for pid in comments_by_product}
+    if not chunks:
+        return saved
+    workers = max(1, min(WRITE_WORKERS, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in pool.map(_commit, chunks):
+            for pid, _, _ in chunk:
+                saved[pid] += 1
+    return saved
 
 def list_product_comments(product_id: int):
     db = getattr(settings, "FIRESTORE_DB", None)
@@ -151,20 +321,27 @@ def list_product_comments(product_id: int):
         return []
     col = db.collection(COMMENTS_COLLECTION).document(str(product_id)).collection("comments")
     out = []
-    for d in col.stream():
+    for d in col.order_by("created_at", direction=firestore.Query.DESCENDING).stream():
         v = d.to_dict() or {}
         v["id"] = d.id
         out.append(v)
-    def _parse(ts):
-        if not ts:
-            return datetime.min
-        try:
-            return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        except Exception:
-            return datetime.min
-    out.sort(key=lambda x: _parse(x.get("created_at")), reverse=True)
     return out
-    
+
+def _iso_bound(ts: Optional[str]) -> Optional[str]:
+    """
+    Convierte una fecha ISO 8601 al formato con que se guarda created_at
+    (ver _timestamp) para poder compararla en Firestore.
+    """
+    if not ts:
+        return None
+    try:
+        when = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return _timestamp(when)
+
 def query_product_comments(
     product_id: int,
     q: Optional[str] = None,
@@ -173,36 +350,50 @@ def query_product_comments(
     page: int = 1,
     page_size: int = 20,
 ) -> Dict[str, object]:
-    items = list_product_comments(product_id)
-    q_norm = (q or "").strip().lower()
-    def _parse2(ts):
-        if not ts:
-            return None
-        try:
-            return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        except Exception:
-            return None
-    start = _parse2(from_ts)
-    end = _parse2(to_ts)
-    filtered: List[Dict] = []
-    for it in items:
-        txt = (it.get("comment") or it.get("comentario") or "")
-        when = _parse2(it.get("created_at"))
-        if q_norm and q_norm not in str(txt).lower():
-            continue
-        if start and (not when or when < start):
-            continue
-        if end and (not when or when > end):
-            continue
-        filtered.append(it)
-    total = len(filtered)
-    if page_size <= 0:
-        page_size = 20
-    if page <= 0:
-        page = 1
+    """
+    Página de comentarios de un producto (más reciente primero).
+
+    El rango from/to se filtra en Firestore sobre created_at. Sin búsqueda de
+    texto, la página se pide con offset/limit y el total con count() sobre la
+    misma consulta filtrada y ordenada; con q
+    se recorre una proyección de los campos de texto y sólo se leen completos
+    los documentos de la página.
+    """
+    page, page_size = _normalize_page(page, page_size)
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return {"count": 0, "page": page, "page_size": page_size, "results": []}
+    col = db.collection(COMMENTS_COLLECTION).document(str(product_id)).collection("comments")
+
+    query = col
+    start = _iso_bound(from_ts)
+    end = _iso_bound(to_ts)
+    if start:
+        query = query.where(filter=FieldFilter("created_at", ">=", start))
+    if end:
+        query = query.where(filter=FieldFilter("created_at", "<=", end))
+    ordered = query.order_by("created_at", direction=firestore.Query.DESCENDING)
     start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-    results = filtered[start_idx:end_idx]
+
+    q_norm = (q or "").strip().lower()
+    if not q_norm:
+        docs = list(ordered.offset(start_idx).limit(page_size).stream())
+        total = _aggregate_count(ordered)
+    else:
+        refs = []
+        for doc in ordered.select(["comment", "comentario", "created_at"]).stream():
+            d = doc.to_dict() or {}
+            txt = d.get("comment") or d.get("comentario") or ""
+            if q_norm in str(txt).lower():
+                refs.append(doc.reference)
+        total = len(refs)
+        docs = _get_docs_in_order(db, refs[start_idx:start_idx + page_size])
+
+    results = []
+    for doc in docs:
+        v = doc.to_dict() or {}
+        v["id"] = doc.id
+        results.append(v)
     return {
         "count": total,
         "page": page,
@@ -210,30 +401,554 @@ def query_product_comments(
         "results": results,
     }
 
-def save_analysis_run(run_data: dict):
+# --- Exportación ---
+
+EXPORT_SOURCES = ("analyses", "history", "comments")
+EXPORT_CHUNK_SIZE = 500
+
+def iter_export_records(source: str, since: Optional[str] = None, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Recorre una colección completa en orden ascendente de fecha y genera un
+    dict por documento, con memoria constante.
+
+    - analyses: product_analysis, por last_analyzed_at
+    - history: todas las subcolecciones runs de product_analysis_history, por created_at
+    - comments: todas las subcolecciones comments de product_comments, por created_at
+
+    since deja sólo los documentos con fecha estrictamente posterior. Se lee
+    en páginas de chunk_size con start_after en lugar de un único stream
+    largo, que Firestore corta pasado un tiempo.
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    if source == "analyses":
+        query, field, parent = db.collection(COLLECTION_NAME), "last_analyzed_at", None
+    elif source == "history":
+        query, field, parent = db.collection_group("runs"), "created_at", HISTORY_COLLECTION
+    elif source == "comments":
+        query, field, parent = db.collection_group("comments"), "created_at", COMMENTS_COLLECTION
+    else:
+        raise ValueError(f"Fuente de exportación desconocida: {source}")
+
+    bound = _iso_bound(since)
+    if bound:
+        query = query.where(filter=FieldFilter(field, ">", bound))
+    query = query.order_by(field)
+
+    last = None
+    while True:
+        page = query.start_after(last) if last is not None else query
+        docs = list(page.limit(chunk_size).stream())
+        for doc in docs:
+            d = doc.to_dict() or {}
+            if parent is None:
+                d["product_id"] = doc.id
+                yield d
+                continue
+            product_ref = doc.reference.parent.parent
+            # Otra colección con una subcolección del mismo nombre
+            if product_ref is None or product_ref.parent.id != parent:
+                continue
+            # Igual que en los listados, "id" es el del documento
+            if "id" in d:
+                d.setdefault("review_id", d["id"])
+            d["id"] = doc.id
+            d["product_id"] = product_ref.id
+            yield d
+        if len(docs) < chunk_size:
+            return
+        last = docs[-1]
+
+
+# Campos livianos de cada corrida; el detalle por producto va en la subcolección "results"
+RUN_HEADER_FIELDS = [
+    "kind",
+    "rating_threshold",
+    "analyzed_count",
+    "total_products",
+    "results_count",
+    "started_at",
+    "finished_at",
+    "duration_seconds",
+    "priority",
+    "budget_seconds",
+    "budget_tokens",
+    "estimated_tokens",
+    "stopped_reason",
+    "deferred_count",
+    "resumed_count",
+    "num_shards",
+    "created_at",
+]
+RUN_RESULT_KEYS = ("summaries", "general_summaries")
+RUN_RESULTS_SUBCOLLECTION = "results"
+
+
+def _merge_run_results(run_data: dict) -> List[Dict]:
+    merged: Dict[str, Dict] = {}
+    for key in RUN_RESULT_KEYS:
+        for entry in run_data.get(key) or []:
+            pid = str(entry.get("product_id"))
+            merged.setdefault(pid, {}).update(entry)
+    return list(merged.values())
+
+
+def save_analysis_run(run_data: dict, run_id: Optional[str] = None):
+    """
+    Guarda una corrida como cabecera liviana + subcolección de resultados.
+
+    La cabecera sólo lleva contadores, umbral y tiempos; los resúmenes de cada
+    producto se escriben como documentos de "results" para no acercarse al
+    límite de 1 MiB por documento. Con run_id se usa ese ID de documento
+    (el mismo del checkpoint de la corrida).
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    results = _merge_run_results(run_data)
+    header = {
+        k: v for k, v in run_data.items()
+        if k not in RUN_RESULT_KEYS and k not in ("analyzed_products", "run_id")
+    }
+    header["results_count"] = len(results)
+    header["created_at"] = _timestamp()
+    run_id = run_id or db.collection(RUNS_COLLECTION).document().id
+    _write("analysis_run", {"run_id": run_id, "header": header, "results": results})
+    return run_id
+
+
+# --- Escrituras diferibles (write-behind, ver write_spool.py) ---
+# Cada tipo arma sus sets a partir de un payload JSON. Todos usan IDs de
+# documento fijos, así que reintentar un payload ya confirmado no duplica nada.
+
+def _product_analysis_writes(db, payload: dict):
+    ref = db.collection(COLLECTION_NAME).document(payload["product_id"])
+    # merge=True para no sobreescribir campos que no están en el análisis
+    return [(ref, payload["data"], True)]
+
+
+def _analysis_history_writes(db, payload: dict):
+    ref = (
+        db.collection(HISTORY_COLLECTION).document(payload["product_id"])
+        .collection("runs").document(payload["entry_id"])
+    )
+    return [(ref, payload["data"], False)]
+
+
+def _analysis_run_writes(db, payload: dict):
+    doc_ref = db.collection(RUNS_COLLECTION).document(payload["run_id"])
+    results_col = doc_ref.collection(RUN_RESULTS_SUBCOLLECTION)
+    writes = [(doc_ref, payload["header"], False)]
+    for entry in payload["results"]:
+        writes.append((results_col.document(str(entry.get("product_id"))), entry, False))
+    return writes
+
+
+def _analysis_run_written(payload: dict):
+    response_cache.invalidate_runs()
+    response_cache.invalidate_run_detail(payload["run_id"])
+
+
+# tipo -> (armar escrituras, invalidar cachés una vez confirmadas)
+DEFERRED_WRITES = {
+    "product_analysis": (
+        _product_analysis_writes,
+        lambda payload: response_cache.invalidate_product_analysis(payload["product_id"]),
+    ),
+    "analysis_history": (
+        _analysis_history_writes,
+        lambda payload: response_cache.invalidate_product_history(payload["product_id"]),
+    ),
+    "analysis_run": (_analysis_run_writes, _analysis_run_written),
+}
+
+
+def apply_writes(items: List[tuple]) -> int:
+    """
+    Confirma las escrituras de items [(tipo, payload)] juntas, en batches de
+    hasta BATCH_MAX_WRITES, y luego invalida las cachés. Las tendencias de
+    los productos con historial nuevo se actualizan después, una transacción
+    por producto. Devuelve la cantidad de sets. Si falla un batch o una
+    tendencia, lo anterior ya quedó confirmado: reintentar items completos
+    es seguro (los IDs son fijos y trends.fold ignora entradas repetidas).
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return 0
+    writes = []
+    for kind, payload in items:
+        build, _ = DEFERRED_WRITES[kind]
+        writes.extend(build(db, payload))
+    for start in range(0, len(writes), BATCH_MAX_WRITES):
+        batch = db.batch()
+        for ref, data, merge in writes[start:start + BATCH_MAX_WRITES]:
+            batch.set(ref, data, merge=merge)
+        batch.commit()
+    for kind, payload in items:
+        DEFERRED_WRITES[kind][1](payload)
+    return len(writes) + _update_trends(db, items)
+
+
+# --- Tendencias por producto (product_trends/<product_id>) ---
+# Estado acumulado que se actualiza con cada entrada nueva del historial, para
+# consultar tendencias sin recorrer product_analysis_history.
+
+TREND_ENTRY_FIELDS = ["product_name", "avg_rating", "total_reviews", "low_rating_reviews_count", "created_at"]
+
+
+@firestore.transactional
+def _fold_trend_in_transaction(transaction, trend_ref, product_id: str, entries: list) -> dict:
+    snapshot = trend_ref.get(transaction=transaction)
+    state = trends.fold(product_id, snapshot.to_dict() if snapshot.exists else None, entries)
+    transaction.set(trend_ref, state)
+    return state
+
+def _update_trends(db, items: List[tuple]) -> int:
+    """
+    Incorpora las entradas de historial de items a product_trends. Cada
+    producto se lee y escribe en una transacción: si otro proceso actualizó
+    la misma tendencia en el medio, Firestore la reintenta con el estado
+    nuevo en lugar de pisar sus puntos.
+    """
+    entries: Dict[str, list] = {}
+    for kind, payload in items:
+        if kind == "analysis_history":
+            entries.setdefault(payload["product_id"], []).append((payload["entry_id"], payload["data"]))
+    for product_id, product_entries in entries.items():
+        trend_ref = db.collection(TRENDS_COLLECTION).document(product_id)
+        _fold_trend_in_transaction(db.transaction(), trend_ref, product_id, product_entries)
+        response_cache.invalidate_product_trend(product_id)
+    return len(entries)
+
+
+def get_product_trend(product_id) -> Optional[dict]:
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    doc = db.collection(TRENDS_COLLECTION).document(str(product_id)).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def list_trend_movers(order: str = "movement", limit: int = 20) -> List[dict]:
+    """
+    Productos con mayor cambio según order (ver trends.MOVER_ORDERS). Ordena
+    por el campo guardado en Firestore, sin leer historiales ni ventanas.
+    """
     db = getattr(settings, "FIRESTORE_DB", None)
     if db is None:
+        return []
+    field, descending = trends.MOVER_ORDERS[order]
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = (
+        db.collection(TRENDS_COLLECTION)
+        .select(trends.TREND_SUMMARY_FIELDS)
+        .order_by(field, direction=direction)
+        .limit(limit)
+    )
+    return [d.to_dict() or {} for d in query.stream()]
+
+
+@firestore.transactional
+def _rebuild_trend_in_transaction(transaction, trend_ref, query, product_id: str) -> Optional[dict]:
+    # Se lee la tendencia para que un fold concurrente haga reintentar la reconstrucción
+    trend_ref.get(transaction=transaction)
+    entries = [(d.id, d.to_dict() or {}) for d in query.stream(transaction=transaction)]
+    if not entries:
         return None
-    run_data = dict(run_data)
-    run_data["created_at"] = datetime.utcnow().isoformat() + "Z"
-    ref, _ = db.collection(RUNS_COLLECTION).add(run_data)
-    return ref.id
+    state = trends.fold(product_id, None, entries)
+    transaction.set(trend_ref, state)
+    return state
+
+def rebuild_product_trend(product_id) -> Optional[dict]:
+    """Recalcula el estado de tendencia desde las últimas entradas del historial (backfill)."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    runs = db.collection(HISTORY_COLLECTION).document(str(product_id)).collection("runs")
+    query = (
+        runs.select(TREND_ENTRY_FIELDS)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .limit(trends.window_size())
+    )
+    trend_ref = db.collection(TRENDS_COLLECTION).document(str(product_id))
+    state = _rebuild_trend_in_transaction(db.transaction(), trend_ref, query, str(product_id))
+    if state is not None:
+        response_cache.invalidate_product_trend(product_id)
+    return state
+
+
+def _write(kind: str, payload: dict):
+    from . import write_spool
+
+    if write_spool.enabled():
+        write_spool.enqueue(kind, payload)
+    else:
+        apply_writes([(kind, payload)])
 
 def list_analysis_runs():
+    """Lista sólo las cabeceras de las corridas, de la más reciente a la más antigua."""
     db = getattr(settings, "FIRESTORE_DB", None)
     if db is None:
         return []
+    query = (
+        db.collection(RUNS_COLLECTION)
+        .select(RUN_HEADER_FIELDS)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+    )
     results = []
-    for d in db.collection(RUNS_COLLECTION).stream():
+    for d in query.stream():
         v = d.to_dict() or {}
         v["id"] = d.id
         results.append(v)
-    def _parse(ts):
-        if not ts:
-            return datetime.min
-        try:
-            return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        except Exception:
-            return datetime.min
-    results.sort(key=lambda x: _parse(x.get("created_at")), reverse=True)
     return results
+
+def get_analysis_run(run_id: str):
+    """
+    Devuelve la cabecera de una corrida junto con sus resultados por producto.
+    Las corridas antiguas (con los resúmenes embebidos) se devuelven con el mismo formato.
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    doc_ref = db.collection(RUNS_COLLECTION).document(str(run_id))
+    doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict() or {}
+    results = [d.to_dict() or {} for d in doc_ref.collection(RUN_RESULTS_SUBCOLLECTION).stream()]
+    if not results:
+        results = _merge_run_results(data)
+    for key in RUN_RESULT_KEYS + ("analyzed_products",):
+        data.pop(key, None)
+    data["id"] = doc.id
+    data["results"] = results
+    return data
+
+
+# --- Checkpoints de corridas (analysis_checkpoints/<run_id>/products/<product_id>) ---
+
+def create_analysis_checkpoint(run_id: str, data: dict):
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    data = dict(data)
+    data["status"] = "running"
+    data["completed_count"] = 0
+    data["updated_at"] = _timestamp()
+    db.collection(CHECKPOINTS_COLLECTION).document(run_id).set(data)
+
+def record_checkpoint_product(run_id: str, product_id, entry: dict):
+    """Registra un producto terminado y actualiza el contador del checkpoint en un mismo batch."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    doc_ref = db.collection(CHECKPOINTS_COLLECTION).document(run_id)
+    batch = db.batch()
+    batch.set(doc_ref.collection("products").document(str(product_id)), entry)
+    batch.update(doc_ref, {
+        "completed_count": firestore.Increment(1),
+        "updated_at": _timestamp(),
+    })
+    batch.commit()
+
+def get_analysis_checkpoint(run_id: str):
+    """Devuelve la cabecera del checkpoint con sus productos terminados en "products", o None."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    doc_ref = db.collection(CHECKPOINTS_COLLECTION).document(str(run_id))
+    doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict() or {}
+    data["run_id"] = doc.id
+    data["products"] = [d.to_dict() or {} for d in doc_ref.collection("products").stream()]
+    return data
+
+def find_resumable_checkpoint(fingerprint: str):
+    """Último checkpoint sin terminar con el mismo fingerprint de entrada, o None."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    query = (
+        db.collection(CHECKPOINTS_COLLECTION)
+        .where(filter=FieldFilter("fingerprint", "==", fingerprint))
+        .where(filter=FieldFilter("status", "==", "running"))
+        .select(["updated_at"])
+    )
+    latest_id, latest_ts = None, ""
+    for doc in query.stream():
+        ts = str((doc.to_dict() or {}).get("updated_at") or "")
+        if latest_id is None or ts > latest_ts:
+            latest_id, latest_ts = doc.id, ts
+    return get_analysis_checkpoint(latest_id) if latest_id else None
+
+def complete_analysis_checkpoint(run_id: str):
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    db.collection(CHECKPOINTS_COLLECTION).document(run_id).update({
+        "status": "completed",
+        "updated_at": _timestamp(),
+    })
+
+# --- Corridas particionadas (shards con lease) ---
+
+def create_shard_run(run_id: str, data: dict, product_ids: List[List[str]]):
+    """Crea la cabecera analysis_shards/<run_id> y sus shards pendientes con sus productos."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    doc_ref = db.collection(SHARDS_COLLECTION).document(run_id)
+    batch = db.batch()
+    batch.set(doc_ref, {**data, "num_shards": len(product_ids), "status": "running"})
+    for index, ids in enumerate(product_ids):
+        batch.set(doc_ref.collection("shards").document(str(index)), {
+            "index": index,
+            "status": "pending",
+            "owner": None,
+            "lease_expires_at": 0,
+            "attempts": 0,
+            "product_ids": list(ids),
+        })
+    batch.commit()
+
+def get_shard_run(run_id: str):
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    doc = db.collection(SHARDS_COLLECTION).document(str(run_id)).get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict() or {}
+    data["run_id"] = doc.id
+    return data
+
+@firestore.transactional
+def _claim_shard_in_transaction(transaction, shard_ref, worker_id: str, now: float, lease_seconds: float) -> bool:
+    snapshot = shard_ref.get(transaction=transaction)
+    d = snapshot.to_dict() or {}
+    if d.get("status") == "done":
+        return False
+    if d.get("status") == "leased" and float(d.get("lease_expires_at") or 0) > now:
+        return False
+    transaction.update(shard_ref, {
+        "status": "leased",
+        "owner": worker_id,
+        "lease_expires_at": now + lease_seconds,
+        "attempts": firestore.Increment(1),
+    })
+    return True
+
+def claim_shard(run_id: str, worker_id: str, lease_seconds: float, now: float):
+    """
+    Toma en una transacción el primer shard pendiente o con lease vencido.
+    Devuelve su índice, o None si no hay ninguno disponible.
+    """
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return None
+    shards = db.collection(SHARDS_COLLECTION).document(run_id).collection("shards")
+    for doc in shards.select(["status", "lease_expires_at"]).stream():
+        d = doc.to_dict() or {}
+        if d.get("status") == "done":
+            continue
+        if d.get("status") == "leased" and float(d.get("lease_expires_at") or 0) > now:
+            continue
+        if _claim_shard_in_transaction(db.transaction(), doc.reference, worker_id, now, lease_seconds):
+            return int(doc.id)
+    return None
+
+@firestore.transactional
+def _update_owned_shard(transaction, shard_ref, worker_id: str, changes: dict) -> bool:
+    snapshot = shard_ref.get(transaction=transaction)
+    d = snapshot.to_dict() or {}
+    if d.get("owner") != worker_id or d.get("status") != "leased":
+        return False
+    transaction.update(shard_ref, changes)
+    return True
+
+def renew_shard_lease(run_id: str, index: int, worker_id: str, lease_seconds: float, now: float) -> bool:
+    """Extiende el lease; False si el shard ya no pertenece a worker_id."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return False
+    shard_ref = db.collection(SHARDS_COLLECTION).document(run_id).collection("shards").document(str(index))
+    return _update_owned_shard(db.transaction(), shard_ref, worker_id, {"lease_expires_at": now + lease_seconds})
+
+def complete_shard(run_id: str, index: int, worker_id: str) -> bool:
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return False
+    shard_ref = db.collection(SHARDS_COLLECTION).document(run_id).collection("shards").document(str(index))
+    return _update_owned_shard(db.transaction(), shard_ref, worker_id, {
+        "status": "done",
+        "completed_at": _timestamp(),
+    })
+
+def record_shard_product(run_id: str, index: int, product_id, entry: dict):
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return
+    (
+        db.collection(SHARDS_COLLECTION).document(run_id)
+        .collection("shards").document(str(index))
+        .collection("products").document(str(product_id))
+        .set(entry)
+    )
+
+def list_shard_products(run_id: str, index: int) -> List[dict]:
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return []
+    products = (
+        db.collection(SHARDS_COLLECTION).document(str(run_id))
+        .collection("shards").document(str(index))
+        .collection("products")
+    )
+    return [d.to_dict() or {} for d in products.stream()]
+
+def list_shard_product_ids(run_id: str) -> Dict[int, List[str]]:
+    """Productos fijados en cada shard al crear la corrida."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return {}
+    shards = db.collection(SHARDS_COLLECTION).document(str(run_id)).collection("shards")
+    return {int(doc.id): (doc.to_dict() or {}).get("product_ids") or [] for doc in shards.select(["product_ids"]).stream()}
+
+def list_shards(run_id: str, with_entries: bool = False) -> List[dict]:
+    """Estado de cada shard; con with_entries incluye sus productos terminados en "products"."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return []
+    out = []
+    shards = db.collection(SHARDS_COLLECTION).document(str(run_id)).collection("shards")
+    for doc in shards.stream():
+        d = doc.to_dict() or {}
+        d.pop("product_ids", None)
+        if with_entries:
+            d["products"] = [p.to_dict() or {} for p in doc.reference.collection("products").stream()]
+        out.append(d)
+    out.sort(key=lambda d: d.get("index", 0))
+    return out
+
+@firestore.transactional
+def _finalize_in_transaction(transaction, run_ref, worker_id: str) -> bool:
+    snapshot = run_ref.get(transaction=transaction)
+    if (snapshot.to_dict() or {}).get("status") != "running":
+        return False
+    transaction.update(run_ref, {
+        "status": "finalized",
+        "finalized_by": worker_id,
+        "finalized_at": _timestamp(),
+    })
+    return True
+
+def finalize_shard_run(run_id: str, worker_id: str) -> bool:
+    """Marca la corrida como finalizada; sólo el primer worker que lo logra escribe el registro."""
+    db = getattr(settings, "FIRESTORE_DB", None)
+    if db is None:
+        return False
+    run_ref = db.collection(SHARDS_COLLECTION).document(run_id)
+    return _finalize_in_transaction(db.transaction(), run_ref, worker_id)
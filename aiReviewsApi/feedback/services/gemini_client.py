@@ -1,7 +1,16 @@
-from typing import List, Dict, Any
+import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
 from django.conf import settings
 import google.generativeai as genai
 
+from .profiling import phase
+from .records import Product, Review, format_rating
+
 
 class GeminiError(Exception):
     """Error genérico al llamar a Gemini."""
@@ -17,149 +26,309 @@ except Exception:
 # Podés cambiar el modelo si querés
 _MODEL_NAME = "gemini-1.5-flash"
 
+# Tiempo máximo por resumen; al vencer se usa el resumen offline
+_DEADLINE_SECONDS = getattr(settings, "GEMINI_DEADLINE_SECONDS", 30.0)
+# Hedging: pasado el p95 observado se lanza una segunda llamada y gana la primera en responder
+_HEDGE_ENABLED = getattr(settings, "GEMINI_HEDGE_ENABLED", False)
+_HEDGE_QUANTILE = getattr(settings, "GEMINI_HEDGE_QUANTILE", 0.95)
+# Demora usada hasta juntar suficientes muestras, y mínimo para la demora calculada
+_HEDGE_INITIAL_DELAY = getattr(settings, "GEMINI_HEDGE_INITIAL_DELAY", 5.0)
+_HEDGE_MIN_DELAY = getattr(settings, "GEMINI_HEDGE_MIN_DELAY", 1.0)
+# Fracción máxima de llamadas que pueden duplicarse
+_HEDGE_BUDGET = getattr(settings, "GEMINI_HEDGE_BUDGET", 0.1)
 
-def summarize_low_rating_reviews(
-    product: Dict[str, Any],
-    low_rating_reviews: List[Dict[str, Any]],
-    rating_threshold: int,
-    avg_rating: float,
-    total_reviews: int,
-) -> str:
-    """
-    Llama a Gemini para generar un resumen de las reseñas con mala calificación
-    de un producto.
+_MIN_SAMPLES = 20
+# Llamadas en vuelo como máximo, contando las abandonadas por deadline que
+# siguen hasta su propio timeout. Nunca se encola: sin hilo libre se usa el
+# resumen offline, porque la espera en la cola se comería el deadline.
+_MAX_WORKERS = max(int(getattr(settings, "GEMINI_MAX_WORKERS", 8)), 1)
+_executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix="gemini")
+_slots = threading.BoundedSemaphore(_MAX_WORKERS)
 
-    - product: dict con al menos 'id' y 'name'/'nombre'
-    - low_rating_reviews: lista de reseñas de ese producto con calificación <= threshold
-    - rating_threshold: umbral considerado como "mala" calificación
-    - avg_rating: promedio de calificaciones del producto
-    - total_reviews: cantidad total de reseñas del producto
+
+class _LatencyStats:
+    """Latencias recientes de Gemini y contadores de deadline/hedging."""
+
+    def __init__(self, size: int = 500):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self.counters = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+            "saturated": 0,
+            "errors": 0,
+        }
+
+    def add_sample(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def incr(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            enough = len(self._samples) >= _MIN_SAMPLES
+        if not enough:
+            return _HEDGE_INITIAL_DELAY
+        return max(_HEDGE_MIN_DELAY, self.quantile(_HEDGE_QUANTILE))
+
+    def try_spend_hedge(self) -> bool:
+        """Reserva un hedge si no se supera la fracción _HEDGE_BUDGET de las llamadas."""
+        with self._lock:
+            if self.counters["hedged"] + 1 > _HEDGE_BUDGET * self.counters["calls"]:
+                return False
+            self.counters["hedged"] += 1
+            return True
+
+    def refund_hedge(self):
+        with self._lock:
+            self.counters["hedged"] -= 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            samples = len(self._samples)
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "samples": samples,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "p99_seconds": self.quantile(0.99),
+            "hedge_enabled": _HEDGE_ENABLED,
+            "hedge_delay_seconds": self.hedge_delay(),
+            "deadline_seconds": _DEADLINE_SECONDS,
+            "max_in_flight": _MAX_WORKERS,
+        }
+
+
+_stats = _LatencyStats()
+
+
+def get_latency_stats() -> Dict[str, object]:
+    return _stats.snapshot()
+
+
+def _generate(prompt: str, timeout: float) -> str:
+    model = genai.GenerativeModel(_MODEL_NAME)
+    response = model.generate_content(
+        prompt,
+        generation_config={"response_mime_type": "application/json"},
+        request_options={"timeout": timeout},
+    )
+    return response.text or ""
+
+
+def _submit(prompt: str, timeout: float):
+    """Lanza la llamada en el pool; None si los GEMINI_MAX_WORKERS hilos están ocupados."""
+    if not _slots.acquire(blocking=False):
+        _stats.incr("saturated")
+        return None
+    started = time.monotonic()
+    future = _executor.submit(_generate, prompt, timeout)
+
+    def record(f):
+        # El hilo queda libre recién cuando la llamada termina, aunque nadie la espere
+        _slots.release()
+        if f.exception() is None:
+            _stats.add_sample(time.monotonic() - started)
+        else:
+            _stats.incr("errors")
+
+    future.add_done_callback(record)
+    return future
+
+
+def _generate_with_deadline(prompt: str) -> Optional[str]:
+    """
+    Llama a Gemini con deadline y, si está habilitado, con hedging.
+    Devuelve el texto de la primera respuesta exitosa, o None si venció el
+    deadline, fallaron todos los intentos o el pool estaba lleno. Las
+    llamadas perdedoras siguen ocupando su hilo hasta su propio timeout,
+    pero nadie las espera.
     """
+    _stats.incr("calls")
+    deadline = time.monotonic() + _DEADLINE_SECONDS
+    primary = _submit(prompt, _DEADLINE_SECONDS)
+    if primary is None:
+        return None
+    pending = {primary}
+    hedge = None
 
-    if not low_rating_reviews:
-        return "No se encontraron reseñas con calificación baja para este producto."
+    if _HEDGE_ENABLED:
+        done, _ = wait(pending, timeout=min(_stats.hedge_delay(), _DEADLINE_SECONDS))
+        if not done and _stats.try_spend_hedge():
+            hedge = _submit(prompt, max(deadline - time.monotonic(), 0.1))
+            if hedge is None:
+                # Sin hilo libre no se duplica: se sigue esperando a la primera
+                _stats.refund_hedge()
+            else:
+                pending.add(hedge)
 
-    # Extraemos algunos campos del producto con nombres genéricos
-    product_id = product.get("id") or product.get("id_producto") or "desconocido"
-    product_name = product.get("name") or product.get("nombre") or "Producto sin nombre"
-    product_desc = product.get("description") or product.get("descripcion") or ""
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _stats.incr("hedge_wins")
+                return future.result()
+    if pending:
+        _stats.incr("deadline_exceeded")
+    return None
 
-    # Limitamos la cantidad de reseñas para no mandar textos enormes
-    max_reviews = 50
-    reviews_sample = low_rating_reviews[:max_reviews]
 
-    # Armamos el texto de reseñas
-    reviews_text_lines = []
-    for idx, r in enumerate(reviews_sample, start=1):
-        rating = r.get("rating") or r.get("calificacion") or "?"
-        comment = r.get("comment") or r.get("comentario") or ""
-        reviews_text_lines.append(f"{idx}. Calificación: {rating} - Comentario: {comment}")
+def _offline_summary(product_name: str, reviews: List[Review]) -> str:
+    """Resumen local por palabras clave, usado sin API key o si Gemini falla."""
+    positives = []
+    negatives = []
+    for r in reviews:
+        txt = r.comment.lower()
+        if any(k in txt for k in ["bueno", "excelente", "positivo", "recomendado", "cumple"]):
+            positives.append(txt)
+        if any(k in txt for k in ["malo", "defecto", "fallo", "problema", "no funciona", "devuelve"]):
+            negatives.append(txt)
+    neg_phrase = "quejas recurrentes" if negatives else "sin patrón claro de quejas"
+    pos_phrase = "algunos aspectos positivos" if positives else "pocos aspectos positivos"
+    return f"{product_name}: {neg_phrase} y {pos_phrase}."
 
-    reviews_text = "\n".join(reviews_text_lines)
 
-    prompt = f"""
-Analiza reseñas de un producto y devuelve UNA SOLA FRASE clara en español.
+def _build_prompt(
+    product: Product,
+    reviews_sample: List[Review],
+    low_sample: List[Review],
+    rating_threshold: int,
+    avg_rating: float,
+    total_reviews: int,
+) -> str:
+    product_id = product.id if product.id is not None else "desconocido"
+    product_name = product.name or "Producto sin nombre"
+
+    reviews_text = "\n".join(
+        f"{idx}. {format_rating(r.rating)}: {r.comment}"
+        for idx, r in enumerate(reviews_sample, start=1)
+    )
+    low_text = "\n".join(
+        f"{idx}. Calificación: {format_rating(r.rating)} - Comentario: {r.comment}"
+        for idx, r in enumerate(low_sample, start=1)
+    ) or "(sin reseñas malas)"
+
+    return f"""
+Analiza reseñas de un producto y responde SOLO con un objeto JSON en español.
 
 Contexto del producto:
 - ID: {product_id}
 - Nombre: {product_name}
-- Descripción: {product_desc}
+- Descripción: {product.description}
 
 Estadísticas:
 - Calificación promedio: {avg_rating:.2f}
 - Total de reseñas: {total_reviews}
 - Umbral de mala calificación: {rating_threshold}
 
-Muestra de reseñas malas (una por línea):
+Muestra de reseñas (una por línea):
 {reviews_text}
 
+Muestra de reseñas malas (una por línea):
+{low_text}
+
+Formato de respuesta:
+{{"general_opinion": "...", "summary": "..."}}
+
 Instrucciones:
-- Redacta una única oración concisa (<= 25 palabras) que resuma patrones de quejas y, si corresponde, un aspecto positivo.
+- general_opinion: una única oración concisa (<= 25 palabras) con la opinión general, equilibrando aspectos positivos y negativos.
+- summary: una única oración concisa (<= 25 palabras) que resuma patrones de quejas de las reseñas malas y, si corresponde, un aspecto positivo; null si no hay reseñas malas.
 - No enumeres ni cites reseñas específicas.
-- No generes más de una oración.
 """
 
-    if not _API_KEY:
-        positives = []
-        negatives = []
-        for r in reviews_sample:
-            txt = (r.get("comment") or r.get("comentario") or "").lower()
-            if any(k in txt for k in ["bueno", "excelente", "positivo", "recomendado", "cumple"]):
-                positives.append(txt)
-            if any(k in txt for k in ["malo", "defecto", "fallo", "problema", "no funciona", "devuelve"]):
-                negatives.append(txt)
-        neg_phrase = "quejas recurrentes" if negatives else "sin patrón claro de quejas"
-        pos_phrase = "algunos aspectos positivos" if positives else "pocos aspectos positivos"
-        return f"{product_name}: {neg_phrase} y {pos_phrase}."
 
-    try:
-        model = genai.GenerativeModel(_MODEL_NAME)
-        response = model.generate_content(prompt)
-        summary = response.text
-        return summary.strip()
-    except Exception as exc:
-        positives = []
-        negatives = []
-        for r in reviews_sample:
-            txt = (r.get("comment") or r.get("comentario") or "").lower()
-            if any(k in txt for k in ["bueno", "excelente", "positivo", "recomendado", "cumple"]):
-                positives.append(txt)
-            if any(k in txt for k in ["malo", "defecto", "fallo", "problema", "no funciona", "devuelve"]):
-                negatives.append(txt)
-        neg_phrase = "quejas recurrentes" if negatives else "sin patrón claro de quejas"
-        pos_phrase = "algunos aspectos positivos" if positives else "pocos aspectos positivos"
-        return f"{product_name}: {neg_phrase} y {pos_phrase}."
-
-
-def summarize_general_opinion(product: Dict[str, Any], reviews: List[Dict[str, Any]]) -> str:
-    product_id = product.get("id") or product.get("id_producto") or "desconocido"
-    product_name = product.get("name") or product.get("nombre") or "Producto sin nombre"
-    product_desc = product.get("description") or product.get("descripcion") or ""
-
-    max_reviews = 100
-    sample = reviews[:max_reviews]
-
-    lines = []
-    for idx, r in enumerate(sample, start=1):
-        rating = r.get("rating") or r.get("calificacion") or "?"
-        comment = r.get("comment") or r.get("comentario") or ""
-        lines.append(f"{idx}. {rating}: {comment}")
-    reviews_text = "\n".join(lines)
-
-    prompt = (
-        "Analiza reseñas de un producto y devuelve una sola frase en español con la opinión general, "
-        "equilibrando aspectos positivos y negativos, sin enumerar reseñas ni citar textualmente.\n\n"
-        f"ID: {product_id}\nNombre: {product_name}\nDescripción: {product_desc}\n\n"
-        f"Muestra de reseñas:\n{reviews_text}\n\n"
-        "Una única oración concisa (≤ 25 palabras)."
+# Tokens reservados para la respuesta JSON (dos oraciones cortas)
+_RESPONSE_TOKENS = 120
+
+
+def estimate_tokens(
+    product: Product,
+    reviews: List[Review],
+    low_rating_reviews: List[Review],
+    rating_threshold: int,
+    avg_rating: float,
+) -> int:
+    """
+    Estimación aproximada (~4 caracteres por token) del costo de
+    summarize_product_reviews para un producto, prompt más respuesta.
+    """
+    prompt = _build_prompt(
+        product, reviews[:100], low_rating_reviews[:50], rating_threshold, avg_rating, len(reviews)
     )
+    return len(prompt) // 4 + _RESPONSE_TOKENS
+
+
+def summarize_product_reviews(
+    product: Product,
+    reviews: List[Review],
+    low_rating_reviews: List[Review],
+    rating_threshold: int,
+    avg_rating: float,
+    total_reviews: int,
+) -> Dict[str, Optional[str]]:
+    """
+    Genera con una sola llamada a Gemini la opinión general y el resumen de
+    reseñas con mala calificación de un producto.
+
+    - product: registro normalizado del producto
+    - reviews: todas las reseñas del producto
+    - low_rating_reviews: reseñas con calificación <= rating_threshold
+    - rating_threshold: umbral considerado como "mala" calificación
+    - avg_rating: promedio de calificaciones del producto
+    - total_reviews: cantidad total de reseñas del producto
+
+    Devuelve {"general_opinion": str, "summary": str | None}; summary es None
+    cuando no hay reseñas malas.
+    """
+    product_name = product.name or "Producto sin nombre"
+
+    # Limitamos la cantidad de reseñas para no mandar textos enormes
+    reviews_sample = reviews[:100]
+    low_sample = low_rating_reviews[:50]
+
+    def offline():
+        return {
+            "general_opinion": _offline_summary(product_name, reviews_sample),
+            "summary": _offline_summary(product_name, low_sample) if low_sample else None,
+        }
 
     if not _API_KEY:
-        positives = []
-        negatives = []
-        for r in sample:
-            txt = (r.get("comment") or r.get("comentario") or "").lower()
-            if any(k in txt for k in ["bueno", "excelente", "positivo", "recomendado", "cumple"]):
-                positives.append(txt)
-            if any(k in txt for k in ["malo", "defecto", "fallo", "problema", "no funciona", "devuelve"]):
-                negatives.append(txt)
-        neg_phrase = "quejas recurrentes" if negatives else "sin patrón claro de quejas"
-        pos_phrase = "algunos aspectos positivos" if positives else "pocos aspectos positivos"
-        return f"{product_name}: {neg_phrase} y {pos_phrase}."
+        return offline()
 
+    with phase("prompt_build"):
+        prompt = _build_prompt(product, reviews_sample, low_sample, rating_threshold, avg_rating, total_reviews)
+    with phase("llm_wait"):
+        text = _generate_with_deadline(prompt)
+    if text is None:
+        # Venció el deadline, fallaron todos los intentos o el pool estaba lleno
+        return offline()
     try:
-        model = genai.GenerativeModel(_MODEL_NAME)
-        response = model.generate_content(prompt)
-        return (response.text or "").strip()
+        data = json.loads(text)
+        general_opinion = str(data.get("general_opinion") or "").strip()
+        summary = str(data.get("summary") or "").strip() or None
     except Exception:
-        positives = []
-        negatives = []
-        for r in sample:
-            txt = (r.get("comment") or r.get("comentario") or "").lower()
-            if any(k in txt for k in ["bueno", "excelente", "positivo", "recomendado", "cumple"]):
-                positives.append(txt)
-            if any(k in txt for k in ["malo", "defecto", "fallo", "problema", "no funciona", "devuelve"]):
-                negatives.append(txt)
-        neg_phrase = "quejas recurrentes" if negatives else "sin patrón claro de quejas"
-        pos_phrase = "algunos aspectos positivos" if positives else "pocos aspectos positivos"
-        return f"{product_name}: {neg_phrase} y {pos_phrase}."
+        return offline()
+    if not general_opinion:
+        return offline()
+    if not low_sample:
+        summary = None
+    elif not summary:
+        summary = _offline_summary(product_name, low_sample)
+    return {"general_opinion": general_opinion, "summary": summary}
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from django.conf import settings
+
+from .firebase_client import (
+    list_history_product_ids,
+    list_product_analysis_history,
+    delete_product_analysis_history_entries,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Campos necesarios para decidir qué entradas conservar
+_POLICY_FIELDS = ["created_at", "summary", "general_opinion"]
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Política de retención del historial de análisis.
+
+    - keep_last: cantidad de entradas recientes que se conservan intactas
+    - downsample: "daily", "weekly" o "" para no reducir las entradas antiguas
+    - collapse_identical: elimina entradas consecutivas con el mismo resumen
+    - max_age_days: fuera de las keep_last, borra las entradas más antiguas
+      que esto (0 sin límite)
+    - max_entries: tope absoluto de entradas por producto; nunca baja de
+      keep_last (0 sin límite)
+    """
+    keep_last: int = 50
+    downsample: str = "daily"
+    collapse_identical: bool = True
+    max_age_days: int = 365
+    max_entries: int = 200
+
+    @classmethod
+    def from_settings(cls) -> "RetentionPolicy":
+        return cls(
+            keep_last=getattr(settings, "HISTORY_KEEP_LAST", 50),
+            downsample=getattr(settings, "HISTORY_DOWNSAMPLE", "daily"),
+            collapse_identical=getattr(settings, "HISTORY_COLLAPSE_IDENTICAL", True),
+            max_age_days=getattr(settings, "HISTORY_MAX_AGE_DAYS", 365),
+            max_entries=getattr(settings, "HISTORY_MAX_ENTRIES", 200),
+        )
+
+
+def _parse(ts) -> Optional[datetime]:
+    if not ts:
+        return None
+    try:
+        when = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    except Exception:
+        return None
+    # Las fechas sin zona se guardaron en UTC
+    return when if when.tzinfo is not None else when.replace(tzinfo=timezone.utc)
+
+
+def _bucket(when: Optional[datetime], downsample: str):
+    if when is None:
+        return None
+    if downsample == "weekly":
+        year, week, _ = when.isocalendar()
+        return (year, week)
+    return when.date()
+
+
+def select_entries_to_delete(
+    entries: List[Dict[str, Any]],
+    policy: RetentionPolicy,
+    now: Optional[datetime] = None,
+) -> List[str]:
+    """
+    Decide qué entradas borrar. entries debe venir ordenado del más reciente
+    al más antiguo (como lo devuelve list_product_analysis_history).
+    """
+    now = now or datetime.now(timezone.utc)
+    keep_last = max(policy.keep_last, 0)
+    recent = entries[:keep_last]
+    older = entries[keep_last:]
+    to_delete = []
+
+    kept = []
+    previous_text = None
+    if recent:
+        previous_text = (recent[-1].get("summary"), recent[-1].get("general_opinion"))
+    for entry in older:
+        text = (entry.get("summary"), entry.get("general_opinion"))
+        if policy.collapse_identical and previous_text == text:
+            # Igual que la entrada conservada inmediatamente más nueva: sobra
+            to_delete.append(entry["id"])
+            continue
+        previous_text = text
+        kept.append(entry)
+
+    if policy.max_age_days > 0:
+        cutoff = now - timedelta(days=policy.max_age_days)
+        survivors = []
+        for entry in kept:
+            when = _parse(entry.get("created_at"))
+            if when is not None and when < cutoff:
+                to_delete.append(entry["id"])
+            else:
+                survivors.append(entry)
+        kept = survivors
+
+    if policy.downsample in ("daily", "weekly"):
+        seen_buckets = set()
+        survivors = []
+        for entry in kept:
+            bucket = _bucket(_parse(entry.get("created_at")), policy.downsample)
+            if bucket is not None and bucket in seen_buckets:
+                to_delete.append(entry["id"])
+                continue
+            if bucket is not None:
+                seen_buckets.add(bucket)
+            survivors.append(entry)
+        kept = survivors
+
+    if policy.max_entries > 0:
+        # kept sigue ordenado del más reciente al más antiguo: sobran las últimas
+        room = max(policy.max_entries - len(recent), 0)
+        to_delete.extend(entry["id"] for entry in kept[room:])
+    return to_delete
+
+
+def compact_product_history(product_id, policy: Optional[RetentionPolicy] = None) -> int:
+    """Aplica la política al historial de un producto; devuelve cuántas entradas borró."""
+    policy = policy or RetentionPolicy.from_settings()
+    entries = list_product_analysis_history(product_id, fields=_POLICY_FIELDS)
+    to_delete = select_entries_to_delete(entries, policy)
+    return delete_product_analysis_history_entries(product_id, to_delete)
+
+
+def compact_all_history(policy: Optional[RetentionPolicy] = None) -> Dict[str, int]:
+    """Compacta el historial de todos los productos, uno por vez."""
+    policy = policy or RetentionPolicy.from_settings()
+    products = 0
+    deleted = 0
+    for product_id in list_history_product_ids():
+        deleted += compact_product_history(product_id, policy)
+        products += 1
+    return {"products": products, "deleted": deleted}
+
+
+def _compaction_loop(interval_seconds: int):
+    while True:
+        time.sleep(interval_seconds)
+        try:
+            compact_all_history()
+        except Exception:
+            # Un fallo puntual de Firestore no debe matar el hilo
+            logger.exception("Falló la compactación del historial")
+
+
+def start_compaction_worker(interval_seconds: int) -> threading.Thread:
+    t = threading.Thread(target=_compaction_loop, args=(interval_seconds,), daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,176 @@
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+
+# Fases que se miden en una corrida de análisis
+PHASES = ("fetch", "parse", "group", "prompt_build", "llm_wait", "firestore_write")
+
+_phases: ContextVar[Optional[Dict[str, Dict[str, float]]]] = ContextVar("analysis_phases", default=None)
+
+_PROFILE_ID_RE = re.compile(r"^[0-9T]+-[0-9a-f]{8}$")
+
+
+# --- Desglose por fases ---
+
+@contextmanager
+def phase(name: str):
+    """
+    Suma el tiempo del bloque a la fase name de la medición activa en este
+    contexto. Sin medición activa no hace nada.
+    """
+    acc = _phases.get()
+    if acc is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        slot = acc.setdefault(name, {"seconds": 0.0, "calls": 0})
+        slot["seconds"] += time.perf_counter() - started
+        slot["calls"] += 1
+
+
+@contextmanager
+def record_phases():
+    """Activa la medición por fases para el bloque y entrega el acumulador."""
+    acc: Dict[str, Dict[str, float]] = {}
+    token = _phases.set(acc)
+    try:
+        yield acc
+    finally:
+        _phases.reset(token)
+
+
+def phase_report(acc: Dict[str, Dict[str, float]], total_seconds: float) -> Dict[str, Any]:
+    """{"total_seconds", "other_seconds", "phases": {fase: {"seconds", "calls"}}}."""
+    phases = {
+        name: {"seconds": round(acc[name]["seconds"], 4), "calls": acc[name]["calls"]}
+        for name in PHASES if name in acc
+    }
+    measured = sum(v["seconds"] for v in acc.values())
+    return {
+        "total_seconds": round(total_seconds, 4),
+        "other_seconds": round(max(total_seconds - measured, 0.0), 4),
+        "phases": phases,
+    }
+
+
+# --- Autorización ---
+
+def wants_profile(request) -> bool:
+    flag = request.GET.get("profile") or request.META.get("HTTP_X_PROFILE") or ""
+    return flag.lower() in ("1", "true", "yes")
+
+
+def is_authorized(request) -> bool:
+    """PROFILING_TOKEN en el header X-Profile-Token, o usuario staff."""
+    token = getattr(settings, "PROFILING_TOKEN", "")
+    supplied = request.META.get("HTTP_X_PROFILE_TOKEN", "")
+    if token and supplied and hmac.compare_digest(token, supplied):
+        return True
+    user = getattr(request, "user", None)
+    return bool(user is not None and user.is_authenticated and user.is_staff)
+
+
+# --- Almacenamiento en disco ---
+
+def _profiles_dir() -> str:
+    return str(getattr(settings, "PROFILING_DIR", "profiles"))
+
+
+def _path(profile_id: str, ext: str) -> str:
+    return os.path.join(_profiles_dir(), f"{profile_id}.{ext}")
+
+
+def save_profile(kind: str, meta: Dict[str, Any], profiler=None) -> str:
+    """
+    Guarda <id>.json con meta y, si hay profiler, <id>.prof con las
+    estadísticas de cProfile. Conserva los últimos PROFILING_KEEP perfiles.
+    """
+    os.makedirs(_profiles_dir(), exist_ok=True)
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    meta = {
+        **meta,
+        "id": profile_id,
+        "kind": kind,
+        "has_stats": profiler is not None,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+    }
+    if profiler is not None:
+        profiler.dump_stats(_path(profile_id, "prof"))
+    with open(_path(profile_id, "json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, default=str)
+    _prune(getattr(settings, "PROFILING_KEEP", 50))
+    return profile_id
+
+
+def _profile_ids() -> List[str]:
+    try:
+        names = os.listdir(_profiles_dir())
+    except FileNotFoundError:
+        return []
+    return sorted((n[:-5] for n in names if n.endswith(".json")), reverse=True)
+
+
+def _prune(keep: int):
+    for profile_id in _profile_ids()[keep:]:
+        for ext in ("json", "prof"):
+            try:
+                os.remove(_path(profile_id, ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Metadatos de los perfiles guardados, del más reciente al más antiguo."""
+    out = []
+    for profile_id in _profile_ids():
+        try:
+            with open(_path(profile_id, "json"), encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def profile_stats_path(profile_id: str) -> Optional[str]:
+    """Ruta del .prof de un perfil (para descargarlo), o None."""
+    if not _PROFILE_ID_RE.match(profile_id):
+        return None
+    path = _path(profile_id, "prof")
+    return path if os.path.exists(path) else None
+
+
+def get_profile(profile_id: str, sort: str = "cumulative", limit: int = 40) -> Optional[Dict[str, Any]]:
+    """Metadatos del perfil y, si tiene cProfile, las limit funciones más costosas según sort."""
+    if not _PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(_path(profile_id, "json"), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stats_path = profile_stats_path(profile_id)
+    if stats_path is not None:
+        out = io.StringIO()
+        stats = pstats.Stats(stats_path, stream=out)
+        try:
+            stats.sort_stats(sort)
+        except KeyError:
+            stats.sort_stats("cumulative")
+        stats.print_stats(limit)
+        data["stats"] = out.getvalue()
+    return data
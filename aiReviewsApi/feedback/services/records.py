@@ -0,0 +1,119 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+# Nombres alternativos que usa la API de origen para cada campo
+PRODUCT_ID_KEYS = ("id", "id_producto")
+PRODUCT_NAME_KEYS = ("name", "nombre")
+PRODUCT_DESC_KEYS = ("description", "descripcion")
+REVIEW_ID_KEYS = ("id", "id_resena")
+REVIEW_PRODUCT_ID_KEYS = ("product_id", "id_producto")
+REVIEW_RATING_KEYS = ("rating", "calificacion")
+REVIEW_COMMENT_KEYS = ("comment", "comentario")
+REVIEW_DATE_KEYS = ("created_at", "fecha", "fecha_creacion")
+
+
+@dataclass(slots=True)
+class Product:
+    id: Any
+    name: Optional[str]
+    description: str
+    raw: Dict[str, Any] = field(repr=False)
+
+    @property
+    def key(self) -> str:
+        return str(self.id)
+
+
+@dataclass(slots=True)
+class Review:
+    id: Any
+    product_id: Any
+    rating: Optional[float]
+    comment: str
+    created_at: Optional[str]
+    raw: Dict[str, Any] = field(repr=False)
+
+    @property
+    def product_key(self) -> str:
+        return str(self.product_id)
+
+
+def _first(d: Dict[str, Any], keys) -> Any:
+    """
+    Primer valor presente entre keys. A diferencia de `a or b`, un 0 es un
+    valor válido; sólo None y "" se consideran ausentes.
+    """
+    for k in keys:
+        v = d.get(k)
+        if v is not None and v != "":
+            return v
+    return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _items(payload) -> List[Dict[str, Any]]:
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        return payload.get("results") or payload.get("data") or []
+    return []
+
+
+def normalize_product(p: Dict[str, Any]) -> Product:
+    return Product(
+        id=_first(p, PRODUCT_ID_KEYS),
+        name=_first(p, PRODUCT_NAME_KEYS),
+        description=_first(p, PRODUCT_DESC_KEYS) or "",
+        raw=p,
+    )
+
+
+def normalize_review(r: Dict[str, Any]) -> Review:
+    return Review(
+        id=_first(r, REVIEW_ID_KEYS),
+        product_id=_first(r, REVIEW_PRODUCT_ID_KEYS),
+        rating=_to_float(_first(r, REVIEW_RATING_KEYS)),
+        comment=str(_first(r, REVIEW_COMMENT_KEYS) or ""),
+        created_at=_first(r, REVIEW_DATE_KEYS),
+        raw=r,
+    )
+
+
+def normalize_products(payload) -> List[Product]:
+    """Convierte la respuesta de /productos en registros Product (descarta los que no tienen ID)."""
+    out = []
+    for p in _items(payload):
+        if not isinstance(p, dict):
+            continue
+        product = normalize_product(p)
+        if product.id is not None:
+            out.append(product)
+    return out
+
+
+def normalize_reviews(payload) -> List[Review]:
+    """Convierte la respuesta de /resenas en registros Review."""
+    return [normalize_review(r) for r in _items(payload) if isinstance(r, dict)]
+
+
+def group_reviews_by_product(reviews: List[Review]) -> Dict[str, List[Review]]:
+    """Agrupa reseñas por product_key; las reseñas sin producto se descartan."""
+    grouped: Dict[str, List[Review]] = {}
+    for r in reviews:
+        if r.product_id is None:
+            continue
+        grouped.setdefault(r.product_key, []).append(r)
+    return grouped
+
+
+def format_rating(rating: Optional[float]) -> str:
+    if rating is None:
+        return "?"
+    return str(int(rating)) if rating.is_integer() else str(rating)
@@ -0,0 +1,86 @@
+import hashlib
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Nombres de las respuestas cacheadas (uno por endpoint de lectura)
+ANALYSIS_SUMMARY = "analysis_summary"
+OPINION_SUMMARY = "opinion_summary"
+ANALYSIS_RUNS = "analysis_runs"
+ANALYSIS_RUN_DETAIL = "analysis_run_detail"
+ANALYSIS_HISTORY = "analysis_history"
+PRODUCT_TREND = "product_trend"
+TREND_MOVERS = "trend_movers"
+
+_PREFIX = "feedback:response:"
+
+
+def _key(name: str, *parts) -> str:
+    return _PREFIX + ":".join([name] + [str(p) for p in parts])
+
+
+def _generation(name: str, parts: tuple) -> int:
+    return cache.get(_key("gen", name, *parts)) or 0
+
+
+def get_entry(name: str, parts: tuple, variant: tuple = ()) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Devuelve (entrada cacheada o None, generación vista).
+
+    variant distingue respuestas del mismo recurso (por ejemplo, la página
+    pedida); todas se invalidan juntas. La entrada tiene la forma
+    {"body": bytes, "etag": str, "last_modified": int}. Ante un fallo hay
+    que pasar la generación a store_entry.
+    """
+    gen = _generation(name, parts)
+    return cache.get(_key(name, *parts, gen, *variant)), gen
+
+
+def store_entry(name: str, parts: tuple, gen: int, body: bytes, variant: tuple = ()) -> Dict[str, Any]:
+    """
+    Guarda el JSON ya renderizado junto con sus validadores HTTP, bajo la
+    generación gen que devolvió get_entry antes de leer Firestore: si hubo
+    una invalidación mientras tanto, la entrada queda en una generación
+    vieja y no se sirve. No vence salvo que se configure RESPONSE_CACHE_TTL.
+    """
+    entry = {
+        "body": body,
+        "etag": '"%s"' % hashlib.sha1(body).hexdigest(),
+        "last_modified": int(time.time()),
+    }
+    cache.set(_key(name, *parts, gen, *variant), entry, timeout=getattr(settings, "RESPONSE_CACHE_TTL", None))
+    return entry
+
+
+def invalidate(name: str, *parts):
+    """
+    Descarta todas las variantes cacheadas de un recurso. La generación es
+    un timestamp en ns: aunque el backend descarte la clave, la siguiente
+    invalidación nunca reutiliza una generación anterior.
+    """
+    cache.set(_key("gen", name, *parts), time.time_ns(), timeout=None)
+
+
+def invalidate_product_analysis(product_id):
+    invalidate(ANALYSIS_SUMMARY, product_id)
+    invalidate(OPINION_SUMMARY, product_id)
+
+
+def invalidate_product_history(product_id):
+    invalidate(ANALYSIS_HISTORY, product_id)
+
+
+def invalidate_product_trend(product_id):
+    invalidate(PRODUCT_TREND, product_id)
+    invalidate(TREND_MOVERS)
+
+
+def invalidate_runs():
+    invalidate(ANALYSIS_RUNS)
+
+
+def invalidate_run_detail(run_id):
+    invalidate(ANALYSIS_RUN_DETAIL, run_id)
@@ -0,0 +1,207 @@
+import hmac
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import DirtyProduct
+from .admission import AdmissionRejected, heavy_controller
+from .analysis_service import AnalysisError, ProductNotFoundError, analyze_single_product
+from .catalog_mirror import refresh_catalog_mirror, use_mirror
+from .cloud_functions_client import CloudFunctionsError
+from .records import normalize_review
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("review.created", "review.updated", "review.deleted")
+
+
+class ReviewEventError(ValueError):
+    """Evento con formato inválido."""
+    pass
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def is_authorized(request) -> bool:
+    """REVIEW_EVENTS_TOKEN en Authorization: Bearer o X-Events-Token. Sin token configurado no se aceptan eventos."""
+    token = _setting("REVIEW_EVENTS_TOKEN", "")
+    if not token:
+        return False
+    auth = request.META.get("HTTP_AUTHORIZATION", "")
+    supplied = auth[7:] if auth.startswith("Bearer ") else request.META.get("HTTP_X_EVENTS_TOKEN", "")
+    return bool(supplied) and hmac.compare_digest(token, supplied)
+
+
+def event_product_id(event: Dict[str, Any]) -> str:
+    """
+    ID de producto de un evento: {"type", "product_id"} o {"type", "review": {...}}
+    con los nombres de campo de /resenas.
+    """
+    if not isinstance(event, dict):
+        raise ReviewEventError("Cada evento debe ser un objeto.")
+    event_type = event.get("type", "review.created")
+    if event_type not in EVENT_TYPES:
+        raise ReviewEventError(f"type debe ser uno de: {', '.join(EVENT_TYPES)}.")
+    product_id = event.get("product_id")
+    if product_id is None and isinstance(event.get("review"), dict):
+        product_id = normalize_review(event["review"]).product_id
+    if product_id is None or product_id == "":
+        raise ReviewEventError("El evento no indica product_id.")
+    return str(product_id)
+
+
+def mark_dirty(product_ids: Iterable[str]) -> List[str]:
+    """
+    Marca productos como pendientes. Los eventos repetidos del mismo
+    producto sólo actualizan last_event_at y el contador.
+    """
+    now = timezone.now()
+    counts: Dict[str, int] = {}
+    for pid in product_ids:
+        counts[pid] = counts.get(pid, 0) + 1
+    for pid, n in counts.items():
+        bump = {"last_event_at": now, "event_count": F("event_count") + n}
+        if DirtyProduct.objects.filter(product_id=pid).update(**bump):
+            continue
+        try:
+            with transaction.atomic():
+                DirtyProduct.objects.create(product_id=pid, first_event_at=now, last_event_at=now, event_count=n)
+        except IntegrityError:
+            # Otro proceso lo creó entre el update y el create
+            DirtyProduct.objects.filter(product_id=pid).update(**bump)
+    return list(counts)
+
+
+def ingest_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Valida todos los eventos y marca sus productos; un evento inválido rechaza el lote."""
+    product_ids = [event_product_id(e) for e in events]
+    products = mark_dirty(product_ids)
+    return {"accepted": len(product_ids), "products": products}
+
+
+def _ready_filter(now):
+    """
+    Listo para re-analizar: sin eventos durante REVIEW_EVENTS_DEBOUNCE_SECONDS,
+    o pendiente desde hace más de REVIEW_EVENTS_MAX_DELAY_SECONDS aunque
+    sigan llegando eventos.
+    """
+    debounce = timedelta(seconds=_setting("REVIEW_EVENTS_DEBOUNCE_SECONDS", 30))
+    max_delay = timedelta(seconds=_setting("REVIEW_EVENTS_MAX_DELAY_SECONDS", 300))
+    return Q(last_event_at__lte=now - debounce) | Q(first_event_at__lte=now - max_delay)
+
+
+def _free_filter(now):
+    return Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+
+
+def pending_products() -> List[Dict[str, Any]]:
+    now = timezone.now()
+    ready = set(DirtyProduct.objects.filter(_ready_filter(now)).values_list("pk", flat=True))
+    out = []
+    for row in DirtyProduct.objects.values(
+        "pk", "product_id", "first_event_at", "last_event_at", "event_count", "claimed_until", "attempts", "last_error"
+    ):
+        row["ready"] = row.pop("pk") in ready
+        out.append(row)
+    return out
+
+
+def process_dirty_products(force: bool = False, limit: int = 0) -> Dict[str, int]:
+    """
+    Re-analiza los productos pendientes listos (todos con force=True).
+
+    Cada producto se toma con un lease (claimed_until) para que varios
+    procesos no lo analicen a la vez. Si llegaron eventos nuevos durante el
+    análisis la fila no se borra y vuelve a procesarse tras el debounce.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=_setting("REVIEW_EVENTS_LEASE_SECONDS", 300))
+    qs = DirtyProduct.objects.filter(_free_filter(now))
+    if not force:
+        qs = qs.filter(_ready_filter(now))
+    candidates = list(qs.values_list("pk", "product_id", "last_event_at", "attempts"))
+    if limit > 0:
+        candidates = candidates[:limit]
+    stats = {"analyzed": 0, "skipped": 0, "failed": 0, "still_dirty": 0}
+    if not candidates:
+        return stats
+
+    if use_mirror():
+        try:
+            refresh_catalog_mirror()
+        except (CloudFunctionsError, DatabaseError) as exc:
+            # Se re-analiza con la última copia del espejo
+            logger.warning("No se pudo refrescar el espejo antes de re-analizar: %s", exc)
+
+    for pk, product_id, seen, attempts in candidates:
+        claim_now = timezone.now()
+        claimed = DirtyProduct.objects.filter(_free_filter(claim_now), pk=pk).update(claimed_until=claim_now + lease)
+        if not claimed:
+            continue
+        done = False
+        try:
+            _reanalyze(pk, product_id, seen, attempts, stats)
+            done = True
+        finally:
+            if not done:
+                # Error inesperado: se libera el lease para que la próxima pasada lo retome
+                DirtyProduct.objects.filter(pk=pk).update(claimed_until=None)
+    return stats
+
+
+def _reanalyze(pk: int, product_id: str, seen, attempts: int, stats: Dict[str, int]):
+    """Re-analiza un producto ya tomado y actualiza su fila según el resultado."""
+    try:
+        analyze_single_product(product_id)
+    except ProductNotFoundError:
+        # Sin producto o sin reseñas (incluye un 4xx de /resenas/producto/<id>): no hay nada que resumir
+        DirtyProduct.objects.filter(pk=pk, last_event_at=seen).delete()
+        stats["skipped"] += 1
+        return
+    except AnalysisError as exc:
+        backoff = timedelta(seconds=min(60 * 2 ** attempts, 3600))
+        DirtyProduct.objects.filter(pk=pk).update(
+            claimed_until=timezone.now() + backoff,
+            attempts=F("attempts") + 1,
+            last_error=str(exc),
+        )
+        stats["failed"] += 1
+        return
+    deleted, _ = DirtyProduct.objects.filter(pk=pk, last_event_at=seen).delete()
+    stats["analyzed"] += 1
+    if not deleted:
+        # Llegaron eventos mientras se analizaba: queda pendiente desde el último análisis
+        DirtyProduct.objects.filter(pk=pk).update(
+            claimed_until=None, first_event_at=seen, attempts=0, last_error=""
+        )
+        stats["still_dirty"] += 1
+
+
+def _worker_loop(poll_seconds: int):
+    while True:
+        time.sleep(poll_seconds)
+        try:
+            # Comparte el límite global con las corridas pedidas por la API
+            with heavy_controller().admit("review-events"):
+                process_dirty_products()
+        except AdmissionRejected:
+            continue
+        except Exception:
+            # Base sin migrar o error puntual: se reintenta en el próximo ciclo
+            logger.exception("Falló la pasada de eventos de reseñas")
+
+
+def start_worker(poll_seconds: int) -> threading.Thread:
+    t = threading.Thread(target=_worker_loop, args=(poll_seconds,), daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,452 @@
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from ..models import AnalysisShard, AnalysisShardEntry, AnalysisShardRun
+from . import firebase_client
+from .analysis_service import (
+    AnalysisError,
+    DEFAULT_RATING_THRESHOLD,
+    _analyze_product,
+    _fetch_catalog,
+    _fingerprint,
+    _product_stats,
+    build_run_results,
+    run_entry,
+)
+from .firebase_client import save_analysis_run
+
+
+logger = logging.getLogger(__name__)
+
+COORDINATORS = ("firestore", "database", "memory")
+
+
+class ShardingError(AnalysisError):
+    """La corrida particionada no existe o no se puede crear."""
+    pass
+
+
+def shard_for(product_key: str, num_shards: int) -> int:
+    """Shard de un producto: hash estable (igual en todos los procesos y nodos)."""
+    digest = hashlib.sha1(str(product_key).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+# --- Coordinadores ---
+#
+# Todos exponen la misma interfaz. Un shard se toma si está pendiente o si su
+# lease venció (el worker que lo tenía murió); cada producto terminado se
+# guarda en el shard, así quien lo retome no repite llamadas a Gemini.
+
+class FirestoreCoordinator:
+    """Leases en analysis_shards/<run_id>/shards; sirve para varios nodos."""
+
+    def create_run(self, run_id: str, data: Dict[str, Any], product_ids: List[List[str]]):
+        firebase_client.create_shard_run(run_id, data, product_ids)
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return firebase_client.get_shard_run(run_id)
+
+    def shard_product_ids(self, run_id: str) -> Dict[int, List[str]]:
+        return firebase_client.list_shard_product_ids(run_id)
+
+    def claim_shard(self, run_id: str, worker_id: str, lease_seconds: float) -> Optional[int]:
+        return firebase_client.claim_shard(run_id, worker_id, lease_seconds, time.time())
+
+    def renew_lease(self, run_id: str, index: int, worker_id: str, lease_seconds: float) -> bool:
+        return firebase_client.renew_shard_lease(run_id, index, worker_id, lease_seconds, time.time())
+
+    def record_entry(self, run_id: str, index: int, entry: Dict[str, Any]):
+        firebase_client.record_shard_product(run_id, index, entry["product_id"], entry)
+
+    def shard_entries(self, run_id: str, index: int) -> List[Dict[str, Any]]:
+        return firebase_client.list_shard_products(run_id, index)
+
+    def complete_shard(self, run_id: str, index: int, worker_id: str) -> bool:
+        return firebase_client.complete_shard(run_id, index, worker_id)
+
+    def list_shards(self, run_id: str, with_entries: bool = False) -> List[Dict[str, Any]]:
+        return firebase_client.list_shards(run_id, with_entries=with_entries)
+
+    def finalize(self, run_id: str, worker_id: str) -> bool:
+        return firebase_client.finalize_shard_run(run_id, worker_id)
+
+
+class DatabaseCoordinator:
+    """
+    Leases en la base de Django (SQLite por defecto); sirve para varios
+    procesos en la misma máquina. Cada toma de lease es un UPDATE condicional.
+    """
+
+    def create_run(self, run_id: str, data: Dict[str, Any], product_ids: List[List[str]]):
+        with transaction.atomic():
+            run = AnalysisShardRun.objects.create(
+                run_id=run_id,
+                num_shards=len(product_ids),
+                rating_threshold=data["rating_threshold"],
+                fingerprint=data["fingerprint"],
+                total_products=data["total_products"],
+                started_at=data["started_at"],
+            )
+            AnalysisShard.objects.bulk_create(
+                [AnalysisShard(run=run, index=i, product_ids=ids) for i, ids in enumerate(product_ids)]
+            )
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return AnalysisShardRun.objects.filter(run_id=run_id).values(
+            "run_id", "num_shards", "rating_threshold", "fingerprint",
+            "total_products", "started_at", "status", "finalized_by",
+        ).first()
+
+    def _shards(self, run_id: str):
+        return AnalysisShard.objects.filter(run__run_id=run_id)
+
+    def shard_product_ids(self, run_id: str) -> Dict[int, List[str]]:
+        return dict(self._shards(run_id).values_list("index", "product_ids"))
+
+    def claim_shard(self, run_id: str, worker_id: str, lease_seconds: float) -> Optional[int]:
+        now = time.time()
+        claimable = Q(status="pending") | Q(status="leased", lease_expires_at__lte=now)
+        for pk, index in self._shards(run_id).filter(claimable).values_list("pk", "index"):
+            claimed = AnalysisShard.objects.filter(claimable, pk=pk).update(
+                status="leased",
+                owner=worker_id,
+                lease_expires_at=now + lease_seconds,
+                attempts=F("attempts") + 1,
+            )
+            if claimed:
+                return index
+        return None
+
+    def renew_lease(self, run_id: str, index: int, worker_id: str, lease_seconds: float) -> bool:
+        return bool(
+            self._shards(run_id)
+            .filter(index=index, owner=worker_id, status="leased")
+            .update(lease_expires_at=time.time() + lease_seconds)
+        )
+
+    def record_entry(self, run_id: str, index: int, entry: Dict[str, Any]):
+        shard = self._shards(run_id).get(index=index)
+        AnalysisShardEntry.objects.update_or_create(
+            shard=shard, product_id=str(entry["product_id"]), defaults={"entry": entry}
+        )
+
+    def shard_entries(self, run_id: str, index: int) -> List[Dict[str, Any]]:
+        return list(
+            AnalysisShardEntry.objects.filter(shard__run__run_id=run_id, shard__index=index)
+            .values_list("entry", flat=True)
+        )
+
+    def complete_shard(self, run_id: str, index: int, worker_id: str) -> bool:
+        return bool(
+            self._shards(run_id)
+            .filter(index=index, owner=worker_id, status="leased")
+            .update(status="done")
+        )
+
+    def list_shards(self, run_id: str, with_entries: bool = False) -> List[Dict[str, Any]]:
+        shards = list(
+            self._shards(run_id).values("pk", "index", "status", "owner", "lease_expires_at", "attempts")
+        )
+        if with_entries:
+            entries: Dict[int, List[dict]] = {}
+            for shard_pk, entry in AnalysisShardEntry.objects.filter(
+                shard__run__run_id=run_id
+            ).values_list("shard_id", "entry"):
+                entries.setdefault(shard_pk, []).append(entry)
+            for s in shards:
+                s["products"] = entries.get(s["pk"], [])
+        for s in shards:
+            s.pop("pk")
+        return shards
+
+    def finalize(self, run_id: str, worker_id: str) -> bool:
+        return bool(
+            AnalysisShardRun.objects.filter(run_id=run_id, status="running")
+            .update(status="finalized", finalized_by=worker_id)
+        )
+
+
+class MemoryCoordinator:
+    """Leases en memoria del proceso: para pruebas y workers en hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[str, Dict[str, Any]] = {}
+
+    def create_run(self, run_id: str, data: Dict[str, Any], product_ids: List[List[str]]):
+        with self._lock:
+            self._runs[run_id] = {
+                **data,
+                "run_id": run_id,
+                "num_shards": len(product_ids),
+                "status": "running",
+                "shards": [
+                    {
+                        "index": i, "status": "pending", "owner": None, "lease_expires_at": 0, "attempts": 0,
+                        "product_ids": list(ids), "products": {},
+                    }
+                    for i, ids in enumerate(product_ids)
+                ],
+            }
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            run = self._runs.get(run_id)
+            return {k: v for k, v in run.items() if k != "shards"} if run else None
+
+    def shard_product_ids(self, run_id: str) -> Dict[int, List[str]]:
+        with self._lock:
+            return {s["index"]: list(s["product_ids"]) for s in self._runs[run_id]["shards"]}
+
+    def claim_shard(self, run_id: str, worker_id: str, lease_seconds: float) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            for shard in self._runs[run_id]["shards"]:
+                if shard["status"] == "pending" or (shard["status"] == "leased" and shard["lease_expires_at"] <= now):
+                    shard.update(status="leased", owner=worker_id, lease_expires_at=now + lease_seconds)
+                    shard["attempts"] += 1
+                    return shard["index"]
+        return None
+
+    def _owned(self, run_id: str, index: int, worker_id: str):
+        shard = self._runs[run_id]["shards"][index]
+        return shard if shard["owner"] == worker_id and shard["status"] == "leased" else None
+
+    def renew_lease(self, run_id: str, index: int, worker_id: str, lease_seconds: float) -> bool:
+        with self._lock:
+            shard = self._owned(run_id, index, worker_id)
+            if shard is None:
+                return False
+            shard["lease_expires_at"] = time.time() + lease_seconds
+            return True
+
+    def record_entry(self, run_id: str, index: int, entry: Dict[str, Any]):
+        with self._lock:
+            self._runs[run_id]["shards"][index]["products"][str(entry["product_id"])] = entry
+
+    def shard_entries(self, run_id: str, index: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._runs[run_id]["shards"][index]["products"].values())
+
+    def complete_shard(self, run_id: str, index: int, worker_id: str) -> bool:
+        with self._lock:
+            shard = self._owned(run_id, index, worker_id)
+            if shard is None:
+                return False
+            shard["status"] = "done"
+            return True
+
+    def list_shards(self, run_id: str, with_entries: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            out = []
+            for shard in self._runs.get(run_id, {}).get("shards", []):
+                d = {k: v for k, v in shard.items() if k not in ("products", "product_ids")}
+                if with_entries:
+                    d["products"] = list(shard["products"].values())
+                out.append(d)
+            return out
+
+    def finalize(self, run_id: str, worker_id: str) -> bool:
+        with self._lock:
+            run = self._runs[run_id]
+            if run["status"] != "running":
+                return False
+            run["status"] = "finalized"
+            run["finalized_by"] = worker_id
+            return True
+
+
+_memory_coordinator = MemoryCoordinator()
+
+
+def get_coordinator(name: Optional[str] = None):
+    """Coordinador por nombre (o ANALYSIS_SHARD_COORDINATOR)."""
+    name = name or getattr(settings, "ANALYSIS_SHARD_COORDINATOR", "firestore")
+    if name == "firestore":
+        return FirestoreCoordinator()
+    if name == "database":
+        return DatabaseCoordinator()
+    if name == "memory":
+        return _memory_coordinator
+    raise ShardingError(f"Coordinador desconocido: {name}")
+
+
+# --- Corridas ---
+
+def create_sharded_run(
+    num_shards: int,
+    rating_threshold: int = DEFAULT_RATING_THRESHOLD,
+    coordinator=None,
+) -> Dict[str, Any]:
+    """
+    Registra una corrida particionada en num_shards shards. Los productos
+    con reseñas de cada shard quedan fijados en el shard: si el catálogo
+    cambia durante la corrida, los workers analizan esos mismos productos
+    con sus reseñas actuales en lugar de repartir otra vez.
+    """
+    if num_shards <= 0:
+        raise ShardingError("num_shards debe ser mayor que cero.")
+    coordinator = coordinator or get_coordinator()
+    products, reviews_by_product, snapshot = _fetch_catalog()
+    product_ids: List[List[str]] = [[] for _ in range(num_shards)]
+    for p in products:
+        if reviews_by_product.get(p.key):
+            product_ids[shard_for(p.key, num_shards)].append(p.key)
+    run_id = uuid.uuid4().hex
+    data = {
+        "rating_threshold": rating_threshold,
+        "fingerprint": _fingerprint(snapshot, rating_threshold),
+        "total_products": len(products),
+        "started_at": datetime.utcnow().isoformat() + "Z",
+    }
+    coordinator.create_run(run_id, data, product_ids)
+    return {"run_id": run_id, "num_shards": num_shards, **data}
+
+
+def _shard_candidates(run: Dict[str, Any], coordinator) -> Dict[int, List[tuple]]:
+    """
+    Productos fijados en cada shard con sus reseñas actuales, en el orden de
+    origen. Si el catálogo cambió desde que se creó la corrida se omiten los
+    productos que ya no existen o se quedaron sin reseñas.
+    """
+    products, reviews_by_product, snapshot = _fetch_catalog()
+    if _fingerprint(snapshot, run["rating_threshold"]) != run["fingerprint"]:
+        logger.info("El catálogo cambió desde que se creó la corrida %s; se usan las reseñas actuales.", run["run_id"])
+    by_key = {p.key: p for p in products}
+    by_shard: Dict[int, List[tuple]] = {}
+    for index, ids in coordinator.shard_product_ids(run["run_id"]).items():
+        for key in ids:
+            p = by_key.get(str(key))
+            product_reviews = reviews_by_product.get(str(key), [])
+            if p is not None and product_reviews:
+                by_shard.setdefault(index, []).append((p, product_reviews))
+    return by_shard
+
+
+def run_shard_worker(
+    run_id: str,
+    coordinator=None,
+    worker_id: Optional[str] = None,
+    lease_seconds: Optional[float] = None,
+    wait: bool = True,
+    poll_seconds: float = 2.0,
+) -> Dict[str, Any]:
+    """
+    Toma shards de la corrida hasta que no queden disponibles y analiza sus
+    productos. Con wait=True sigue esperando mientras haya shards tomados por
+    otros workers, para retomar los que venzan. El worker que ve todos los
+    shards terminados escribe el registro combinado en analysis_runs.
+    """
+    coordinator = coordinator or get_coordinator()
+    worker_id = worker_id or default_worker_id()
+    if lease_seconds is None:
+        lease_seconds = getattr(settings, "ANALYSIS_SHARD_LEASE_SECONDS", 120)
+    run = coordinator.get_run(run_id)
+    if run is None:
+        raise ShardingError(f"No existe la corrida particionada {run_id}.")
+    by_shard = _shard_candidates(run, coordinator)
+    threshold = run["rating_threshold"]
+
+    claimed = []
+    analyzed = 0
+    while True:
+        index = coordinator.claim_shard(run_id, worker_id, lease_seconds)
+        if index is None:
+            pending = [s for s in coordinator.list_shards(run_id) if s["status"] != "done"]
+            if not pending or not wait:
+                break
+            time.sleep(poll_seconds)
+            continue
+        claimed.append(index)
+        # Productos que ya guardó un worker anterior con este shard
+        done = {str(e.get("product_id")) for e in coordinator.shard_entries(run_id, index)}
+        lost = False
+        for p, product_reviews in by_shard.get(index, []):
+            if p.key in done:
+                continue
+            if not coordinator.renew_lease(run_id, index, worker_id, lease_seconds):
+                # El lease venció y otro worker tomó el shard
+                lost = True
+                break
+            stats = _product_stats(product_reviews, threshold)
+            analysis_data = _analyze_product(p, product_reviews, stats, threshold)
+            coordinator.record_entry(run_id, index, run_entry(p, analysis_data))
+            analyzed += 1
+        if not lost:
+            coordinator.complete_shard(run_id, index, worker_id)
+
+    run_record = finalize_sharded_run(run_id, coordinator, worker_id, by_shard=by_shard)
+    return {
+        "run_id": run_id,
+        "worker_id": worker_id,
+        "shards": claimed,
+        "analyzed_count": analyzed,
+        "finalized": run_record is not None,
+    }
+
+
+def finalize_sharded_run(run_id: str, coordinator, worker_id: str, by_shard=None) -> Optional[Dict[str, Any]]:
+    """
+    Une las entradas de todos los shards en un único registro de
+    analysis_runs. Devuelve None si faltan shards o si otro worker ya lo hizo.
+
+    El registro se guarda antes de marcar la corrida como finalizada: si el
+    guardado falla la corrida sigue abierta y el próximo worker lo reintenta.
+    Dos workers que terminan a la vez pueden escribirlo los dos; como usa el
+    mismo ID de documento el resultado es el mismo.
+    """
+    shards = coordinator.list_shards(run_id, with_entries=True)
+    if not shards or any(s["status"] != "done" for s in shards):
+        return None
+    run = coordinator.get_run(run_id)
+    if run is None or run.get("status") != "running":
+        return None
+
+    entries_by_product = {str(e.get("product_id")): e for s in shards for e in s["products"]}
+    entries = []
+    if by_shard is not None:
+        # Orden de origen dentro de cada shard
+        for index in sorted(by_shard):
+            for p, _ in by_shard[index]:
+                entry = entries_by_product.pop(p.key, None)
+                if entry is not None:
+                    entries.append(entry)
+    entries.extend(entries_by_product.values())
+
+    started_at = run.get("started_at")
+    duration = None
+    try:
+        started = datetime.fromisoformat(str(started_at).replace("Z", ""))
+        duration = round((datetime.utcnow() - started).total_seconds(), 3)
+    except ValueError:
+        pass
+    record = {
+        "kind": "sharded",
+        **build_run_results(entries, run["rating_threshold"], run.get("total_products", 0)),
+        "num_shards": run["num_shards"],
+        "workers": sorted({s["owner"] for s in shards if s.get("owner")}),
+        "started_at": started_at,
+        "finished_at": datetime.utcnow().isoformat() + "Z",
+        "duration_seconds": duration,
+        "run_id": run_id,
+    }
+    save_analysis_run(record, run_id=run_id)
+    if not coordinator.finalize(run_id, worker_id):
+        return None
+    return record
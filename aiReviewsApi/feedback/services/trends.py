@@ -0,0 +1,116 @@
+from datetime import datetime
+from statistics import mean
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+
+# Orden de "biggest movers": nombre -> (campo guardado, descendente)
+MOVER_ORDERS = {
+    "movement": ("movement", True),                       # mayor cambio absoluto de calificación
+    "improving": ("avg_rating_delta", True),              # la calificación más subió
+    "worsening": ("avg_rating_delta", False),             # la calificación más bajó
+    "low_rating_ratio": ("low_rating_ratio_delta", True),  # más creció la proporción de reseñas malas
+    "velocity": ("review_velocity", True),                # más reseñas nuevas por día
+}
+
+# Campos del estado que se devuelven en los listados (sin la ventana de puntos)
+TREND_SUMMARY_FIELDS = [
+    "product_id",
+    "product_name",
+    "points",
+    "window_avg_rating",
+    "avg_rating",
+    "avg_rating_delta",
+    "movement",
+    "low_rating_ratio",
+    "low_rating_ratio_delta",
+    "review_velocity",
+    "total_reviews",
+    "last_entry_at",
+]
+
+
+def window_size() -> int:
+    return max(int(getattr(settings, "TRENDS_WINDOW_SIZE", 10)), 2)
+
+
+def _parse(ts: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def entry_point(entry_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Punto de la ventana a partir de una entrada de product_analysis_history."""
+    total = int(entry.get("total_reviews") or 0)
+    low = int(entry.get("low_rating_reviews_count") or 0)
+    return {
+        "id": entry_id,
+        "at": entry.get("created_at") or "",
+        "avg_rating": float(entry.get("avg_rating") or 0.0),
+        "total_reviews": total,
+        "low_rating_ratio": round(low / total, 4) if total else 0.0,
+    }
+
+
+def _review_velocity(oldest: Dict[str, Any], latest: Dict[str, Any]) -> float:
+    """Reseñas nuevas por día entre el punto más viejo y el más nuevo de la ventana."""
+    start, end = _parse(oldest["at"]), _parse(latest["at"])
+    if start is None or end is None:
+        return 0.0
+    days = (end - start).total_seconds() / 86400
+    if days <= 0:
+        return 0.0
+    return round((latest["total_reviews"] - oldest["total_reviews"]) / days, 4)
+
+
+def fold(
+    product_id: str,
+    state: Optional[Dict[str, Any]],
+    entries: Iterable[Tuple[str, Dict[str, Any]]],
+    size: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Incorpora entradas nuevas [(entry_id, entrada)] al estado de tendencia
+    de un producto y recalcula las métricas sobre los últimos size puntos.
+
+    Es idempotente: una entrada cuyo ID ya está en la ventana se ignora, así
+    que reaplicar una escritura reintentada no altera el estado. Los deltas
+    comparan el punto más nuevo con el más viejo de la ventana; con un solo
+    punto valen 0 (nunca null, para que ordenen bien en Firestore).
+    """
+    size = size or window_size()
+    window: List[Dict[str, Any]] = list((state or {}).get("window") or [])
+    seen = {p["id"] for p in window}
+    name = (state or {}).get("product_name")
+    for entry_id, entry in entries:
+        name = entry.get("product_name") or name
+        if entry_id in seen:
+            continue
+        seen.add(entry_id)
+        window.append(entry_point(entry_id, entry))
+    window = sorted(window, key=lambda p: p["at"])[-size:]
+    if not window:
+        return {"product_id": str(product_id), "product_name": name, "points": 0, "window": []}
+
+    oldest, latest = window[0], window[-1]
+    rating_delta = round(latest["avg_rating"] - oldest["avg_rating"], 4)
+    return {
+        "product_id": str(product_id),
+        "product_name": name,
+        "points": len(window),
+        "window": window,
+        "window_avg_rating": round(mean(p["avg_rating"] for p in window), 4),
+        "avg_rating": latest["avg_rating"],
+        "avg_rating_delta": rating_delta,
+        "movement": abs(rating_delta),
+        "low_rating_ratio": latest["low_rating_ratio"],
+        "low_rating_ratio_delta": round(latest["low_rating_ratio"] - oldest["low_rating_ratio"], 4),
+        "review_velocity": _review_velocity(oldest, latest),
+        "total_reviews": latest["total_reviews"],
+        "first_entry_at": oldest["at"],
+        "last_entry_at": latest["at"],
+        "updated_at": datetime.utcnow().isoformat() + "Z",
+    }
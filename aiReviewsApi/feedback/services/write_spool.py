@@ -0,0 +1,231 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from google.api_core import exceptions as api_exceptions
+
+from ..models import SpooledWrite, SpoolFlushLease
+from .firebase_client import DEFERRED_WRITES, apply_writes
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "firestore"
+# Un batch de Firestore puede tardar; el lease se renueva antes de cada uno
+LEASE_SECONDS = 120
+
+_owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+_lock = threading.Lock()
+# El hilo y el vaciado al salir comparten el lease (mismo owner): no deben correr a la vez
+_flush_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+_stats: Dict[str, Any] = {
+    "enqueued": 0,
+    "flushed": 0,
+    "batches": 0,
+    "dead": 0,
+    "failures": 0,
+    "consecutive_failures": 0,
+    "last_flush_at": None,
+    "last_error": None,
+}
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def enabled() -> bool:
+    return bool(_setting("FIRESTORE_WRITE_BEHIND", False)) and _setting("FIRESTORE_DB", None) is not None
+
+
+def _bump(**changes):
+    with _lock:
+        for key, value in changes.items():
+            _stats[key] = _stats[key] + value if isinstance(value, int) else value
+
+
+def enqueue(kind: str, payload: Dict[str, Any]) -> int:
+    """Guarda la escritura en el spool (SQLite) y devuelve su id; no espera a Firestore."""
+    if kind not in DEFERRED_WRITES:
+        raise ValueError(f"Tipo de escritura desconocido: {kind}")
+    row = SpooledWrite.objects.create(kind=kind, payload=payload)
+    _bump(enqueued=1)
+    start_flusher()
+    return row.pk
+
+
+# --- Flush ---
+
+def _is_permanent(exc: Exception) -> bool:
+    """
+    Errores que no se arreglan reintentando: payload inválido o un 4xx de
+    Firestore (salvo 429 y 409, que son contención).
+    """
+    if isinstance(exc, (KeyError, TypeError, ValueError)):
+        return True
+    return isinstance(exc, api_exceptions.ClientError) and not isinstance(
+        exc, (api_exceptions.TooManyRequests, api_exceptions.Conflict)
+    )
+
+
+def _acquire_lease() -> bool:
+    now = time.time()
+    expires = now + LEASE_SECONDS
+    free = Q(owner=_owner) | Q(expires_at__lt=now)
+    if SpoolFlushLease.objects.filter(free, name=LEASE_NAME).update(owner=_owner, expires_at=expires):
+        return True
+    try:
+        # Savepoint: si el create pierde la carrera no invalida una transacción abierta
+        with transaction.atomic():
+            SpoolFlushLease.objects.create(name=LEASE_NAME, owner=_owner, expires_at=expires)
+        return True
+    except IntegrityError:
+        # Otro proceso tiene el lease vigente
+        return False
+
+
+def _release_lease():
+    SpoolFlushLease.objects.filter(name=LEASE_NAME, owner=_owner).update(expires_at=0)
+
+
+def _mark_dead(row: SpooledWrite, exc: Exception):
+    SpooledWrite.objects.filter(pk=row.pk).update(
+        status="dead", attempts=F("attempts") + 1, last_error=repr(exc)
+    )
+    _bump(dead=1)
+    logger.error("Escritura %s #%s descartada del spool: %r", row.kind, row.pk, exc)
+
+
+def _commit(rows: List[SpooledWrite]):
+    apply_writes([(row.kind, row.payload) for row in rows])
+    SpooledWrite.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    _bump(flushed=len(rows), batches=1, last_flush_at=datetime.utcnow().isoformat() + "Z")
+    with _lock:
+        _stats["consecutive_failures"] = 0
+
+
+def flush(deadline: Optional[float] = None) -> int:
+    """
+    Vacía el spool en orden de id, de a FIRESTORE_SPOOL_BATCH_ROWS filas
+    por commit. Se detiene ante el primer error transitorio (así nunca se
+    confirma una escritura más nueva antes que una anterior del mismo
+    documento) y lo propaga. Devuelve las filas confirmadas.
+    """
+    with _flush_lock:
+        if not _acquire_lease():
+            return 0
+        try:
+            return _drain(deadline)
+        finally:
+            _release_lease()
+
+
+def _drain(deadline: Optional[float]) -> int:
+    batch_rows = max(int(_setting("FIRESTORE_SPOOL_BATCH_ROWS", 100)), 1)
+    flushed = 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = list(SpooledWrite.objects.filter(status="pending")[:batch_rows])
+        if not rows:
+            break
+        try:
+            _commit(rows)
+            flushed += len(rows)
+        except Exception as exc:
+            if not _is_permanent(exc):
+                SpooledWrite.objects.filter(pk__in=[row.pk for row in rows]).update(
+                    attempts=F("attempts") + 1, last_error=repr(exc)
+                )
+                raise
+            # Uno de los payloads es inválido: se confirman de a uno para aislarlo
+            for row in rows:
+                try:
+                    _commit([row])
+                    flushed += 1
+                except Exception as row_exc:
+                    if not _is_permanent(row_exc):
+                        raise
+                    _mark_dead(row, row_exc)
+        if not _acquire_lease():
+            # El lease venció y lo tomó otro proceso: sigue él
+            break
+    return flushed
+
+
+def _flusher_loop():
+    interval = float(_setting("FIRESTORE_SPOOL_FLUSH_INTERVAL", 1.0))
+    max_backoff = float(_setting("FIRESTORE_SPOOL_MAX_BACKOFF", 300))
+    delay = interval
+    while True:
+        time.sleep(delay)
+        try:
+            flush()
+            delay = interval
+        except Exception as exc:
+            # Firestore no responde: reintento con espera exponencial sin perder filas
+            _bump(failures=1, consecutive_failures=1, last_error=repr(exc))
+            delay = min(interval * 2 ** _stats["consecutive_failures"], max_backoff)
+            logger.warning("Flush del spool falló (reintento en %.0fs): %r", delay, exc)
+
+
+def _drain_at_exit():
+    timeout = float(_setting("FIRESTORE_SPOOL_EXIT_TIMEOUT", 10))
+    if timeout <= 0:
+        return
+    try:
+        flush(deadline=time.monotonic() + timeout)
+    except Exception as exc:
+        logger.warning("Quedaron escrituras en el spool al salir: %r", exc)
+
+
+def start_flusher() -> Optional[threading.Thread]:
+    """
+    Arranca (una vez por proceso) el hilo que vacía el spool. Al salir el
+    proceso se intenta vaciarlo hasta FIRESTORE_SPOOL_EXIT_TIMEOUT segundos;
+    lo que quede se envía la próxima vez que arranque un flusher.
+    """
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flusher_loop, daemon=True)
+            _flusher.start()
+            atexit.register(_drain_at_exit)
+        return _flusher
+
+
+# --- Métricas ---
+
+def requeue_dead() -> int:
+    return SpooledWrite.objects.filter(status="dead").update(status="pending", attempts=0)
+
+
+def snapshot() -> Dict[str, Any]:
+    """
+    depth: escrituras pendientes; lag_seconds: antigüedad de la más vieja
+    (cuánto atrasa Firestore respecto de lo ya calculado). Los contadores
+    son de este proceso.
+    """
+    pending = SpooledWrite.objects.filter(status="pending")
+    oldest = pending.values_list("created_at", flat=True).first()
+    lag = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+    lease = SpoolFlushLease.objects.filter(name=LEASE_NAME).values("owner", "expires_at").first()
+    with _lock:
+        stats = dict(_stats)
+    return {
+        "enabled": enabled(),
+        "depth": pending.count(),
+        "dead_count": SpooledWrite.objects.filter(status="dead").count(),
+        "lag_seconds": round(max(lag, 0.0), 3),
+        "flusher_running": _flusher is not None,
+        "flusher_owner": lease["owner"] if lease and lease["expires_at"] > time.time() else None,
+        **stats,
+    }
@@ -1,3 +1,1814 @@
-from django.test import TestCase
+import copy
+import csv
+import gzip
+import hashlib
+import io
+import json
+import operator
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipIf
 
-# Create your tests here.
+import requests
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from firebase_admin import firestore
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1.transaction import Transaction
+
+from .middleware import CompressionMiddleware, brotli
+from .models import DirtyProduct, SpooledWrite, SpoolFlushLease
+from .renderers import FastJSONRenderer, RawJSON
+from .services import (
+    analysis_service,
+    catalog_mirror,
+    cloud_functions_client,
+    exporter,
+    firebase_client,
+    gemini_client,
+    profiling,
+    response_cache,
+    review_events,
+    sharding,
+    trends,
+    write_spool,
+)
+from .services.admission import AdmissionController, AdmissionRejected
+from .services.catalog_index import (
+    CatalogQueryError,
+    _build_reviews_index,
+    decode_cursor,
+    encode_cursor,
+    query_index,
+)
+from .services.history_retention import RetentionPolicy, compact_product_history, select_entries_to_delete
+from .services.records import (
+    group_reviews_by_product,
+    normalize_product,
+    normalize_products,
+    normalize_review,
+)
+from .throttling import TokenBucketThrottle
+
+
+def _review(review_id, product_id, rating=5, comment="ok"):
+    return {"id": review_id, "product_id": product_id, "rating": rating, "comment": comment}
+
+
+class FakeBatch:
+    """Batch de Firestore que registra sus sets y cuenta los commits en el db."""
+
+    def __init__(self, db):
+        self.db = db
+        self.sets = []
+
+    def set(self, ref, data, merge=False):
+        self.sets.append((ref, data))
+
+    def commit(self):
+        with self.db.lock:
+            self.db.commits.append(self.sets)
+
+
+def _fake_db():
+    db = mock.MagicMock()
+    db.lock = threading.Lock()
+    db.commits = []
+    db.batch.side_effect = lambda: FakeBatch(db)
+    return db
+
+
+class SaveProductsCommentsBulkTests(SimpleTestCase):
+    def test_splits_writes_into_batches(self):
+        db = _fake_db()
+        comments = {"1": [{"comment": f"c{i}"} for i in range(7)], "2": [{"comment": "x"}] * 3}
+        with override_settings(FIRESTORE_DB=db), mock.patch.object(firebase_client, "BATCH_MAX_WRITES", 4):
+            saved = firebase_client.save_products_comments_bulk(comments)
+        self.assertEqual(saved, {"1": 7, "2": 3})
+        self.assertEqual(sorted(len(c) for c in db.commits), [2, 4, 4])
+        # Todos los comentarios de una llamada llevan la misma fecha por batch
+        self.assertTrue(all(data["created_at"] for commit in db.commits for _, data in commit))
+
+    def test_products_without_comments_report_zero(self):
+        with override_settings(FIRESTORE_DB=_fake_db()):
+            self.assertEqual(firebase_client.save_products_comments_bulk({"9": []}), {"9": 0})
+
+
+class SyncProductsCommentsViewTests(SimpleTestCase):
+    url = "/api/comentarios/productos/sync/"
+
+    def setUp(self):
+        reviews = [_review(1, 1), _review(2, 1), _review(3, 2), _review(4, 3)]
+        patcher = mock.patch("feedback.views_analysis.get_all_reviews", return_value=reviews)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = _fake_db()
+        settings_override = override_settings(FIRESTORE_DB=self.db)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post(self, body):
+        return self.client.post(self.url, body, content_type="application/json")
+
+    def test_without_ids_syncs_the_whole_catalog(self):
+        response = self.post({})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["per_product"], {"1": 2, "2": 1, "3": 1})
+        self.assertEqual(response.json()["saved"], 4)
+
+    def test_syncs_only_the_requested_subset(self):
+        response = self.post({"product_ids": [2, "1"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["per_product"], {"2": 1, "1": 2})
+        written = [data["product_id"] for commit in self.db.commits for _, data in commit]
+        self.assertNotIn(3, written)
+
+    def test_unknown_ids_are_reported_with_zero(self):
+        response = self.post({"product_ids": [1, 99]})
+        self.assertEqual(response.json()["per_product"], {"1": 2, "99": 0})
+        self.assertEqual(response.json()["products"], 2)
+
+    def test_empty_list_is_rejected(self):
+        response = self.post({"product_ids": []})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.db.commits, [])
+
+    def test_product_ids_must_be_a_list(self):
+        self.assertEqual(self.post({"product_ids": "1,2"}).status_code, 400)
+
+    def test_upstream_failure_is_a_bad_gateway(self):
+        with mock.patch("feedback.views_analysis.get_all_reviews", side_effect=RuntimeError("caído")):
+            self.assertEqual(self.post({}).status_code, 502)
+
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_store_then_hit(self):
+        entry, gen = response_cache.get_entry(response_cache.PRODUCT_TREND, ("1",))
+        self.assertIsNone(entry)
+        stored = response_cache.store_entry(response_cache.PRODUCT_TREND, ("1",), gen, b'{"a": 1}')
+        hit, _ = response_cache.get_entry(response_cache.PRODUCT_TREND, ("1",))
+        self.assertEqual(hit["etag"], stored["etag"])
+        self.assertEqual(hit["body"], b'{"a": 1}')
+
+    def test_invalidate_drops_every_variant(self):
+        name, parts = response_cache.ANALYSIS_HISTORY, ("1",)
+        _, gen = response_cache.get_entry(name, parts, variant=(1,))
+        response_cache.store_entry(name, parts, gen, b"p1", variant=(1,))
+        response_cache.store_entry(name, parts, gen, b"p2", variant=(2,))
+        response_cache.invalidate_product_history("1")
+        self.assertIsNone(response_cache.get_entry(name, parts, variant=(1,))[0])
+        self.assertIsNone(response_cache.get_entry(name, parts, variant=(2,))[0])
+
+    def test_entry_read_before_an_invalidation_is_never_served(self):
+        name, parts = response_cache.ANALYSIS_SUMMARY, ("1",)
+        _, gen = response_cache.get_entry(name, parts)
+        # Se escribe Firestore e invalida mientras la lectura estaba en curso
+        response_cache.invalidate_product_analysis("1")
+        response_cache.store_entry(name, parts, gen, b"viejo")
+        self.assertIsNone(response_cache.get_entry(name, parts)[0])
+
+    def test_invalidation_only_touches_its_resource(self):
+        _, gen = response_cache.get_entry(response_cache.ANALYSIS_SUMMARY, ("2",))
+        response_cache.store_entry(response_cache.ANALYSIS_SUMMARY, ("2",), gen, b"otro")
+        response_cache.invalidate_product_analysis("1")
+        self.assertIsNotNone(response_cache.get_entry(response_cache.ANALYSIS_SUMMARY, ("2",))[0])
+
+    def test_entries_do_not_expire_unless_a_ttl_is_set(self):
+        with mock.patch.object(response_cache.cache, "set") as cache_set:
+            response_cache.store_entry(response_cache.ANALYSIS_SUMMARY, ("1",), 0, b"{}")
+            with override_settings(RESPONSE_CACHE_TTL=60):
+                response_cache.store_entry(response_cache.ANALYSIS_SUMMARY, ("1",), 0, b"{}")
+        self.assertEqual([c.kwargs["timeout"] for c in cache_set.call_args_list], [None, 60])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CachedSummaryViewTests(SimpleTestCase):
+    url = "/api/analisis/productos/1/resumen/"
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        patcher = mock.patch("feedback.views_analysis.get_product_analysis", return_value={"summary": "bien"})
+        self.read = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_second_request_is_served_from_the_cache(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.read.call_count, 1)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidation_forces_a_new_read(self):
+        self.client.get(self.url)
+        response_cache.invalidate_product_analysis(1)
+        self.read.return_value = {"summary": "mal"}
+        self.assertEqual(self.client.get(self.url).json()["summary"], "mal")
+
+    def test_missing_analysis_is_not_cached(self):
+        self.read.return_value = None
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.get(self.url)
+        self.assertEqual(self.read.call_count, 2)
+
+
+# --- Firestore en memoria ---
+
+class FakeAggregate:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeQuery:
+    """Consulta sobre una colección (path) o un grupo de colecciones (group)."""
+
+    _OPS = {
+        "==": operator.eq,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "<": operator.lt,
+        "<=": operator.le,
+    }
+
+    def __init__(self, db, path=None, group=None, filters=(), orders=(), skip=0, size=None, after=None):
+        self._db = db
+        self._path = path
+        self._group = group
+        self._filters = filters
+        self._orders = orders
+        self._skip = skip
+        self._size = size
+        self._after = after
+
+    def _with(self, **changes):
+        state = {
+            "path": self._path, "group": self._group, "filters": self._filters, "orders": self._orders,
+            "skip": self._skip, "size": self._size, "after": self._after,
+        }
+        state.update(changes)
+        return FakeQuery(self._db, **state)
+
+    def select(self, fields):
+        return self._with()
+
+    def where(self, filter):
+        return self._with(filters=self._filters + ((filter.field_path, filter.op_string, filter.value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._with(orders=self._orders + ((field, direction == "DESCENDING"),))
+
+    def offset(self, n):
+        return self._with(skip=n)
+
+    def limit(self, n):
+        return self._with(size=n)
+
+    def start_after(self, snapshot):
+        return self._with(after=snapshot.reference._path)
+
+    def _matches(self):
+        with self._db.lock:
+            docs = [
+                (path, data) for path, data in self._db.docs.items()
+                if (path[:-1] == self._path if self._group is None else path[-2] == self._group)
+            ]
+        for field, op, value in self._filters:
+            docs = [(p, d) for p, d in docs if field in d and self._OPS[op](d[field], value)]
+        # Como Firestore, order_by deja afuera los documentos sin ese campo
+        for field, _ in self._orders:
+            docs = [(p, d) for p, d in docs if field in d]
+        for field, descending in reversed(self._orders):
+            docs.sort(key=lambda doc: doc[1][field], reverse=descending)
+        return docs
+
+    def stream(self, transaction=None):
+        docs = self._matches()
+        if self._after is not None:
+            paths = [p for p, _ in docs]
+            docs = docs[paths.index(self._after) + 1:]
+        docs = docs[self._skip:]
+        if self._size is not None:
+            docs = docs[:self._size]
+        return iter([FakeSnapshot(FakeDocument(self._db, p), copy.deepcopy(d)) for p, d in docs])
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def count(self):
+        total = len(self._matches())
+        return mock.Mock(get=lambda: [[FakeAggregate(total)]])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path=path)
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return FakeDocument(self._db, self._path[:-1]) if len(self._path) > 1 else None
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._db, self._path + (str(doc_id or uuid.uuid4().hex),))
+
+    def list_documents(self):
+        depth = len(self._path)
+        ids = {p[depth] for p in self._db.docs if len(p) > depth and p[:depth] == self._path}
+        return [self.document(doc_id) for doc_id in sorted(ids)]
+
+
+def _apply_fields(current, data):
+    for key, value in data.items():
+        if isinstance(value, firestore.Increment):
+            value = (current.get(key) or 0) + value.value
+        current[key] = value
+    return current
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return FakeCollection(self._db, self._path[:-1])
+
+    def collection(self, name):
+        return FakeCollection(self._db, self._path + (name,))
+
+    def get(self, transaction=None, field_paths=None):
+        with self._db.lock:
+            data = self._db.docs.get(self._path)
+        return FakeSnapshot(self, copy.deepcopy(data))
+
+    def set(self, data, merge=False):
+        with self._db.lock:
+            current = dict(self._db.docs.get(self._path) or {}) if merge else {}
+            self._db.docs[self._path] = _apply_fields(current, copy.deepcopy(data))
+
+    def update(self, data):
+        with self._db.lock:
+            if self._path not in self._db.docs:
+                raise api_exceptions.NotFound(f"No existe {'/'.join(self._path)}")
+            _apply_fields(self._db.docs[self._path], copy.deepcopy(data))
+
+    def delete(self):
+        with self._db.lock:
+            self._db.docs.pop(self._path, None)
+
+
+class FakeWriteBatch:
+    """Acumula las escrituras y las aplica todas juntas en commit()."""
+
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data):
+        self._ops.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def commit(self):
+        self._db.commits.append(len(self._ops))
+        for op in self._ops:
+            op()
+
+
+class FakeTransaction(Transaction):
+    """Transacción que usa firestore.transactional real sobre el db en memoria."""
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._db = db
+        self._ops = []
+
+    def _begin(self, retry_id=None):
+        self._id = b"fake"
+        self._ops = []
+
+    def _commit(self):
+        for op in self._ops:
+            op()
+        self._ops = []
+        self._clean_up()
+        return []
+
+    def _rollback(self):
+        self._ops = []
+        self._clean_up()
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data, option=None):
+        self._ops.append(lambda: ref.update(data))
+
+    def delete(self, ref, option=None):
+        self._ops.append(ref.delete)
+
+
+class FakeFirestore:
+    """Cliente de Firestore en memoria con lo que usa firebase_client."""
+
+    def __init__(self):
+        self.docs = {}
+        self.commits = []
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def collection_group(self, name):
+        return FakeQuery(self, group=name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def get_all(self, refs, field_paths=None):
+        return [ref.get() for ref in refs]
+
+    def data(self, *path):
+        return self.docs.get(tuple(str(p) for p in path))
+
+
+class FirestoreTestCase(SimpleTestCase):
+    """Tests contra FakeFirestore, con escrituras directas y caché local."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        self.db = FakeFirestore()
+        settings_override = override_settings(
+            FIRESTORE_DB=self.db, FIRESTORE_WRITE_BEHIND=False, CACHES=LOCMEM_CACHE, CATALOG_SOURCE="upstream"
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+
+class SaveAnalysisRunTests(FirestoreTestCase):
+
+    def run_data(self):
+        return {
+            "kind": "full",
+            "rating_threshold": 3,
+            "analyzed_count": 2,
+            "run_id": "ignorado",
+            "analyzed_products": ["1", "2"],
+            "summaries": [{"product_id": 1, "summary": "flojo"}, {"product_id": 2, "summary": "roto"}],
+            "general_summaries": [{"product_id": 1, "general_opinion": "bien"}],
+        }
+
+    def test_header_keeps_only_the_light_fields(self):
+        run_id = firebase_client.save_analysis_run(self.run_data(), run_id="r1")
+        header = self.db.data(firebase_client.RUNS_COLLECTION, run_id)
+        self.assertEqual(run_id, "r1")
+        self.assertEqual(header["results_count"], 2)
+        self.assertEqual(header["rating_threshold"], 3)
+        self.assertTrue(header["created_at"].endswith("Z"))
+        for key in ("summaries", "general_summaries", "analyzed_products", "run_id"):
+            self.assertNotIn(key, header)
+
+    def test_results_are_one_document_per_product(self):
+        firebase_client.save_analysis_run(self.run_data(), run_id="r1")
+        results = firebase_client.RUN_RESULTS_SUBCOLLECTION
+        first = self.db.data(firebase_client.RUNS_COLLECTION, "r1", results, "1")
+        self.assertEqual(first, {"product_id": 1, "summary": "flojo", "general_opinion": "bien"})
+        self.assertEqual(self.db.data(firebase_client.RUNS_COLLECTION, "r1", results, "2")["summary"], "roto")
+
+    def test_get_returns_the_merged_results(self):
+        run_id = firebase_client.save_analysis_run(self.run_data())
+        run = firebase_client.get_analysis_run(run_id)
+        self.assertEqual(run["results_count"], 2)
+        self.assertEqual(sorted(str(r["product_id"]) for r in run["results"]), ["1", "2"])
+
+    def test_get_reads_runs_saved_in_the_old_format(self):
+        legacy = self.run_data()
+        self.db.collection(firebase_client.RUNS_COLLECTION).document("viejo").set(legacy)
+        run = firebase_client.get_analysis_run("viejo")
+        by_product = {str(r["product_id"]): r for r in run["results"]}
+        self.assertEqual(by_product["1"]["general_opinion"], "bien")
+        self.assertEqual(by_product["2"]["summary"], "roto")
+
+    def test_missing_run_is_none(self):
+        self.assertIsNone(firebase_client.get_analysis_run("nada"))
+
+
+NOW = datetime(2026, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _history(count, step=timedelta(hours=1), text=None):
+    """Entradas de historial del más reciente al más antiguo, cada una con un texto distinto."""
+    return [
+        {
+            "id": f"e{i}",
+            "created_at": (NOW - step * i).isoformat(),
+            "summary": text if text is not None else f"resumen {i}",
+            "general_opinion": "",
+        }
+        for i in range(count)
+    ]
+
+
+class SelectEntriesToDeleteTests(SimpleTestCase):
+    def policy(self, **kwargs):
+        options = {
+            "keep_last": 2, "downsample": "", "collapse_identical": False,
+            "max_age_days": 0, "max_entries": 0,
+        }
+        options.update(kwargs)
+        return RetentionPolicy(**options)
+
+    def test_keeps_everything_without_limits(self):
+        self.assertEqual(select_entries_to_delete(_history(10), self.policy(), now=NOW), [])
+
+    def test_collapses_identical_entries_outside_keep_last(self):
+        entries = _history(5, text="igual")
+        deleted = select_entries_to_delete(entries, self.policy(collapse_identical=True), now=NOW)
+        # Las dos recientes quedan intactas; las demás repiten el texto de la conservada
+        self.assertEqual(deleted, ["e2", "e3", "e4"])
+
+    def test_downsamples_older_entries_daily(self):
+        entries = _history(6, step=timedelta(hours=6))
+        deleted = select_entries_to_delete(entries, self.policy(downsample="daily"), now=NOW)
+        # e2 (00:00) y e3 (18:00 del día anterior) abren su día; e4 y e5 caen en el día de e3
+        self.assertEqual(deleted, ["e4", "e5"])
+
+    def test_deletes_entries_older_than_max_age(self):
+        entries = _history(5, step=timedelta(days=100))
+        deleted = select_entries_to_delete(entries, self.policy(max_age_days=250), now=NOW)
+        self.assertEqual(deleted, ["e3", "e4"])
+
+    def test_max_age_never_touches_keep_last(self):
+        entries = _history(3, step=timedelta(days=1000))
+        deleted = select_entries_to_delete(entries, self.policy(keep_last=3, max_age_days=1), now=NOW)
+        self.assertEqual(deleted, [])
+
+    def test_caps_total_entries(self):
+        entries = _history(800)
+        deleted = select_entries_to_delete(entries, self.policy(keep_last=5, max_entries=20), now=NOW)
+        self.assertEqual(len(entries) - len(deleted), 20)
+        self.assertEqual(deleted[0], "e20")
+
+    def test_naive_timestamps_are_utc(self):
+        entries = _history(3, step=timedelta(days=10))
+        for entry in entries:
+            entry["created_at"] = entry["created_at"].replace("+00:00", "")
+        deleted = select_entries_to_delete(entries, self.policy(keep_last=0, max_age_days=15), now=NOW)
+        self.assertEqual(deleted, ["e2"])
+
+    def test_compaction_deletes_the_selected_entries(self):
+        db = FakeFirestore()
+        runs = db.collection(firebase_client.HISTORY_COLLECTION).document("7").collection("runs")
+        for entry in _history(4, text="igual"):
+            runs.document(entry.pop("id")).set(entry)
+        with override_settings(FIRESTORE_DB=db, CACHES=LOCMEM_CACHE):
+            deleted = compact_product_history("7", self.policy(keep_last=1, collapse_identical=True))
+        self.assertEqual(deleted, 3)
+        self.assertEqual([ref.id for ref in runs.list_documents()], ["e0"])
+
+
+def _history_entry(day, avg_rating, total_reviews, low=0):
+    return {
+        "product_name": "Figura",
+        "avg_rating": avg_rating,
+        "total_reviews": total_reviews,
+        "low_rating_reviews_count": low,
+        "created_at": f"2026-01-{day:02d}T00:00:00Z",
+    }
+
+
+class TrendFoldTests(SimpleTestCase):
+    def test_single_point_has_zero_deltas(self):
+        state = trends.fold("1", None, [("a", _history_entry(1, 4.0, 10))], size=5)
+        self.assertEqual(state["points"], 1)
+        self.assertEqual(state["avg_rating_delta"], 0.0)
+        self.assertEqual(state["movement"], 0.0)
+        self.assertEqual(state["review_velocity"], 0.0)
+
+    def test_deltas_compare_newest_with_oldest(self):
+        state = trends.fold("1", None, [
+            ("a", _history_entry(1, 4.0, 10, low=1)),
+            ("b", _history_entry(3, 3.0, 30, low=6)),
+        ], size=5)
+        self.assertEqual(state["avg_rating_delta"], -1.0)
+        self.assertEqual(state["movement"], 1.0)
+        self.assertEqual(state["low_rating_ratio_delta"], 0.1)
+        self.assertEqual(state["review_velocity"], 10.0)
+        self.assertEqual(state["window_avg_rating"], 3.5)
+
+    def test_fold_is_idempotent_by_entry_id(self):
+        state = trends.fold("1", None, [("a", _history_entry(1, 4.0, 10))], size=5)
+        again = trends.fold("1", state, [("a", _history_entry(1, 4.0, 10))], size=5)
+        self.assertEqual(again["window"], state["window"])
+
+    def test_window_keeps_the_latest_points(self):
+        state = None
+        for day in range(1, 8):
+            state = trends.fold("1", state, [(f"e{day}", _history_entry(day, float(day % 5), day))], size=3)
+        self.assertEqual([p["id"] for p in state["window"]], ["e5", "e6", "e7"])
+        self.assertEqual(state["first_entry_at"], "2026-01-05T00:00:00Z")
+
+    def test_out_of_order_entries_are_sorted_by_date(self):
+        state = trends.fold("1", None, [
+            ("b", _history_entry(2, 2.0, 20)),
+            ("a", _history_entry(1, 4.0, 10)),
+        ], size=5)
+        self.assertEqual(state["avg_rating"], 2.0)
+        self.assertEqual(state["avg_rating_delta"], -2.0)
+
+
+class ConflictingTransaction(FakeTransaction):
+    """Simula otro proceso que escribe antes del primer commit, que Firestore aborta."""
+
+    def __init__(self, db, conflict):
+        super().__init__(db)
+        self._conflict = conflict
+
+    def _commit(self):
+        if self._conflict is not None:
+            conflict, self._conflict = self._conflict, None
+            self._ops = []
+            conflict()
+            raise api_exceptions.Aborted("conflicto")
+        return super()._commit()
+
+
+class TrendUpdateTests(FirestoreTestCase):
+    def history(self, entry_id, day, avg_rating, total_reviews):
+        return ("analysis_history", {"product_id": "1", "entry_id": entry_id, "data": _history_entry(day, avg_rating, total_reviews)})
+
+    def trend(self):
+        return self.db.data(firebase_client.TRENDS_COLLECTION, "1")
+
+    def test_history_writes_fold_into_the_trend(self):
+        items = [self.history("a", 1, 4.0, 10), self.history("b", 2, 3.0, 20)]
+        firebase_client.apply_writes(items)
+        self.assertEqual([p["id"] for p in self.trend()["window"]], ["a", "b"])
+        self.assertEqual(self.trend()["avg_rating_delta"], -1.0)
+        # Reintentar los mismos items (spool) no duplica puntos
+        firebase_client.apply_writes(items)
+        self.assertEqual(self.trend()["points"], 2)
+
+    def test_concurrent_update_is_retried_with_the_new_state(self):
+        trend_ref = self.db.collection(firebase_client.TRENDS_COLLECTION).document("1")
+
+        def other_process():
+            trend_ref.set(trends.fold("1", None, [("x", _history_entry(1, 5.0, 5))]))
+
+        transaction = ConflictingTransaction(self.db, other_process)
+        with mock.patch.object(self.db, "transaction", return_value=transaction):
+            firebase_client.apply_writes([self.history("a", 2, 4.0, 10)])
+        self.assertEqual([p["id"] for p in self.trend()["window"]], ["x", "a"])
+
+
+class RecordsTests(SimpleTestCase):
+    def test_product_accepts_spanish_field_names(self):
+        product = normalize_product({"id_producto": 7, "nombre": "Goku", "descripcion": "Figura"})
+        self.assertEqual((product.key, product.name, product.description), ("7", "Goku", "Figura"))
+
+    def test_zero_id_is_a_valid_value(self):
+        self.assertEqual(normalize_product({"id": 0, "id_producto": 9}).id, 0)
+
+    def test_review_rating_is_parsed_and_invalid_ratings_are_none(self):
+        review = normalize_review({"id_resena": 1, "id_producto": "3", "calificacion": "4", "comentario": None})
+        self.assertEqual((review.product_key, review.rating, review.comment), ("3", 4.0, ""))
+        self.assertIsNone(normalize_review({"rating": "n/a"}).rating)
+
+    def test_payload_envelopes_and_products_without_id(self):
+        payload = {"data": [{"id": 1}, {"nombre": "sin id"}, "basura"]}
+        self.assertEqual([p.id for p in normalize_products(payload)], [1])
+        self.assertEqual(normalize_products({"results": [{"id": 2}]})[0].id, 2)
+
+    def test_groups_reviews_and_drops_orphans(self):
+        reviews = [normalize_review(r) for r in ({"product_id": 1}, {"product_id": "1"}, {"comment": "x"})]
+        grouped = group_reviews_by_product(reviews)
+        self.assertEqual(list(grouped), ["1"])
+        self.assertEqual(len(grouped["1"]), 2)
+
+
+
+
+def _payload(data):
+    return {"data": data, "content_hash": hashlib.sha256(json.dumps(data).encode()).hexdigest()}
+
+
+class AnalysisRunTestCase(FirestoreTestCase):
+    """Corridas completas con Cloud Functions y Gemini simulados."""
+
+    products = [{"id": 1, "nombre": "Goku"}, {"id": 2, "nombre": "Vegeta"}, {"id": 3, "nombre": "Sin reseñas"}]
+    reviews = [
+        {"id_producto": 1, "calificacion": 2, "comentario": "se rompió"},
+        {"id_producto": 1, "calificacion": 5, "comentario": "hermosa"},
+        {"id_producto": 2, "calificacion": 5, "comentario": "genial"},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        patches = {
+            "get_products_payload": mock.Mock(return_value=_payload(self.products)),
+            "get_reviews_payload": mock.Mock(return_value=_payload(self.reviews)),
+            "summarize_product_reviews": mock.Mock(side_effect=self.summarize),
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(analysis_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.mocks = patches
+
+    @staticmethod
+    def summarize(product, reviews, low_rating_reviews, **kwargs):
+        return {
+            "general_opinion": f"opinión de {product.name}",
+            "summary": f"quejas de {product.name}" if low_rating_reviews else None,
+        }
+
+    def analyzed_ids(self):
+        return [c.kwargs["product"].id for c in self.mocks["summarize_product_reviews"].call_args_list]
+
+
+class AnalyzeProductViewTests(AnalysisRunTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(analysis_service, "get_reviews_by_product")
+        self.reviews_by_product = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, product_id):
+        return self.client.post(f"/api/analisis/productos/{product_id}/", {}, content_type="application/json")
+
+    def test_analyzes_the_product_from_its_reviews(self):
+        self.reviews_by_product.return_value = self.reviews[:2]
+        response = self.post(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["product_id"], 1)
+        self.assertEqual(self.analyzed_ids(), [1])
+        self.reviews_by_product.assert_called_once_with(1)
+
+    def test_unknown_product_is_404_without_fetching_reviews(self):
+        self.assertEqual(self.post(99).status_code, 404)
+        self.reviews_by_product.assert_not_called()
+
+    def test_upstream_4xx_for_the_reviews_is_404(self):
+        self.reviews_by_product.side_effect = cloud_functions_client.CloudFunctionsError("404", status_code=404)
+        self.assertEqual(self.post(3).status_code, 404)
+        self.assertEqual(self.analyzed_ids(), [])
+
+    def test_upstream_5xx_is_502(self):
+        self.reviews_by_product.side_effect = cloud_functions_client.CloudFunctionsError("503", status_code=503)
+        self.assertEqual(self.post(1).status_code, 502)
+
+    def test_unreachable_catalog_is_502(self):
+        self.mocks["get_products_payload"].side_effect = cloud_functions_client.CloudFunctionsError("timeout")
+        self.assertEqual(self.post(1).status_code, 502)
+
+
+class CombinedAnalysisTests(AnalysisRunTestCase):
+
+    def test_catalog_is_fetched_once_and_gemini_called_once_per_product(self):
+        run = analysis_service.analyze_products(rating_threshold=3)
+        self.assertEqual(self.mocks["get_products_payload"].call_count, 1)
+        self.assertEqual(self.mocks["get_reviews_payload"].call_count, 1)
+        self.assertEqual(self.mocks["summarize_product_reviews"].call_count, 2)
+        self.assertEqual((run["analyzed_count"], run["total_products"]), (2, 3))
+        self.assertEqual([s["product_id"] for s in run["summaries"]], [1])
+        self.assertEqual(len(run["general_summaries"]), 2)
+
+    def test_one_merged_document_and_history_entry_per_product(self):
+        analysis_service.analyze_products(rating_threshold=3)
+        first = self.db.data(firebase_client.COLLECTION_NAME, 1)
+        self.assertEqual((first["summary"], first["general_opinion"]), ("quejas de Goku", "opinión de Goku"))
+        self.assertEqual((first["low_rating_reviews_count"], first["total_reviews"]), (1, 2))
+        self.assertIsNone(self.db.data(firebase_client.COLLECTION_NAME, 2)["summary"])
+        self.assertIsNone(self.db.data(firebase_client.COLLECTION_NAME, 3))
+        for product_id in ("1", "2"):
+            self.assertEqual(len(firebase_client.list_product_analysis_history(product_id)), 1)
+
+    def test_legacy_entry_points_use_the_same_pipeline(self):
+        analysis_service.analyze_products_with_low_ratings(3)
+        analysis_service.analyze_general_opinion_for_products()
+        self.assertEqual(self.mocks["summarize_product_reviews"].call_count, 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SummarizeProductReviewsTests(SimpleTestCase):
+    def summarize(self, response, low=True):
+        product = normalize_product({"id": 1, "nombre": "Goku"})
+        reviews = [normalize_review({"id_producto": 1, "calificacion": 1, "comentario": "mala pintura"})]
+        with mock.patch.object(gemini_client, "_API_KEY", "clave"), \
+                mock.patch.object(gemini_client, "_generate_with_deadline", return_value=response) as generate:
+            result = gemini_client.summarize_product_reviews(
+                product=product, reviews=reviews, low_rating_reviews=reviews if low else [],
+                rating_threshold=3, avg_rating=1.0, total_reviews=1,
+            )
+        self.assertEqual(generate.call_count, 1)
+        return result
+
+    def test_both_summaries_come_from_one_response(self):
+        result = self.summarize('{"general_opinion": "regular", "summary": "pintura"}')
+        self.assertEqual(result, {"general_opinion": "regular", "summary": "pintura"})
+
+    def test_summary_is_none_without_low_ratings(self):
+        result = self.summarize('{"general_opinion": "regular", "summary": "inventado"}', low=False)
+        self.assertIsNone(result["summary"])
+
+    def test_invalid_json_falls_back_to_the_offline_summary(self):
+        result = self.summarize("no es json")
+        self.assertIn("Goku", result["general_opinion"])
+        self.assertTrue(result["summary"])
+
+
+class GeminiDeadlineTests(SimpleTestCase):
+    def setUp(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.stats = gemini_client._LatencyStats()
+        for name, value in (
+            ("_API_KEY", "clave"),
+            ("_executor", executor),
+            ("_slots", threading.BoundedSemaphore(2)),
+            ("_stats", self.stats),
+            ("_DEADLINE_SECONDS", 0.05),
+        ):
+            patcher = mock.patch.object(gemini_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Las cleanups corren en orden inverso: se libera la llamada colgada y
+        # se espera a que termine (su callback usa _slots) antes de quitar los patches
+        self.addCleanup(executor.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def hang(self, prompt, timeout):
+        # Simula una llamada que no responde antes del deadline
+        self.release.wait(5)
+        return '{"general_opinion": "tarde"}'
+
+    def summarize(self):
+        product = normalize_product({"id": 1, "nombre": "Goku"})
+        reviews = [normalize_review({"id_producto": 1, "calificacion": 1, "comentario": "mala pintura"})]
+        return gemini_client.summarize_product_reviews(
+            product=product, reviews=reviews, low_rating_reviews=reviews,
+            rating_threshold=3, avg_rating=1.0, total_reviews=1,
+        )
+
+    def test_deadline_falls_back_to_the_offline_summary(self):
+        with mock.patch.object(gemini_client, "_generate", side_effect=self.hang):
+            result = self.summarize()
+        self.assertIn("Goku", result["general_opinion"])
+        self.assertEqual(self.stats.counters["deadline_exceeded"], 1)
+
+    def test_hedge_wins_when_the_primary_is_slow(self):
+        calls = []
+
+        def generate(prompt, timeout):
+            calls.append(prompt)
+            if len(calls) == 1:
+                return self.hang(prompt, timeout)
+            return '{"general_opinion": "rápida", "summary": "pintura"}'
+
+        with mock.patch.object(gemini_client, "_DEADLINE_SECONDS", 5.0), \
+                mock.patch.object(gemini_client, "_HEDGE_ENABLED", True), \
+                mock.patch.object(gemini_client, "_HEDGE_INITIAL_DELAY", 0.01), \
+                mock.patch.object(gemini_client, "_HEDGE_BUDGET", 1.0), \
+                mock.patch.object(gemini_client, "_generate", side_effect=generate):
+            result = self.summarize()
+        self.assertEqual(result, {"general_opinion": "rápida", "summary": "pintura"})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.stats.counters["hedged"], 1)
+        self.assertEqual(self.stats.counters["hedge_wins"], 1)
+
+    def test_saturated_pool_returns_offline_without_calling_gemini(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        self.addCleanup(slots.release)
+        with mock.patch.object(gemini_client, "_slots", slots), \
+                mock.patch.object(gemini_client, "_generate") as generate:
+            result = self.summarize()
+        generate.assert_not_called()
+        self.assertIn("Goku", result["general_opinion"])
+        self.assertEqual(self.stats.counters["saturated"], 1)
+
+
+def _response(status=200, body=b"", etag=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    if etag:
+        response.headers["ETag"] = etag
+    return response
+
+
+class ConditionalUpstreamTests(SimpleTestCase):
+    def setUp(self):
+        for state in (cloud_functions_client._payloads, cloud_functions_client._product_payloads, cloud_functions_client._stats):
+            patcher = mock.patch.dict(state, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(cloud_functions_client.requests, "get")
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_headers(self):
+        return self.get.call_args.kwargs["headers"]
+
+    def stats(self, path):
+        return cloud_functions_client.get_transfer_stats()[path]
+
+    def test_error_keeps_the_upstream_status(self):
+        self.get.return_value = _response(status=404)
+        with self.assertRaises(cloud_functions_client.CloudFunctionsError) as ctx:
+            cloud_functions_client.get_reviews_by_product(7)
+        self.assertEqual(ctx.exception.status_code, 404)
+        self.assertTrue(ctx.exception.is_client_error)
+
+    def test_not_modified_serves_the_stored_copy(self):
+        path = f"{cloud_functions_client.PREFIX}/resenas"
+        self.get.return_value = _response(body=b'[{"id": 1}]', etag='"v1"')
+        first = cloud_functions_client.get_reviews()
+        self.get.return_value = _response(status=304)
+        second = cloud_functions_client.get_reviews()
+        self.assertEqual(self.sent_headers()["If-None-Match"], '"v1"')
+        self.assertIs(second, first)
+        self.assertEqual(self.stats(path)["not_modified"], 1)
+        self.assertEqual(self.stats(path)["bytes_saved"], len(b'[{"id": 1}]'))
+
+    def test_same_body_without_validators_is_not_parsed_again(self):
+        path = f"{cloud_functions_client.PREFIX}/productos"
+        self.get.return_value = _response(body=b'[{"id": 1}]')
+        first = cloud_functions_client.get_products()
+        second = cloud_functions_client.get_products()
+        self.assertNotIn("If-None-Match", self.sent_headers())
+        self.assertIs(second, first)
+        self.assertEqual(self.stats(path)["hash_hits"], 1)
+
+    def test_changed_body_is_parsed(self):
+        self.get.return_value = _response(body=b"[1]", etag='"v1"')
+        cloud_functions_client.get_products()
+        self.get.return_value = _response(body=b"[2]", etag='"v2"')
+        self.assertEqual(cloud_functions_client.get_products(), [2])
+        self.get.return_value = _response(status=304)
+        self.assertEqual(cloud_functions_client.get_products(), [2])
+        self.assertEqual(self.sent_headers()["If-None-Match"], '"v2"')
+
+    def test_per_product_payloads_are_bounded(self):
+        self.get.return_value = _response(body=b"[]", etag='"v"')
+        with mock.patch.object(cloud_functions_client, "PAYLOAD_CACHE_SIZE", 2):
+            for product_id in (1, 2, 3):
+                cloud_functions_client.get_reviews_by_product(product_id)
+            cloud_functions_client.get_reviews_by_product(1)
+        self.assertNotIn("If-None-Match", self.sent_headers())
+        self.assertEqual(len(cloud_functions_client._product_payloads), 2)
+
+    def test_invalid_json_is_an_upstream_error(self):
+        self.get.return_value = _response(body=b"<html>")
+        with self.assertRaises(cloud_functions_client.CloudFunctionsError):
+            cloud_functions_client.get_products()
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_raw_json_is_passed_through_untouched(self):
+        body = b'[{"id": 1, "nombre": "Goku"}]'
+        self.assertIs(FastJSONRenderer().render(RawJSON(body)), body)
+
+    def test_renders_with_orjson_and_escapes_line_separators(self):
+        rendered = FastJSONRenderer().render({1: "a b"})
+        self.assertEqual(rendered, b'{"1":"a\\u2028b"}')
+
+    def test_indented_output_uses_the_drf_renderer(self):
+        rendered = FastJSONRenderer().render({"a": 1}, "application/json; indent=2", {})
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_none_is_an_empty_body(self):
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_resenas_forwards_the_upstream_bytes(self):
+        body = b'[{"id_resena": 1, "calificacion": 5}]'
+        with mock.patch("feedback.views_data.get_reviews_raw", return_value=body):
+            response = self.client.get("/api/resenas/")
+        self.assertEqual(response.content, body)
+
+
+@override_settings(COMPRESSION_PATH_PREFIX="/api/", COMPRESSION_MIN_BYTES=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = b'{"comentario": "' + b"muy buena figura " * 50 + b'"}'
+
+    def respond(self, path="/api/resenas/", accept="gzip, deflate, br", body=None, etag='"abc"'):
+        def get_response(request):
+            response = HttpResponse(self.body if body is None else body, content_type="application/json")
+            if etag:
+                response.headers["ETag"] = etag
+            return response
+
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(get_response)(request)
+
+    @skipIf(brotli is None, "brotli no está instalado")
+    def test_prefers_brotli(self):
+        response = self.respond()
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), self.body)
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_falls_back_to_gzip(self):
+        response = self.respond(accept="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_compressed_responses_get_a_weak_etag(self):
+        self.assertEqual(self.respond(accept="gzip")["ETag"], 'W/"abc"')
+
+    def test_small_bodies_and_other_paths_are_left_alone(self):
+        self.assertFalse(self.respond(body=b"{}").has_header("Content-Encoding"))
+        self.assertFalse(self.respond(path="/admin/").has_header("Content-Encoding"))
+
+    def test_without_accept_encoding_the_body_is_identity(self):
+        response = self.respond(accept="")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, self.body)
+        self.assertEqual(response["ETag"], '"abc"')
+
+    def test_streaming_responses_are_gzipped(self):
+        def get_response(request):
+            return StreamingHttpResponse(iter([self.body, self.body]))
+
+        request = RequestFactory().get("/api/exportar/analisis/", HTTP_ACCEPT_ENCODING="br, gzip")
+        response = CompressionMiddleware(get_response)(request)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.body * 2)
+
+
+class QueryIndexTests(SimpleTestCase):
+    def setUp(self):
+        reviews = [
+            {"id": i, "product_id": i % 2, "rating": i % 5 + 1, "comment": f"c{i}", "created_at": f"2026-01-{i + 1:02d}"}
+            for i in range(10)
+        ]
+        self.index = _build_reviews_index({"data": reviews, "content_hash": "h"})
+
+    def ids(self, result):
+        return [r["id"] for r in result["results"]]
+
+    def test_pages_by_number(self):
+        result = query_index(self.index, page=2, page_size=4)
+        self.assertEqual(self.ids(result), [4, 5, 6, 7])
+        self.assertEqual(result["count"], 10)
+
+    def test_cursor_continues_after_last_result(self):
+        first = query_index(self.index, page_size=4)
+        second = query_index(self.index, page_size=4, cursor=first["next_cursor"])
+        last = query_index(self.index, page_size=4, cursor=second["next_cursor"])
+        self.assertEqual(self.ids(second), [4, 5, 6, 7])
+        self.assertEqual(self.ids(last), [8, 9])
+        self.assertIsNone(last["next_cursor"])
+        self.assertIsNone(second["page"])
+
+    def test_cursor_round_trip_and_invalid_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+        with self.assertRaises(CatalogQueryError):
+            decode_cursor("no-es-un-cursor")
+
+    def test_filters_by_product_rating_and_date(self):
+        result = query_index(self.index, product_id=0, rating_min=3, date_from="2026-01-03", date_to="2026-01-09")
+        self.assertEqual(self.ids(result), [2, 4, 8])
+
+    def test_invalid_dates_are_rejected(self):
+        with self.assertRaises(CatalogQueryError):
+            query_index(self.index, date_from="ayer")
+
+    def test_projects_canonical_fields(self):
+        index = _build_reviews_index({"data": [{"id_resena": 1, "calificacion": 5, "comentario": "ok"}], "content_hash": "h"})
+        result = query_index(index, fields=["id", "rating"])
+        self.assertEqual(result["results"], [{"id": 1, "rating": 5}])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(query_index(self.index, page_size=10_000)["page_size"], 500)
+
+
+    def test_query_params_are_served_from_the_index(self):
+        with mock.patch("feedback.views_data.get_reviews_index", return_value=self.index), \
+                mock.patch("feedback.views_data.get_reviews_raw") as raw:
+            response = self.client.get("/api/resenas/", {"rating_min": 5, "fields": "id"})
+            invalid = self.client.get("/api/resenas/", {"cursor": "roto"})
+        self.assertEqual(response.json()["results"], [{"id": 4}, {"id": 9}])
+        self.assertEqual(invalid.status_code, 400)
+        raw.assert_not_called()
+
+
+class BudgetAndPriorityTests(AnalysisRunTestCase):
+    products = [{"id": 1, "nombre": "Goku"}, {"id": 2, "nombre": "Vegeta"}, {"id": 3, "nombre": "Gohan"}]
+    reviews = [
+        {"id_producto": 1, "calificacion": 4},
+        {"id_producto": 2, "calificacion": 1},
+        {"id_producto": 2, "calificacion": 3},
+        {"id_producto": 3, "calificacion": 5},
+        {"id_producto": 3, "calificacion": 5},
+        {"id_producto": 3, "calificacion": 4},
+    ]
+
+    def test_upstream_order_by_default(self):
+        analysis_service.analyze_products()
+        self.assertEqual(self.analyzed_ids(), [1, 2, 3])
+
+    def test_lowest_rating_first(self):
+        analysis_service.analyze_products(priority="lowest_rating")
+        self.assertEqual(self.analyzed_ids(), [2, 1, 3])
+
+    def test_most_reviews_first(self):
+        analysis_service.analyze_products(priority="most_reviews")
+        self.assertEqual(self.analyzed_ids(), [3, 2, 1])
+
+    def test_new_reviews_since_the_last_analysis_first(self):
+        previous = self.db.collection(firebase_client.COLLECTION_NAME)
+        previous.document("3").set({"total_reviews": 3})
+        previous.document("2").set({"total_reviews": 0})
+        analysis_service.analyze_products(priority="new_reviews")
+        self.assertEqual(self.analyzed_ids(), [2, 1, 3])
+
+    def test_token_budget_defers_the_rest(self):
+        with mock.patch.object(analysis_service, "estimate_tokens", return_value=100):
+            run = analysis_service.analyze_products(budget_tokens=250)
+        self.assertEqual(self.analyzed_ids(), [1, 2])
+        self.assertEqual((run["stopped_reason"], run["deferred_products"]), ("token_budget", [3]))
+        self.assertEqual(run["estimated_tokens"], 200)
+        header = self.db.data(firebase_client.RUNS_COLLECTION, run["run_id"])
+        self.assertEqual(header["deferred_count"], 1)
+
+    def test_exhausted_time_budget_stops_before_the_next_product(self):
+        run = analysis_service.analyze_products(budget_seconds=0)
+        self.assertEqual(self.analyzed_ids(), [])
+        self.assertEqual((run["stopped_reason"], run["deferred_products"]), ("time_budget", [1, 2, 3]))
+
+    def test_unknown_priority_is_rejected(self):
+        with self.assertRaises(analysis_service.AnalysisError):
+            analysis_service.analyze_products(priority="azar")
+
+
+class CheckpointResumeTests(AnalysisRunTestCase):
+    def interrupted_run(self):
+        """Corrida que se corta en el producto 2; devuelve su run_id."""
+        def fail_on_second(product, **kwargs):
+            if product.id == 2:
+                raise gemini_client.GeminiError("cuota agotada")
+            return self.summarize(product, **kwargs)
+
+        self.mocks["summarize_product_reviews"].side_effect = fail_on_second
+        with self.assertRaises(analysis_service.AnalysisError):
+            analysis_service.analyze_products()
+        self.mocks["summarize_product_reviews"].side_effect = self.summarize
+        self.mocks["summarize_product_reviews"].reset_mock()
+        (path,) = [p for p in self.db.docs if p[0] == firebase_client.CHECKPOINTS_COLLECTION and len(p) == 2]
+        return path[1]
+
+    def test_checkpoint_records_each_finished_product(self):
+        run_id = self.interrupted_run()
+        checkpoint = firebase_client.get_analysis_checkpoint(run_id)
+        self.assertEqual((checkpoint["status"], checkpoint["completed_count"]), ("running", 1))
+        self.assertEqual([e["product_id"] for e in checkpoint["products"]], [1])
+
+    def test_resume_skips_finished_products(self):
+        run_id = self.interrupted_run()
+        run = analysis_service.analyze_products(resume=True)
+        self.assertEqual(self.analyzed_ids(), [2])
+        self.assertEqual((run["run_id"], run["resumed_count"], run["analyzed_count"]), (run_id, 1, 2))
+        # El registro final incluye lo hecho antes de la interrupción
+        self.assertEqual([s["product_id"] for s in run["general_summaries"]], [1, 2])
+        self.assertEqual(firebase_client.get_analysis_checkpoint(run_id)["status"], "completed")
+        self.assertEqual(self.db.data(firebase_client.RUNS_COLLECTION, run_id)["results_count"], 2)
+
+    def test_resume_by_id_rejects_changed_input(self):
+        run_id = self.interrupted_run()
+        self.mocks["get_reviews_payload"].return_value = _payload(self.reviews[:1])
+        with self.assertRaises(analysis_service.CheckpointError):
+            analysis_service.analyze_products(resume_run_id=run_id)
+
+    def test_resume_by_id_rejects_unknown_and_finished_runs(self):
+        with self.assertRaises(analysis_service.CheckpointError):
+            analysis_service.analyze_products(resume_run_id="nada")
+        run = analysis_service.analyze_products()
+        with self.assertRaises(analysis_service.CheckpointError):
+            analysis_service.analyze_products(resume_run_id=run["run_id"])
+
+    def test_resume_without_a_pending_run_starts_a_new_one(self):
+        run = analysis_service.analyze_products(resume=True)
+        self.assertEqual(run["resumed_count"], 0)
+        self.assertEqual(self.analyzed_ids(), [1, 2])
+
+
+class CatalogMirrorTests(TestCase):
+    products = [{"id": 1, "nombre": "Goku"}, {"id": 2, "nombre": "Vegeta"}]
+    reviews = [{"id_resena": 10, "id_producto": 1, "calificacion": 4}, {"id_resena": 11, "id_producto": 2}]
+
+    def setUp(self):
+        self.payloads = {"products": _payload(self.products), "reviews": _payload(self.reviews)}
+        for name, kind in (("get_products_payload", "products"), ("get_reviews_payload", "reviews")):
+            patcher = mock.patch.object(catalog_mirror, name, side_effect=lambda kind=kind: self.payloads[kind])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def serve(self, products, reviews):
+        self.payloads = {"products": _payload(products), "reviews": _payload(reviews)}
+
+    def test_refresh_applies_only_the_difference(self):
+        catalog_mirror.refresh_catalog_mirror()
+        self.serve([{"id": 1, "nombre": "Goku SSJ"}, {"id": 3, "nombre": "Gohan"}], self.reviews)
+        stats = catalog_mirror.refresh_catalog_mirror()
+        self.assertEqual(stats["products"], {"created": 1, "updated": 1, "deleted": 1})
+        self.assertEqual(catalog_mirror.mirror_product(1).name, "Goku SSJ")
+        self.assertIsNone(catalog_mirror.mirror_product(2))
+
+    def test_empty_upstream_keeps_the_mirror(self):
+        catalog_mirror.refresh_catalog_mirror()
+        self.serve([], [])
+        with self.assertLogs(catalog_mirror.logger, "WARNING"):
+            stats = catalog_mirror.refresh_catalog_mirror()
+        self.assertEqual(stats["products"]["deleted"], 0)
+        self.assertEqual(len(catalog_mirror.mirror_payloads("products")), 2)
+        self.assertEqual(len(catalog_mirror.mirror_payloads("reviews")), 2)
+
+    def test_force_applies_an_empty_upstream(self):
+        catalog_mirror.refresh_catalog_mirror()
+        self.serve([], [])
+        stats = catalog_mirror.refresh_catalog_mirror(force=True)
+        self.assertEqual(stats["reviews"]["deleted"], 2)
+        self.assertEqual(catalog_mirror.mirror_payloads("products"), [])
+
+    @override_settings(CATALOG_SOURCE="mirror")
+    def test_plain_listings_are_served_from_the_mirror(self):
+        catalog_mirror.refresh_catalog_mirror()
+        with mock.patch("feedback.views_data.get_products_raw") as products_raw, \
+                mock.patch("feedback.views_data.get_reviews_raw") as reviews_raw:
+            products = self.client.get("/api/productos/")
+            reviews = self.client.get("/api/resenas/")
+        self.assertEqual(products.json(), self.products)
+        self.assertEqual(reviews.json(), self.reviews)
+        products_raw.assert_not_called()
+        reviews_raw.assert_not_called()
+
+
+class PagedQueryCountTests(FirestoreTestCase):
+    def test_analyses_count_matches_the_paged_query(self):
+        col = self.db.collection(firebase_client.COLLECTION_NAME)
+        for i in range(1, 4):
+            col.document(str(i)).set({"product_name": f"Figura {i}", "last_analyzed_at": f"2026-01-0{i}T00:00:00Z"})
+        # Documento sin last_analyzed_at: order_by no lo devuelve
+        col.document("9").set({"product_name": "Figura vieja"})
+        first = firebase_client.query_product_analyses(page=1, page_size=2)
+        second = firebase_client.query_product_analyses(page=2, page_size=2)
+        self.assertEqual((first["count"], second["count"]), (3, 3))
+        self.assertEqual([r["product_id"] for r in first["results"] + second["results"]], ["3", "2", "1"])
+        filtered = firebase_client.query_product_analyses("figura", page_size=10)
+        self.assertEqual(filtered["count"], len(filtered["results"]))
+        self.assertEqual([r["product_id"] for r in filtered["results"]], ["3", "2", "1"])
+
+    def test_history_count_matches_the_paged_query(self):
+        runs = self.db.collection(firebase_client.HISTORY_COLLECTION).document("1").collection("runs")
+        runs.document("a").set({"created_at": "2026-01-01T00:00:00Z"})
+        runs.document("b").set({"created_at": "2026-01-02T00:00:00Z"})
+        runs.document("c").set({"summary": "sin fecha"})
+        page = firebase_client.query_product_analysis_history(1, page_size=10)
+        self.assertEqual(page["count"], 2)
+        self.assertEqual([r["id"] for r in page["results"]], ["b", "a"])
+
+    def test_comments_count_honours_the_date_range(self):
+        comments = self.db.collection(firebase_client.COMMENTS_COLLECTION).document("1").collection("comments")
+        for day in range(1, 6):
+            comments.document(f"c{day}").set({"comment": "ok", "created_at": f"2026-01-0{day}T12:00:00.250000Z"})
+        page = firebase_client.query_product_comments(1, from_ts="2026-01-02", to_ts="2026-01-04T23:00:00", page_size=1)
+        self.assertEqual(page["count"], 3)
+        self.assertEqual([r["id"] for r in page["results"]], ["c4"])
+
+
+class MemoryCoordinatorTests(AnalysisRunTestCase):
+    products = [{"id": i, "nombre": f"Figura {i}"} for i in range(1, 7)]
+    reviews = [{"id_producto": i, "calificacion": i % 5 + 1} for i in range(1, 7)]
+
+    def setUp(self):
+        super().setUp()
+        self.coordinator = sharding.MemoryCoordinator()
+
+    def create_run(self, num_shards=3):
+        return sharding.create_sharded_run(num_shards, coordinator=self.coordinator)["run_id"]
+
+    def test_expired_lease_is_claimed_by_another_worker(self):
+        run_id = self.create_run(num_shards=1)
+        self.assertEqual(self.coordinator.claim_shard(run_id, "w1", lease_seconds=-1), 0)
+        self.assertEqual(self.coordinator.claim_shard(run_id, "w2", lease_seconds=60), 0)
+        # El worker anterior ya no puede renovar ni completar el shard
+        self.assertFalse(self.coordinator.renew_lease(run_id, 0, "w1", 60))
+        self.assertFalse(self.coordinator.complete_shard(run_id, 0, "w1"))
+        self.assertTrue(self.coordinator.complete_shard(run_id, 0, "w2"))
+        (shard,) = self.coordinator.list_shards(run_id)
+        self.assertEqual((shard["owner"], shard["attempts"]), ("w2", 2))
+
+    def test_live_lease_is_not_claimed(self):
+        run_id = self.create_run(num_shards=1)
+        self.coordinator.claim_shard(run_id, "w1", lease_seconds=60)
+        self.assertIsNone(self.coordinator.claim_shard(run_id, "w2", lease_seconds=60))
+
+    def test_reclaimed_shard_skips_products_already_saved(self):
+        run_id = self.create_run(num_shards=1)
+        # Un worker guardó dos productos y murió sin completar el shard
+        self.coordinator.claim_shard(run_id, "muerto", lease_seconds=-1)
+        for product in normalize_products(self.products[:2]):
+            entry = {"product_id": product.id, "product_name": product.name, "summary": None, "general_opinion": "ok"}
+            self.coordinator.record_entry(run_id, 0, entry)
+        result = sharding.run_shard_worker(run_id, coordinator=self.coordinator, worker_id="w2", wait=False)
+        self.assertEqual(sorted(self.analyzed_ids()), [3, 4, 5, 6])
+        self.assertTrue(result["finalized"])
+        header = self.db.data(firebase_client.RUNS_COLLECTION, run_id)
+        self.assertEqual((header["analyzed_count"], header["kind"]), (6, "sharded"))
+
+    def test_run_is_finalized_exactly_once(self):
+        run_id = self.create_run()
+        results = []
+
+        def work(worker_id):
+            results.append(
+                sharding.run_shard_worker(run_id, coordinator=self.coordinator, worker_id=worker_id, poll_seconds=0.01)
+            )
+
+        threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sum(r["finalized"] for r in results), 1)
+        self.assertEqual(sorted(self.analyzed_ids()), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.coordinator.get_run(run_id)["status"], "finalized")
+        self.assertIsNone(sharding.finalize_sharded_run(run_id, self.coordinator, "tarde"))
+
+
+class TimestampBoundTests(FirestoreTestCase):
+    def test_timestamps_always_carry_microseconds(self):
+        self.assertEqual(firebase_client._timestamp(datetime(2026, 1, 4)), "2026-01-04T00:00:00.000000Z")
+        self.assertEqual(firebase_client._iso_bound("2026-01-04T03:00:00+03:00"), "2026-01-04T00:00:00.000000Z")
+        self.assertIsNone(firebase_client._iso_bound("ayer"))
+
+    def test_bounds_are_inclusive_on_exact_timestamps(self):
+        comments = self.db.collection(firebase_client.COMMENTS_COLLECTION).document("1").collection("comments")
+        for doc_id, when in (("a", datetime(2026, 1, 4)), ("b", datetime(2026, 1, 4, 0, 0, 0, 500000))):
+            comments.document(doc_id).set({"comment": "ok", "created_at": firebase_client._timestamp(when)})
+        page = firebase_client.query_product_comments(1, from_ts="2026-01-04T00:00:00Z", to_ts="2026-01-04T00:00:00.5Z")
+        self.assertEqual([r["id"] for r in page["results"]], ["b", "a"])
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        settings_override = override_settings(PROFILING_TOKEN="secreto", PROFILING_DIR=self.dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_authorized_request_is_profiled_and_retrievable(self):
+        response = self.client.get("/api/diagnostico/gemini/?profile=1", HTTP_X_PROFILE_TOKEN="secreto")
+        profile_id = response["X-Profile-Id"]
+        detail = self.client.get(f"/api/diagnostico/perfiles/{profile_id}/", HTTP_X_PROFILE_TOKEN="secreto").json()
+        self.assertEqual((detail["kind"], detail["path"]), ("request", "/api/diagnostico/gemini/"))
+        self.assertIn("function calls", detail["stats"])
+
+    def test_unauthorized_flag_is_ignored(self):
+        response = self.client.get("/api/diagnostico/gemini/?profile=1", HTTP_X_PROFILE_TOKEN="otro")
+        self.assertFalse(response.has_header("X-Profile-Id"))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_failed_save_still_answers_the_request(self):
+        blocked = os.path.join(self.dir, "archivo")
+        open(blocked, "w").close()
+        with override_settings(PROFILING_DIR=blocked), self.assertLogs("feedback.middleware", "WARNING"):
+            response = self.client.get("/api/diagnostico/gemini/", HTTP_X_PROFILE="1", HTTP_X_PROFILE_TOKEN="secreto")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Profile-Skipped"], "save-failed")
+
+    def test_phase_report_accounts_for_the_measured_blocks(self):
+        with profiling.record_phases() as acc:
+            with profiling.phase("parse"):
+                pass
+            with profiling.phase("parse"):
+                pass
+        report = profiling.phase_report(acc, 1.0)
+        self.assertEqual(report["phases"]["parse"]["calls"], 2)
+        self.assertLessEqual(report["other_seconds"], 1.0)
+        # Fuera de record_phases, phase no mide nada
+        with profiling.phase("fetch"):
+            pass
+
+
+class AnalysisPhasesTests(AnalysisRunTestCase):
+    def test_profiled_run_reports_its_phases(self):
+        with tempfile.TemporaryDirectory() as profiles, override_settings(PROFILING_DIR=profiles):
+            run = analysis_service.analyze_products(profile=True)
+            saved = profiling.get_profile(run["phases"]["profile_id"])
+        self.assertEqual(saved["run_id"], run["run_id"])
+        self.assertGreater(run["phases"]["phases"]["firestore_write"]["calls"], 0)
+        self.assertIn("group", run["phases"]["phases"])
+
+
+class ExportTests(FirestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        products = self.db.collection(firebase_client.COMMENTS_COLLECTION)
+        for i in range(5):
+            comments = products.document(str(i % 2 + 1)).collection("comments")
+            comments.document(f"c{i}").set({
+                "id": 100 + i, "calificacion": i + 1, "comentario": f"texto {i}",
+                "created_at": f"2026-01-0{i + 1}T00:00:00.000000Z",
+            })
+        # Otra colección con una subcolección del mismo nombre no entra en la exportación
+        self.db.collection("otra").document("1").collection("comments").document("x").set(
+            {"created_at": "2026-01-09T00:00:00.000000Z"}
+        )
+
+    def test_pages_through_the_collection_group_in_date_order(self):
+        records = list(firebase_client.iter_export_records("comments", chunk_size=2))
+        self.assertEqual([r["id"] for r in records], ["c0", "c1", "c2", "c3", "c4"])
+        self.assertEqual([r["product_id"] for r in records[:2]], ["1", "2"])
+        self.assertEqual(records[0]["review_id"], 100)
+
+    def test_since_is_exclusive(self):
+        records = list(firebase_client.iter_export_records("comments", since="2026-01-03T00:00:00Z", chunk_size=2))
+        self.assertEqual([r["id"] for r in records], ["c3", "c4"])
+
+    def test_ndjson_reports_count_and_watermark(self):
+        stats = {}
+        lines = b"".join(exporter.export("comments", "ndjson", stats=stats)).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[-1])["comentario"], "texto 4")
+        self.assertEqual(stats, {"count": 5, "watermark": "2026-01-05T00:00:00.000000Z"})
+
+    def test_csv_uses_the_source_columns(self):
+        rows = list(csv.DictReader(io.StringIO(b"".join(exporter.export("comments", "csv")).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(
+            (rows[0]["id"], rows[0]["review_id"], rows[0]["rating"], rows[0]["comment"]),
+            ("c0", "100", "1.0", "texto 0"),
+        )
+
+    @skipIf(exporter.pyarrow is None, "pyarrow no está instalado")
+    def test_parquet_round_trip(self):
+        data = b"".join(exporter.export("comments", "parquet"))
+        table = exporter.pyarrow.parquet.read_table(io.BytesIO(data))
+        self.assertEqual(table.column("rating").to_pylist(), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    def test_endpoint_streams_an_attachment(self):
+        response = self.client.get("/api/exportar/comentarios/", {"fmt": "csv"})
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment", response["Content-Disposition"])
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(body.strip().splitlines()), 6)
+
+    def test_endpoint_rejects_unknown_sources_and_formats(self):
+        self.assertEqual(self.client.get("/api/exportar/usuarios/").status_code, 404)
+        self.assertEqual(self.client.get("/api/exportar/analisis/", {"fmt": "xml"}).status_code, 400)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_rejects_client_over_its_limit_with_429(self):
+        controller = AdmissionController("test", global_limit=5, per_client_limit=1, queue_size=0, queue_timeout=0)
+        with controller.admit("a"):
+            with self.assertRaises(AdmissionRejected) as ctx:
+                with controller.admit("a"):
+                    pass
+            # Otro cliente sí entra
+            with controller.admit("b"):
+                pass
+        self.assertEqual(ctx.exception.status, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+    def test_rejects_with_503_when_capacity_and_queue_are_full(self):
+        controller = AdmissionController("test", global_limit=1, per_client_limit=5, queue_size=0, queue_timeout=1)
+        with controller.admit("a"):
+            with self.assertRaises(AdmissionRejected) as ctx:
+                with controller.admit("b"):
+                    pass
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(controller.snapshot()["rejected_full"], 1)
+
+    def test_queued_request_times_out_with_503(self):
+        controller = AdmissionController("test", global_limit=1, per_client_limit=5, queue_size=1, queue_timeout=0.05)
+        with controller.admit("a"):
+            with self.assertRaises(AdmissionRejected) as ctx:
+                with controller.admit("b"):
+                    pass
+        self.assertEqual(ctx.exception.status, 503)
+        snapshot = controller.snapshot()
+        self.assertEqual((snapshot["rejected_timeout"], snapshot["waiting"]), (1, 0))
+
+    def test_queued_request_runs_when_a_slot_frees(self):
+        controller = AdmissionController("test", global_limit=1, per_client_limit=5, queue_size=1, queue_timeout=5)
+        admitted = []
+        release = threading.Event()
+
+        def hold():
+            with controller.admit("a"):
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        while controller.snapshot()["running"] == 0:
+            time.sleep(0.01)
+
+        def wait_in_queue():
+            with controller.admit("b"):
+                admitted.append(True)
+
+        waiter = threading.Thread(target=wait_in_queue)
+        waiter.start()
+        while controller.snapshot()["waiting"] == 0:
+            time.sleep(0.01)
+        release.set()
+        holder.join(5)
+        waiter.join(5)
+        self.assertEqual(admitted, [True])
+        self.assertEqual(controller.snapshot()["queued"], 1)
+
+
+
+
+@override_settings(PROXY_RATE_PER_SECOND=1, PROXY_BURST=2, CACHES=LOCMEM_CACHE, TRUSTED_PROXY_HEADER="")
+class TokenBucketThrottleTests(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.request = RequestFactory().get("/api/productos/", REMOTE_ADDR="10.0.0.1")
+        clock = mock.patch("feedback.throttling.time.time", return_value=1000.0)
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_allows_a_burst_then_throttles(self):
+        throttle = TokenBucketThrottle()
+        self.assertTrue(throttle.allow_request(self.request, None))
+        self.assertTrue(throttle.allow_request(self.request, None))
+        self.assertFalse(throttle.allow_request(self.request, None))
+        self.assertAlmostEqual(throttle.wait(), 1.0)
+
+    def test_tokens_refill_over_time(self):
+        throttle = TokenBucketThrottle()
+        for _ in range(2):
+            throttle.allow_request(self.request, None)
+        self.clock.return_value = 1001.0
+        self.assertTrue(throttle.allow_request(self.request, None))
+
+    def test_bucket_lives_in_the_shared_cache(self):
+        # Cada petición crea su throttle; otro proceso vería el mismo bucket en la caché
+        for _ in range(2):
+            TokenBucketThrottle().allow_request(self.request, None)
+        self.assertFalse(TokenBucketThrottle().allow_request(self.request, None))
+
+    def test_buckets_are_per_client(self):
+        throttle = TokenBucketThrottle()
+        for _ in range(2):
+            throttle.allow_request(self.request, None)
+        other = RequestFactory().get("/api/productos/", REMOTE_ADDR="10.0.0.2")
+        self.assertTrue(throttle.allow_request(other, None))
+
+    def test_forwarded_header_is_ignored_unless_trusted(self):
+        throttle = TokenBucketThrottle()
+        for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+            request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR=ip)
+            allowed = throttle.allow_request(request, None)
+        self.assertFalse(allowed)
+
+    @override_settings(TRUSTED_PROXY_HEADER="X-Forwarded-For")
+    def test_trusted_proxy_header_identifies_the_client(self):
+        throttle = TokenBucketThrottle()
+        for _ in range(2):
+            throttle.allow_request(RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="7.7.7.7"), None)
+        # Lo que el cliente agrega antes de la dirección del proxy no cambia su identidad
+        spoofed = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="1.2.3.4, 7.7.7.7")
+        self.assertFalse(throttle.allow_request(spoofed, None))
+        other = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="8.8.8.8")
+        self.assertTrue(throttle.allow_request(other, None))
+
+    @override_settings(PROXY_RATE_PER_SECOND=0)
+    def test_zero_rate_disables_the_limit(self):
+        throttle = TokenBucketThrottle()
+        self.assertTrue(all(throttle.allow_request(self.request, None) for _ in range(10)))
+
+
+@override_settings(PROFILING_TOKEN="secreto")
+class DiagnosticsPermissionTests(SimpleTestCase):
+    urls = ["upstream", "admision", "gemini", "perfiles"]
+
+    def test_diagnostics_require_the_profiling_token(self):
+        for name in self.urls:
+            with self.subTest(name):
+                self.assertEqual(self.client.get(f"/api/diagnostico/{name}/").status_code, 403)
+                ok = self.client.get(f"/api/diagnostico/{name}/", HTTP_X_PROFILE_TOKEN="secreto")
+                self.assertEqual(ok.status_code, 200)
+
+
+@override_settings(
+    REVIEW_EVENTS_DEBOUNCE_SECONDS=30,
+    REVIEW_EVENTS_MAX_DELAY_SECONDS=300,
+    REVIEW_EVENTS_LEASE_SECONDS=300,
+    CATALOG_SOURCE="upstream",
+)
+class ReviewEventsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(review_events, "analyze_single_product")
+        self.analyze = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def dirty(self, product_id, first_ago, last_ago, **fields):
+        now = datetime.now(timezone.utc)
+        return DirtyProduct.objects.create(
+            product_id=product_id,
+            first_event_at=now - timedelta(seconds=first_ago),
+            last_event_at=now - timedelta(seconds=last_ago),
+            event_count=1,
+            **fields,
+        )
+
+    def analyzed(self):
+        return sorted(c.args[0] for c in self.analyze.call_args_list)
+
+    def test_events_of_one_product_coalesce_into_one_row(self):
+        review_events.ingest_events([{"product_id": 1}, {"product_id": 1}, {"review": {"id_producto": 2}}])
+        review_events.ingest_events([{"product_id": 1, "type": "review.deleted"}])
+        counts = dict(DirtyProduct.objects.values_list("product_id", "event_count"))
+        self.assertEqual(counts, {"1": 3, "2": 1})
+        stats = review_events.process_dirty_products(force=True)
+        self.assertEqual(self.analyzed(), ["1", "2"])
+        self.assertEqual(stats["analyzed"], 2)
+        self.assertFalse(DirtyProduct.objects.exists())
+
+    def test_recent_events_wait_for_the_debounce(self):
+        self.dirty("1", first_ago=40, last_ago=10)
+        self.dirty("2", first_ago=40, last_ago=31)
+        review_events.process_dirty_products()
+        self.assertEqual(self.analyzed(), ["2"])
+        self.assertEqual(list(DirtyProduct.objects.values_list("product_id", flat=True)), ["1"])
+
+    def test_max_delay_wins_over_a_steady_stream_of_events(self):
+        self.dirty("1", first_ago=301, last_ago=1)
+        review_events.process_dirty_products()
+        self.assertEqual(self.analyzed(), ["1"])
+
+    def test_events_during_the_analysis_keep_the_product_dirty(self):
+        self.dirty("1", first_ago=60, last_ago=60)
+        self.analyze.side_effect = lambda product_id: review_events.mark_dirty([product_id])
+        stats = review_events.process_dirty_products()
+        self.assertEqual(stats["still_dirty"], 1)
+        row = DirtyProduct.objects.get()
+        self.assertIsNone(row.claimed_until)
+        self.assertEqual(row.event_count, 2)
+
+    def test_product_without_reviews_is_dropped(self):
+        self.dirty("1", first_ago=60, last_ago=60)
+        self.analyze.side_effect = analysis_service.ProductNotFoundError("sin reseñas")
+        stats = review_events.process_dirty_products()
+        self.assertEqual(stats["skipped"], 1)
+        self.assertFalse(DirtyProduct.objects.exists())
+
+    def test_analysis_error_backs_off(self):
+        self.dirty("1", first_ago=60, last_ago=60)
+        self.analyze.side_effect = analysis_service.AnalysisError("502")
+        review_events.process_dirty_products()
+        row = DirtyProduct.objects.get()
+        self.assertEqual((row.attempts, row.last_error), (1, "502"))
+        self.assertGreater(row.claimed_until, datetime.now(timezone.utc))
+        self.assertEqual(review_events.process_dirty_products(), {"analyzed": 0, "skipped": 0, "failed": 0, "still_dirty": 0})
+
+    def test_unexpected_error_releases_the_claim(self):
+        self.dirty("1", first_ago=60, last_ago=60)
+        self.analyze.side_effect = RuntimeError("bug")
+        with self.assertRaises(RuntimeError):
+            review_events.process_dirty_products()
+        self.assertIsNone(DirtyProduct.objects.get().claimed_until)
+
+
+class WriteSpoolTests(FirestoreTestCase, TestCase):
+    """Spool write-behind contra FakeFirestore; el hilo flusher no se arranca."""
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(
+            FIRESTORE_WRITE_BEHIND=True, FIRESTORE_SPOOL_BATCH_ROWS=2, FIRESTORE_SPOOL_FLUSH_INTERVAL=1,
+            FIRESTORE_SPOOL_MAX_BACKOFF=3,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for patcher in (
+            mock.patch.object(write_spool, "start_flusher"),
+            mock.patch.dict(write_spool._stats),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save(self, *product_ids):
+        for pid in product_ids:
+            firebase_client.save_product_analysis(pid, {"general_opinion": f"opinión {pid}"})
+
+    def test_writes_wait_in_the_spool_until_flushed(self):
+        self.save(1)
+        self.assertIsNone(self.db.data("product_analysis", 1))
+        self.assertEqual(write_spool.flush(), 1)
+        self.assertEqual(self.db.data("product_analysis", 1)["general_opinion"], "opinión 1")
+        self.assertFalse(SpooledWrite.objects.exists())
+
+    def test_rows_are_committed_in_id_order_in_batches(self):
+        self.save(1, 2, 3, 4, 5)
+        with mock.patch.object(write_spool, "apply_writes", wraps=firebase_client.apply_writes) as apply:
+            self.assertEqual(write_spool.flush(), 5)
+        batches = [[payload["product_id"] for _, payload in c.args[0]] for c in apply.call_args_list]
+        self.assertEqual(batches, [["1", "2"], ["3", "4"], ["5"]])
+        self.assertEqual(self.db.commits, [2, 2, 1])
+
+    def test_transient_error_leaves_rows_pending_and_stops(self):
+        self.save(1, 2, 3)
+        with mock.patch.object(write_spool, "apply_writes", side_effect=api_exceptions.ServiceUnavailable("caído")):
+            with self.assertRaises(api_exceptions.ServiceUnavailable):
+                write_spool.flush()
+        rows = list(SpooledWrite.objects.values_list("status", "attempts"))
+        # Sólo el primer batch se intentó; nada se adelanta al que falló
+        self.assertEqual(rows, [("pending", 1), ("pending", 1), ("pending", 0)])
+        self.assertIn("caído", SpooledWrite.objects.first().last_error)
+        self.assertEqual(write_spool.flush(), 3)
+        self.assertFalse(SpooledWrite.objects.exists())
+
+    def test_flusher_backs_off_exponentially_up_to_the_maximum(self):
+        delays = []
+
+        def sleep(seconds):
+            delays.append(seconds)
+            if len(delays) == 5:
+                raise StopIteration
+
+        with mock.patch.object(write_spool, "flush", side_effect=api_exceptions.ServiceUnavailable("caído")), \
+                mock.patch.object(write_spool.time, "sleep", side_effect=sleep), \
+                self.assertLogs("feedback.services.write_spool", "WARNING"):
+            with self.assertRaises(StopIteration):
+                write_spool._flusher_loop()
+        self.assertEqual(delays, [1, 2, 3, 3, 3])
+        self.assertEqual(write_spool._stats["consecutive_failures"], 4)
+
+    def test_permanent_error_is_dead_lettered_and_the_rest_committed(self):
+        self.save(1)
+        SpooledWrite.objects.create(kind="product_analysis", payload={"product_id": "2"})
+        self.save(3)
+        with self.assertLogs("feedback.services.write_spool", "ERROR"):
+            self.assertEqual(write_spool.flush(), 2)
+        self.assertEqual(list(SpooledWrite.objects.values_list("status", flat=True)), ["dead"])
+        self.assertIn("KeyError", SpooledWrite.objects.get().last_error)
+        self.assertIsNotNone(self.db.data("product_analysis", 1))
+        self.assertIsNotNone(self.db.data("product_analysis", 3))
+        self.assertEqual(write_spool._stats["dead"], 1)
+
+    def test_firestore_client_errors_are_permanent_except_contention(self):
+        self.assertTrue(write_spool._is_permanent(api_exceptions.InvalidArgument("x")))
+        self.assertFalse(write_spool._is_permanent(api_exceptions.TooManyRequests("x")))
+        self.assertFalse(write_spool._is_permanent(api_exceptions.Conflict("x")))
+        self.assertFalse(write_spool._is_permanent(api_exceptions.ServiceUnavailable("x")))
+
+    def test_flush_skips_while_another_process_holds_the_lease(self):
+        self.save(1)
+        SpoolFlushLease.objects.create(name=write_spool.LEASE_NAME, owner="otro", expires_at=time.time() + 60)
+        self.assertEqual(write_spool.flush(), 0)
+        self.assertEqual(SpooledWrite.objects.count(), 1)
@@ -0,0 +1,59 @@
+import math
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from .services.admission import client_id
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket por cliente: rate tokens por segundo con ráfagas de hasta
+    burst peticiones. Con rate <= 0 no limita.
+
+    Los buckets se guardan en la caché de Django, así que con una caché
+    compartida (CACHE_DIR o REDIS_CACHE_URL) el límite vale para todos los
+    procesos. Cada entrada vence sola cuando el bucket ya estaría lleno.
+    Leer y escribir el bucket no es atómico entre procesos: dos peticiones
+    simultáneas del mismo cliente en procesos distintos pueden gastar el
+    mismo token.
+
+    DRF responde 429 con Retry-After = wait().
+    """
+
+    rate_setting = "PROXY_RATE_PER_SECOND"
+    burst_setting = "PROXY_BURST"
+    cache_prefix = "throttle:proxy"
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.rate = float(getattr(settings, self.rate_setting, 0))
+        self.burst = max(float(getattr(settings, self.burst_setting, 1)), 1.0)
+        self._wait: Optional[float] = None
+
+    def allow_request(self, request, view):
+        if self.rate <= 0:
+            return True
+        key = f"{self.cache_prefix}:{client_id(request)}"
+        # Reloj de pared: el bucket lo comparten procesos distintos
+        now = time.time()
+        with type(self)._lock:
+            # (tokens disponibles, última recarga)
+            tokens, last = cache.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + max(now - last, 0.0) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            cache.set(key, (tokens, now), timeout=math.ceil(self.burst / self.rate) + 1)
+        if allowed:
+            return True
+        self._wait = (1 - tokens) / self.rate
+        return False
+
+    def wait(self):
+        return self._wait
@@ -3,6 +3,12 @@ from .views_data import (
     ProductosView,
     ResenasView,
     ResenasPorProductoView,
+    UpstreamStatsView,
+    AdmissionStatsView,
+    GeminiStatsView,
+    WriteSpoolStatsView,
+    ProfilesView,
+    ProfileDetailView,
 )
 from . import views_analysis
 
@@ -22,6 +28,22 @@ urlpatterns = [
         name="resenas-by-product",
     ),
 
+    # GET /api/diagnostico/upstream/
+    path("diagnostico/upstream/", UpstreamStatsView.as_view(), name="upstream-stats"),
+
+    # GET /api/diagnostico/admision/
+    path("diagnostico/admision/", AdmissionStatsView.as_view(), name="admission-stats"),
+
+    # GET /api/diagnostico/gemini/
+    path("diagnostico/gemini/", GeminiStatsView.as_view(), name="gemini-stats"),
+
+    # GET /api/diagnostico/spool/
+    path("diagnostico/spool/", WriteSpoolStatsView.as_view(), name="write-spool-stats"),
+
+    # GET /api/diagnostico/perfiles/
+    path("diagnostico/perfiles/", ProfilesView.as_view(), name="profiles-list"),
+    path("diagnostico/perfiles/<str:profile_id>/", ProfileDetailView.as_view(), name="profile-detail"),
+
     # --- Endpoints de análisis (Gemini + Firebase) ---
 
     # POST /api/analisis/productos/malas-calificaciones/
@@ -31,6 +53,13 @@ urlpatterns = [
         name="analisis-low-rated-products",
     ),
 
+    # POST /api/analisis/productos/<id>/
+    path(
+        "analisis/productos/<int:product_id>/",
+        views_analysis.analyze_product,
+        name="analyze-product",
+    ),
+
     # GET /api/analisis/productos/<id>/resumen/
     path(
         "analisis/productos/<int:product_id>/resumen/",
@@ -47,11 +76,36 @@ urlpatterns = [
         views_analysis.analysis_runs_list,
         name="analysis-runs-list",
     ),
+    path(
+        "analisis/runs/<str:run_id>/",
+        views_analysis.analysis_run_detail,
+        name="analysis-run-detail",
+    ),
+    path(
+        "analisis/checkpoints/<str:run_id>/",
+        views_analysis.analysis_checkpoint_detail,
+        name="analysis-checkpoint-detail",
+    ),
+    path(
+        "analisis/shards/<str:run_id>/",
+        views_analysis.sharded_run_detail,
+        name="sharded-run-detail",
+    ),
     path(
         "analisis/productos/<int:product_id>/historial/",
         views_analysis.product_analysis_history_list,
         name="product-analysis-history",
     ),
+    path(
+        "analisis/productos/<int:product_id>/tendencia/",
+        views_analysis.product_trend,
+        name="product-trend",
+    ),
+    path(
+        "analisis/tendencias/",
+        views_analysis.trend_movers,
+        name="trend-movers",
+    ),
     path(
         "comentarios/producto/<int:product_id>/",
         views_analysis.product_comments_list,
@@ -62,6 +116,11 @@ urlpatterns = [
         views_analysis.sync_product_comments,
         name="product-comments-sync",
     ),
+    path(
+        "comentarios/productos/sync/",
+        views_analysis.sync_products_comments,
+        name="products-comments-sync",
+    ),
     path(
         "opiniones/producto/<int:product_id>/resumen/",
         views_analysis.product_opinion_summary,
@@ -72,4 +131,18 @@ urlpatterns = [
         views_analysis.sync_product_opinions,
         name="product-opinions-sync",
     ),
+
+    # GET /api/exportar/<analisis|historial|comentarios>/
+    path(
+        "exportar/<str:source>/",
+        views_analysis.export_collection,
+        name="export-collection",
+    ),
+
+    # POST /api/eventos/resenas/ (Cloud Functions)
+    path(
+        "eventos/resenas/",
+        views_analysis.review_events_ingest,
+        name="review-events",
+    ),
 ]
@@ -1,3 +1,9 @@
+import functools
+from datetime import datetime
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.decorators import api_view
 from rest_framework import status
 from rest_framework.response import Response
@@ -5,49 +11,186 @@ from rest_framework.response import Response
 from .services.analysis_service import (
     analyze_products_with_low_ratings,
     AnalysisError,
+    CheckpointError,
+    ProductNotFoundError,
     analyze_general_opinion_for_products,
+    analyze_single_product,
+    PRIORITY_POLICIES,
 )
+from .services.sharding import ShardingError, get_coordinator
 from .services.firebase_client import (
     get_product_analysis,
     list_product_analyses,
     list_analysis_runs,
-    list_product_analysis_history,
+    get_analysis_run,
+    get_analysis_checkpoint,
+    query_product_analysis_history,
     list_product_comments,
     save_product_comments,
+    save_products_comments_bulk,
     query_product_analyses,
     query_product_comments,
+    get_product_trend,
+    list_trend_movers,
 )
-from .services.cloud_functions_client import get_reviews_by_product
+from .services.cloud_functions_client import get_reviews_by_product, get_all_reviews
+from .renderers import FastJSONRenderer
+from .services import admission, exporter, profiling, response_cache, review_events, trends
+from .services.records import normalize_reviews, group_reviews_by_product
 
 
-@api_view(["POST"])
-def analyze_low_rated_products(request):
+def _cached_json(request, name, parts, build, variant=()):
     """
-    POST /api/analisis/productos/malas-calificaciones/
+    Sirve una respuesta JSON pre-renderizada desde response_cache.
 
-    Body (opcional):
-    {
-        "rating_threshold": 3
-    }
+    build() devuelve (data, status) y sólo se ejecuta si no hay entrada
+    cacheada; las respuestas distintas de 200 no se cachean. Respeta
+    If-None-Match / If-Modified-Since devolviendo 304 sin tocar Firestore.
+    """
+    entry, gen = response_cache.get_entry(name, parts, variant)
+    if entry is None:
+        data, code = build()
+        if code != status.HTTP_200_OK:
+            return Response(data, status=code)
+        entry = response_cache.store_entry(name, parts, gen, FastJSONRenderer().render(data), variant)
+    response = get_conditional_response(
+        request,
+        etag=entry["etag"],
+        last_modified=entry["last_modified"],
+    )
+    if response is not None:
+        return response
+    response = HttpResponse(entry["body"], content_type="application/json")
+    response["ETag"] = entry["etag"]
+    response["Last-Modified"] = http_date(entry["last_modified"])
+    return response
+
+
+def _admitted(view):
+    """
+    Control de admisión de los endpoints pesados (corridas de análisis y
+    escrituras masivas): límite global y por cliente con cola acotada.
+    Rechaza con 429/503 y Retry-After.
     """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            with admission.heavy_controller().admit(admission.client_id(request)):
+                return view(request, *args, **kwargs)
+        except admission.AdmissionRejected as exc:
+            return Response(
+                {"detail": exc.detail},
+                status=exc.status,
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+    return wrapper
+
+
+def _rating_threshold(request):
+    """Lee rating_threshold del body. Devuelve (umbral, None) o (None, Response 400)."""
     threshold = request.data.get("rating_threshold", 3)
 
     try:
         threshold = int(threshold)
     except (TypeError, ValueError):
-        return Response(
+        return None, Response(
             {"detail": "rating_threshold debe ser un número entero."},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
     if threshold < 1 or threshold > 5:
-        return Response(
+        return None, Response(
             {"detail": "rating_threshold debe estar entre 1 y 5."},
             status=status.HTTP_400_BAD_REQUEST,
         )
+    return threshold, None
+
+
+def _run_options(request):
+    """
+    Lee budget_seconds, budget_tokens, priority, resume_run_id, resume y
+    profile del body de una corrida.
+    Devuelve (opciones, None) o (None, Response 400/403).
+    """
+    data = request.data
+    options = {}
+    for name, cast in (("budget_seconds", float), ("budget_tokens", int)):
+        value = data.get(name)
+        if value is None:
+            continue
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            return None, Response(
+                {"detail": f"{name} debe ser numérico."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if value <= 0:
+            return None, Response(
+                {"detail": f"{name} debe ser mayor que 0."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        options[name] = value
+    priority = data.get("priority")
+    if priority is not None:
+        if priority not in PRIORITY_POLICIES:
+            return None, Response(
+                {"detail": f"priority debe ser una de: {', '.join(PRIORITY_POLICIES)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        options["priority"] = priority
+    if data.get("resume_run_id"):
+        options["resume_run_id"] = str(data["resume_run_id"])
+    if data.get("resume") is not None:
+        if not isinstance(data["resume"], bool):
+            return None, Response(
+                {"detail": "resume debe ser booleano."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        options["resume"] = data["resume"]
+    if data.get("profile") is not None:
+        if not isinstance(data["profile"], bool):
+            return None, Response(
+                {"detail": "profile debe ser booleano."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if data["profile"] and not profiling.is_authorized(request):
+            return None, Response(
+                {"detail": "profile requiere X-Profile-Token o un usuario staff."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        options["profile"] = data["profile"]
+    return options, None
+
+
+@api_view(["POST"])
+@_admitted
+def analyze_low_rated_products(request):
+    """
+    POST /api/analisis/productos/malas-calificaciones/
+
+    Body (opcional):
+    {
+        "rating_threshold": 3,
+        "budget_seconds": 600,
+        "budget_tokens": 200000,
+        "priority": "new_reviews",
+        "resume_run_id": "...",
+        "profile": true
+    }
+    """
+    threshold, error = _rating_threshold(request)
+    if error is not None:
+        return error
+
+    options, error = _run_options(request)
+    if error is not None:
+        return error
 
     try:
-        result = analyze_products_with_low_ratings(threshold)
+        result = analyze_products_with_low_ratings(threshold, **options)
+    except CheckpointError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
     except AnalysisError as exc:
         return Response(
             {"detail": str(exc)},
@@ -57,6 +200,29 @@ def analyze_low_rated_products(request):
     return Response(result, status=status.HTTP_200_OK)
 
 
+@api_view(["POST"])
+@_admitted
+def analyze_product(request, product_id: int):
+    """
+    POST /api/analisis/productos/<product_id>/
+
+    Body (opcional): { "rating_threshold": 3 }
+
+    Analiza sólo este producto con sus reseñas (sin descargar el catálogo
+    completo) y actualiza su análisis e historial. Devuelve el análisis.
+    """
+    threshold, error = _rating_threshold(request)
+    if error is not None:
+        return error
+    try:
+        result = analyze_single_product(product_id, threshold)
+    except ProductNotFoundError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_404_NOT_FOUND)
+    except AnalysisError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+    return Response(result, status=status.HTTP_200_OK)
+
+
 @api_view(["GET"])
 def product_analysis_summary(request, product_id: int):
     """
@@ -64,14 +230,13 @@ def product_analysis_summary(request, product_id: int):
 
     Devuelve el análisis guardado en Firebase para un producto.
     """
-    data = get_product_analysis(product_id)
+    def build():
+        data = get_product_analysis(product_id)
+        if data is None:
+            return {"detail": "No hay análisis guardado para este producto."}, status.HTTP_404_NOT_FOUND
+        return data, status.HTTP_200_OK
 
-    if data is None:
-        return Response(
-            {"detail": "No hay análisis guardado para este producto."},
-            status=status.HTTP_404_NOT_FOUND,
-        )
-    return Response(data, status=status.HTTP_200_OK)
+    return _cached_json(request, response_cache.ANALYSIS_SUMMARY, (product_id,), build)
 
 
 @api_view(["GET"])
@@ -85,14 +250,126 @@ def product_analyses_list(request):
 
 @api_view(["GET"])
 def analysis_runs_list(request):
-    data = list_analysis_runs()
-    return Response({"count": len(data), "results": data}, status=status.HTTP_200_OK)
+    def build():
+        data = list_analysis_runs()
+        return {"count": len(data), "results": data}, status.HTTP_200_OK
+
+    return _cached_json(request, response_cache.ANALYSIS_RUNS, (), build)
+
+
+@api_view(["GET"])
+def analysis_run_detail(request, run_id: str):
+    """
+    GET /api/analisis/runs/<run_id>/
+
+    Devuelve la cabecera de la corrida y los resultados por producto.
+    """
+    def build():
+        data = get_analysis_run(run_id)
+        if data is None:
+            return {"detail": "No existe la corrida solicitada."}, status.HTTP_404_NOT_FOUND
+        return data, status.HTTP_200_OK
+
+    return _cached_json(request, response_cache.ANALYSIS_RUN_DETAIL, (run_id,), build)
+
+
+@api_view(["GET"])
+def analysis_checkpoint_detail(request, run_id: str):
+    """
+    GET /api/analisis/checkpoints/<run_id>/
+
+    Estado del checkpoint de una corrida: fingerprint, status y productos terminados.
+    """
+    data = get_analysis_checkpoint(run_id)
+    if data is None:
+        return Response({"detail": "No existe checkpoint para esta corrida."}, status=status.HTTP_404_NOT_FOUND)
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def sharded_run_detail(request, run_id: str):
+    """
+    GET /api/analisis/shards/<run_id>/
+
+    Estado de una corrida particionada: cabecera y, por shard, status, owner
+    y vencimiento del lease. El resultado combinado queda en analisis/runs/<run_id>/.
+    """
+    try:
+        coordinator = get_coordinator()
+    except ShardingError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    run = coordinator.get_run(run_id)
+    if run is None:
+        return Response({"detail": "No existe la corrida particionada."}, status=status.HTTP_404_NOT_FOUND)
+    shards = coordinator.list_shards(run_id)
+    return Response(
+        {**run, "done_count": sum(1 for s in shards if s["status"] == "done"), "shards": shards},
+        status=status.HTTP_200_OK,
+    )
 
 
 @api_view(["GET"])
 def product_analysis_history_list(request, product_id: int):
-    data = list_product_analysis_history(product_id)
-    return Response({"count": len(data), "results": data}, status=status.HTTP_200_OK)
+    page = int(request.GET.get("page", 1) or 1)
+    page_size = int(request.GET.get("page_size", 20) or 20)
+
+    def build():
+        data = query_product_analysis_history(product_id, page=page, page_size=page_size)
+        return data, status.HTTP_200_OK
+
+    return _cached_json(
+        request,
+        response_cache.ANALYSIS_HISTORY,
+        (product_id,),
+        build,
+        variant=(page, page_size),
+    )
+
+
+@api_view(["GET"])
+def product_trend(request, product_id: int):
+    """
+    GET /api/analisis/productos/<product_id>/tendencia/
+
+    Tendencia del producto sobre sus últimos análisis: promedio en la
+    ventana, deltas de calificación y de proporción de reseñas malas, y
+    reseñas nuevas por día. Se lee del estado acumulado, no del historial.
+    """
+    def build():
+        data = get_product_trend(product_id)
+        if data is None:
+            return {"detail": "No hay tendencia para este producto."}, status.HTTP_404_NOT_FOUND
+        return data, status.HTTP_200_OK
+
+    return _cached_json(request, response_cache.PRODUCT_TREND, (product_id,), build)
+
+
+@api_view(["GET"])
+def trend_movers(request):
+    """
+    GET /api/analisis/tendencias/?order=movement&limit=20
+
+    Productos con mayores cambios. order: movement (cambio absoluto de
+    calificación, por defecto), improving, worsening, low_rating_ratio o
+    velocity. limit entre 1 y 100.
+    """
+    order = request.GET.get("order", "movement")
+    if order not in trends.MOVER_ORDERS:
+        return Response(
+            {"detail": f"order debe ser uno de: {', '.join(trends.MOVER_ORDERS)}."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        return Response({"detail": "limit debe ser un número entero."}, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(max(limit, 1), 100)
+
+    def build():
+        data = list_trend_movers(order, limit)
+        return {"order": order, "count": len(data), "results": data}, status.HTTP_200_OK
+
+    return _cached_json(request, response_cache.TREND_MOVERS, (), build, variant=(order, limit))
 
 
 @api_view(["GET"])
@@ -112,23 +389,150 @@ def sync_product_comments(request, product_id: int):
         reviews = get_reviews_by_product(product_id)
     except Exception as exc:
         return Response({"detail": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
-    items = reviews if isinstance(reviews, list) else (reviews.get("results") or [])
+    items = [r.raw for r in normalize_reviews(reviews)]
     saved = save_product_comments(product_id, items)
     return Response({"product_id": product_id, "saved": saved}, status=status.HTTP_200_OK)
 
 
+@api_view(["POST"])
+@_admitted
+def sync_products_comments(request):
+    """
+    POST /api/comentarios/productos/sync/
+
+    Body (opcional):
+    {
+        "product_ids": [1, 2, 3]
+    }
+
+    Descarga todas las reseñas en una sola llamada, las agrupa por producto
+    y las guarda en Firestore. Sin product_ids sincroniza todo el catálogo;
+    los productos pedidos que no tienen reseñas vuelven con 0 en per_product.
+    """
+    product_ids = request.data.get("product_ids")
+    if product_ids is not None and not isinstance(product_ids, list):
+        return Response(
+            {"detail": "product_ids debe ser una lista."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if product_ids is not None and not product_ids:
+        # Una lista vacía no significa "todo el catálogo"
+        return Response(
+            {"detail": "product_ids no puede estar vacía; omitila para sincronizar todo el catálogo."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # Orden del pedido, sin repetidos
+    wanted = dict.fromkeys(str(pid) for pid in product_ids) if product_ids is not None else None
+
+    try:
+        reviews = get_all_reviews()
+    except Exception as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+    comments_by_product = {
+        key: [r.raw for r in product_reviews]
+        for key, product_reviews in group_reviews_by_product(normalize_reviews(reviews)).items()
+        if wanted is None or key in wanted
+    }
+
+    saved = save_products_comments_bulk(comments_by_product)
+    if wanted is not None:
+        saved = {pid: saved.get(pid, 0) for pid in wanted}
+    return Response(
+        {
+            "products": len(saved),
+            "saved": sum(saved.values()),
+            "per_product": saved,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
 @api_view(["GET"])
 def product_opinion_summary(request, product_id: int):
-    data = get_product_analysis(product_id)
-    if not data or not data.get("general_opinion"):
-        return Response({"detail": "No hay opinión general guardada para este producto."}, status=status.HTTP_404_NOT_FOUND)
-    return Response({"product_id": product_id, "product_name": data.get("product_name"), "general_opinion": data.get("general_opinion")}, status=status.HTTP_200_OK)
+    def build():
+        data = get_product_analysis(product_id)
+        if not data or not data.get("general_opinion"):
+            return {"detail": "No hay opinión general guardada para este producto."}, status.HTTP_404_NOT_FOUND
+        return {"product_id": product_id, "product_name": data.get("product_name"), "general_opinion": data.get("general_opinion")}, status.HTTP_200_OK
+
+    return _cached_json(request, response_cache.OPINION_SUMMARY, (product_id,), build)
 
 
 @api_view(["POST"])
+@_admitted
 def sync_product_opinions(request):
+    options, error = _run_options(request)
+    if error is not None:
+        return error
     try:
-        result = analyze_general_opinion_for_products()
+        result = analyze_general_opinion_for_products(**options)
+    except CheckpointError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
     except AnalysisError as exc:
         return Response({"detail": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
     return Response(result, status=status.HTTP_200_OK)
+
+
+# Nombre en la URL -> fuente de exporter
+EXPORT_URL_SOURCES = {
+    "analisis": "analyses",
+    "historial": "history",
+    "comentarios": "comments",
+}
+
+
+@api_view(["GET"])
+def export_collection(request, source: str):
+    """
+    GET /api/exportar/<analisis|historial|comentarios>/?fmt=ndjson&since=2025-01-01T00:00:00Z
+
+    Exporta la colección completa en una sola pasada, ordenada por fecha
+    ascendente y enviada por chunks. fmt: ndjson (por defecto), csv o parquet.
+    since deja sólo los documentos posteriores a esa fecha (ISO 8601).
+    ("format" no se usa porque DRF lo reserva para la negociación de contenido.)
+    """
+    if source not in EXPORT_URL_SOURCES:
+        return Response(
+            {"detail": f"Fuente desconocida; usar una de: {', '.join(EXPORT_URL_SOURCES)}."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    fmt = request.GET.get("fmt", "ndjson")
+    try:
+        chunks = exporter.export(EXPORT_URL_SOURCES[source], fmt, since=request.GET.get("since"))
+    except exporter.ExportError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(chunks, content_type=exporter.CONTENT_TYPES[fmt])
+    filename = f"{source}-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.{fmt}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(["GET", "POST"])
+def review_events_ingest(request):
+    """
+    POST /api/eventos/resenas/
+    Header: Authorization: Bearer <REVIEW_EVENTS_TOKEN> (o X-Events-Token)
+
+    Body: un evento o { "events": [...] }. Cada evento:
+      { "type": "review.created" | "review.updated" | "review.deleted",
+        "product_id": 12 }            (o "review": {...} con los campos de /resenas)
+
+    Marca los productos como pendientes y responde 202; el worker los
+    re-analiza cuando dejan de llegar eventos (ver REVIEW_EVENTS_*).
+
+    GET devuelve los productos pendientes.
+    """
+    if not review_events.is_authorized(request):
+        return Response({"detail": "Token de eventos inválido o no configurado."}, status=status.HTTP_403_FORBIDDEN)
+    if request.method == "GET":
+        return Response({"results": review_events.pending_products()}, status=status.HTTP_200_OK)
+
+    payload = request.data
+    events = payload.get("events") if isinstance(payload, dict) and "events" in payload else [payload]
+    if not isinstance(events, list) or not events:
+        return Response({"detail": "events debe ser una lista no vacía."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        result = review_events.ingest_events(events)
+    except review_events.ReviewEventError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_202_ACCEPTED)
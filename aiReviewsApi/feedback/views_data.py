@@ -1,39 +1,214 @@
+from django.http import FileResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
+from .permissions import DiagnosticsPermission
+from .renderers import RawJSON
+from .services import admission, profiling, write_spool
+from .services.gemini_client import get_latency_stats
+from .throttling import TokenBucketThrottle
+from .services.catalog_mirror import (
+    has_product_reviews,
+    mirror_payloads,
+    mirror_reviews_for_product,
+    query_mirror,
+    use_mirror,
+)
+from .services.catalog_index import (
+    CatalogQueryError,
+    get_products_index,
+    get_reviews_index,
+    query_index,
+)
 from .services.cloud_functions_client import (
-    get_products,
-    get_reviews,
-    get_reviews_by_product
+    get_products_raw,
+    get_reviews_raw,
+    get_reviews_by_product_raw,
+    get_transfer_stats,
 )
 
+# Parámetros que obligan a evaluar la consulta sobre el índice en lugar de reenviar la respuesta original
+QUERY_PARAMS = ("fields", "page", "page_size", "cursor", "rating_min", "rating_max", "from", "to")
+
+
+def _wants_query(request) -> bool:
+    return any(p in request.GET for p in QUERY_PARAMS)
+
+
+def _query_options(request, with_filters: bool) -> dict:
+    """
+    Lee fields, page/page_size/cursor y, para reseñas, rating_min/rating_max
+    y from/to. Lanza CatalogQueryError ante valores inválidos.
+    """
+    def _number(name, cast):
+        value = request.GET.get(name)
+        if value in (None, ""):
+            return None
+        try:
+            return cast(value)
+        except ValueError:
+            raise CatalogQueryError(f"{name} debe ser numérico.")
+
+    fields = [f.strip() for f in (request.GET.get("fields") or "").split(",") if f.strip()]
+    options = {
+        "fields": fields or None,
+        "page": _number("page", int) or 1,
+        "page_size": _number("page_size", int) or 20,
+        "cursor": request.GET.get("cursor") or None,
+    }
+    if with_filters:
+        options.update(
+            rating_min=_number("rating_min", float),
+            rating_max=_number("rating_max", float),
+            date_from=request.GET.get("from") or None,
+            date_to=request.GET.get("to") or None,
+        )
+    return options
+
 
 class ProductosView(APIView):
+    throttle_classes = [TokenBucketThrottle]
+
     def get(self, request):
         try:
-            data = get_products()
+            if not _wants_query(request):
+                # Con el espejo activo tampoco el listado completo depende del origen
+                data = mirror_payloads("products") if use_mirror() else RawJSON(get_products_raw())
+                return Response(data, status=status.HTTP_200_OK)
+            options = _query_options(request, with_filters=False)
+            if use_mirror():
+                data = query_mirror("products", **options)
+            else:
+                data = query_index(get_products_index(), **options)
             return Response(data, status=status.HTTP_200_OK)
+        except CatalogQueryError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
 
 class ResenasView(APIView):
+    throttle_classes = [TokenBucketThrottle]
+
     def get(self, request):
         try:
-            data = get_reviews()
+            if not _wants_query(request):
+                # Con el espejo activo tampoco el listado completo depende del origen
+                data = mirror_payloads("reviews") if use_mirror() else RawJSON(get_reviews_raw())
+                return Response(data, status=status.HTTP_200_OK)
+            options = _query_options(request, with_filters=True)
+            if use_mirror():
+                data = query_mirror("reviews", **options)
+            else:
+                data = query_index(get_reviews_index(), **options)
             return Response(data, status=status.HTTP_200_OK)
+        except CatalogQueryError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
 
 class ResenasPorProductoView(APIView):
+    throttle_classes = [TokenBucketThrottle]
+
     def get(self, request, product_id):
         try:
-            data = get_reviews_by_product(product_id)
+            options = _query_options(request, with_filters=True) if _wants_query(request) else None
+        except CatalogQueryError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if use_mirror():
+                # Lectura indexada local: no depende de la latencia ni disponibilidad del origen
+                if not has_product_reviews(product_id):
+                    raise LookupError(product_id)
+                if options is None:
+                    data = [r.raw for r in mirror_reviews_for_product(product_id)]
+                else:
+                    data = query_mirror("reviews", product_id=product_id, **options)
+                return Response(data, status=status.HTTP_200_OK)
+            if options is None:
+                data = RawJSON(get_reviews_by_product_raw(product_id))
+                return Response(data, status=status.HTTP_200_OK)
+            index = get_reviews_index()
+            if str(product_id) not in index.by_product:
+                raise LookupError(product_id)
+            data = query_index(index, product_id=product_id, **options)
             return Response(data, status=status.HTTP_200_OK)
+        except CatalogQueryError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception:
             return Response(
                 {"error": "Producto no encontrado o sin reseñas"},
                 status=status.HTTP_404_NOT_FOUND
             )
+
+
+class UpstreamStatsView(APIView):
+    """Métricas de revalidación condicional por ruta de Cloud Functions."""
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request):
+        return Response(get_transfer_stats(), status=status.HTTP_200_OK)
+
+
+class GeminiStatsView(APIView):
+    """Latencias (p50/p95/p99) y contadores de deadline y hedging de Gemini."""
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request):
+        return Response(get_latency_stats(), status=status.HTTP_200_OK)
+
+
+class AdmissionStatsView(APIView):
+    """Estado del control de admisión de los endpoints pesados (en este proceso)."""
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request):
+        return Response(admission.heavy_controller().snapshot(), status=status.HTTP_200_OK)
+
+
+class WriteSpoolStatsView(APIView):
+    """Profundidad y atraso del spool de escrituras a Firestore."""
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request):
+        return Response(write_spool.snapshot(), status=status.HTTP_200_OK)
+
+
+class ProfilesView(APIView):
+    """Perfiles guardados (peticiones con ?profile=1 y corridas con profile=true)."""
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request):
+        data = profiling.list_profiles()
+        return Response({"count": len(data), "results": data}, status=status.HTTP_200_OK)
+
+
+class ProfileDetailView(APIView):
+    """
+    Detalle de un perfil. Query: sort (columna de pstats, por defecto
+    cumulative), limit (funciones a listar) y download=1 para bajar el .prof.
+    """
+
+    permission_classes = [DiagnosticsPermission]
+
+    def get(self, request, profile_id: str):
+        if request.GET.get("download"):
+            path = profiling.profile_stats_path(profile_id)
+            if path is None:
+                return Response({"detail": "El perfil no tiene estadísticas de cProfile."}, status=status.HTTP_404_NOT_FOUND)
+            return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
+        try:
+            limit = int(request.GET.get("limit", 40))
+        except ValueError:
+            return Response({"detail": "limit debe ser un número entero."}, status=status.HTTP_400_BAD_REQUEST)
+        data = profiling.get_profile(profile_id, sort=request.GET.get("sort", "cumulative"), limit=limit)
+        if data is None:
+            return Response({"detail": "No existe el perfil."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data, status=status.HTTP_200_OK)